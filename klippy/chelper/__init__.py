@@ -18,7 +18,7 @@ COMPILE_ARGS = ("-Wall -g -O2 -shared -fPIC"
 SSE_FLAGS = "-mfpmath=sse -msse2"
 SOURCE_FILES = [
     'pyhelper.c', 'serialqueue.c', 'stepcompress.c', 'itersolve.c', 'trapq.c',
-    'pollreactor.c', 'msgblock.c', 'trdispatch.c',
+    'pollreactor.c', 'msgblock.c', 'trdispatch.c', 'lookahead.c',
     'kin_cartesian.c', 'kin_corexy.c', 'kin_corexz.c', 'kin_delta.c',
     'kin_deltesian.c', 'kin_polar.c', 'kin_rotary_delta.c', 'kin_winch.c',
     'kin_extruder.c', 'kin_shaper.c', 'kin_idex.c',
@@ -103,6 +103,20 @@ defs_trapq = """
         , double start_time, double end_time);
 """
 
+defs_lookahead = """
+    struct lookahead_queue *lookahead_alloc(void);
+    void lookahead_free(struct lookahead_queue *lq);
+    void lookahead_reset(struct lookahead_queue *lq);
+    int lookahead_add_move(struct lookahead_queue *lq, double move_d
+        , double accel, double junction_deviation
+        , double axes_r_x, double axes_r_y, double axes_r_z
+        , int is_kinematic_move, double max_cruise_v2
+        , double delta_v2, double smooth_delta_v2, double extruder_v2);
+    void lookahead_limit_next_junction(struct lookahead_queue *lq
+        , double v2);
+    int lookahead_flush(struct lookahead_queue *lq, int lazy, double *out);
+"""
+
 defs_kin_cartesian = """
     struct stepper_kinematics *cartesian_stepper_alloc(char axis);
 """
@@ -220,7 +234,7 @@ defs_std = """
 
 defs_all = [
     defs_pyhelper, defs_serialqueue, defs_std, defs_stepcompress,
-    defs_itersolve, defs_trapq, defs_trdispatch,
+    defs_itersolve, defs_trapq, defs_trdispatch, defs_lookahead,
     defs_kin_cartesian, defs_kin_corexy, defs_kin_corexz, defs_kin_delta,
     defs_kin_deltesian, defs_kin_polar, defs_kin_rotary_delta, defs_kin_winch,
     defs_kin_extruder, defs_kin_shaper, defs_kin_idex,
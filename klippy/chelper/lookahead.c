@@ -0,0 +1,255 @@
+// Toolhead lookahead junction velocity planning
+//
+// Copyright (C) 2016-2024  Kevin O'Connor <kevin@koconnor.net>
+//
+// This file may be distributed under the terms of the GNU GPLv3 license.
+
+#include <math.h> // sqrt
+#include <stdlib.h> // realloc
+#include <string.h> // memmove
+#include "compiler.h" // __visible
+#include "pyhelper.h" // errorf
+
+// Common suffixes: _d is distance (in mm), _v is velocity (in
+//   mm/second), _v2 is velocity squared (mm^2/s^2), _t is time (in
+//   seconds), _r is ratio (scalar between 0.0 and 1.0)
+
+struct lookahead_move {
+    double move_d, accel, junction_deviation, axes_r[3];
+    int is_kinematic_move;
+    // Junction speeds are tracked in velocity squared
+    double max_start_v2, max_cruise_v2, delta_v2;
+    double max_smoothed_v2, smooth_delta_v2, next_junction_v2;
+    // Temporary storage for moves delayed during a flush
+    double delayed_start_v2, delayed_end_v2;
+};
+
+struct lookahead_queue {
+    struct lookahead_move *moves;
+    int count, size;
+};
+
+static inline double
+dmin(double a, double b)
+{
+    return a < b ? a : b;
+}
+
+static inline double
+dmax(double a, double b)
+{
+    return a > b ? a : b;
+}
+
+// Allocate a new 'lookahead_queue' object
+struct lookahead_queue * __visible
+lookahead_alloc(void)
+{
+    struct lookahead_queue *lq = malloc(sizeof(*lq));
+    memset(lq, 0, sizeof(*lq));
+    return lq;
+}
+
+// Free memory associated with a 'lookahead_queue' object
+void __visible
+lookahead_free(struct lookahead_queue *lq)
+{
+    if (!lq)
+        return;
+    free(lq->moves);
+    free(lq);
+}
+
+// Remove all pending moves
+void __visible
+lookahead_reset(struct lookahead_queue *lq)
+{
+    lq->count = 0;
+}
+
+// Determine the maximum start velocity of a move given the previous move
+static void
+calc_junction(struct lookahead_move *m, struct lookahead_move *pm
+              , double extruder_v2)
+{
+    if (!m->is_kinematic_move || !pm->is_kinematic_move)
+        return;
+    double max_start_v2 = dmin(extruder_v2, m->max_cruise_v2);
+    max_start_v2 = dmin(max_start_v2, pm->max_cruise_v2);
+    max_start_v2 = dmin(max_start_v2, pm->next_junction_v2);
+    max_start_v2 = dmin(max_start_v2, pm->max_start_v2 + pm->delta_v2);
+    // Find max velocity using "approximated centripetal velocity"
+    double junction_cos_theta = -(m->axes_r[0] * pm->axes_r[0]
+                                  + m->axes_r[1] * pm->axes_r[1]
+                                  + m->axes_r[2] * pm->axes_r[2]);
+    double sin_theta_d2 = sqrt(dmax(0.5*(1.0-junction_cos_theta), 0.));
+    double cos_theta_d2 = sqrt(dmax(0.5*(1.0+junction_cos_theta), 0.));
+    double one_minus_sin_theta_d2 = 1. - sin_theta_d2;
+    if (one_minus_sin_theta_d2 > 0. && cos_theta_d2 > 0.) {
+        double R_jd = sin_theta_d2 / one_minus_sin_theta_d2;
+        double move_jd_v2 = R_jd * m->junction_deviation * m->accel;
+        double pmove_jd_v2 = R_jd * pm->junction_deviation * pm->accel;
+        // Approximated circle must contact moves no further than mid-move
+        //   centripetal_v2 = .5 * move_d * accel * tan_theta_d2
+        double quarter_tan_theta_d2 = .25 * sin_theta_d2 / cos_theta_d2;
+        double move_centripetal_v2 = m->delta_v2 * quarter_tan_theta_d2;
+        double pmove_centripetal_v2 = pm->delta_v2 * quarter_tan_theta_d2;
+        max_start_v2 = dmin(max_start_v2, move_jd_v2);
+        max_start_v2 = dmin(max_start_v2, pmove_jd_v2);
+        max_start_v2 = dmin(max_start_v2, move_centripetal_v2);
+        max_start_v2 = dmin(max_start_v2, pmove_centripetal_v2);
+    }
+    // Apply limits
+    m->max_start_v2 = max_start_v2;
+    m->max_smoothed_v2 = dmin(
+        max_start_v2, pm->max_smoothed_v2 + pm->smooth_delta_v2);
+}
+
+// Add a move to the end of the queue and calculate its junction limits
+int __visible
+lookahead_add_move(struct lookahead_queue *lq, double move_d, double accel
+                   , double junction_deviation
+                   , double axes_r_x, double axes_r_y, double axes_r_z
+                   , int is_kinematic_move, double max_cruise_v2
+                   , double delta_v2, double smooth_delta_v2
+                   , double extruder_v2)
+{
+    if (lq->count >= lq->size) {
+        int new_size = lq->size ? lq->size * 2 : 64;
+        struct lookahead_move *moves = realloc(
+            lq->moves, new_size * sizeof(*moves));
+        if (!moves) {
+            errorf("lookahead_add_move: out of memory");
+            return -1;
+        }
+        lq->moves = moves;
+        lq->size = new_size;
+    }
+    struct lookahead_move *m = &lq->moves[lq->count++];
+    m->move_d = move_d;
+    m->accel = accel;
+    m->junction_deviation = junction_deviation;
+    m->axes_r[0] = axes_r_x;
+    m->axes_r[1] = axes_r_y;
+    m->axes_r[2] = axes_r_z;
+    m->is_kinematic_move = is_kinematic_move;
+    m->max_start_v2 = 0.;
+    m->max_cruise_v2 = max_cruise_v2;
+    m->delta_v2 = delta_v2;
+    m->max_smoothed_v2 = 0.;
+    m->smooth_delta_v2 = smooth_delta_v2;
+    m->next_junction_v2 = 999999999.9;
+    if (lq->count > 1)
+        calc_junction(m, m - 1, extruder_v2);
+    return 0;
+}
+
+// Limit the velocity at the junction following the last queued move
+void __visible
+lookahead_limit_next_junction(struct lookahead_queue *lq, double v2)
+{
+    if (!lq->count)
+        return;
+    struct lookahead_move *m = &lq->moves[lq->count - 1];
+    m->next_junction_v2 = dmin(m->next_junction_v2, v2);
+}
+
+// Determine accel, cruise, and decel portions of a move.  Results are
+// stored as start_v, cruise_v, end_v, accel_t, cruise_t, decel_t.
+static void
+set_junction(struct lookahead_move *m, double *out
+             , double start_v2, double cruise_v2, double end_v2)
+{
+    // Determine accel, cruise, and decel portions of the move distance
+    double half_inv_accel = .5 / m->accel;
+    double accel_d = (cruise_v2 - start_v2) * half_inv_accel;
+    double decel_d = (cruise_v2 - end_v2) * half_inv_accel;
+    double cruise_d = m->move_d - accel_d - decel_d;
+    // Determine move velocities
+    double start_v = sqrt(start_v2);
+    double cruise_v = sqrt(cruise_v2);
+    double end_v = sqrt(end_v2);
+    out[0] = start_v;
+    out[1] = cruise_v;
+    out[2] = end_v;
+    // Determine time spent in each portion of move (time is the
+    // distance divided by average velocity)
+    out[3] = accel_d / ((start_v + cruise_v) * 0.5);
+    out[4] = cruise_d / cruise_v;
+    out[5] = decel_d / ((end_v + cruise_v) * 0.5);
+}
+
+// Calculate junction velocities for the queued moves and remove the
+// moves that are ready to be processed.  The velocities and times of
+// the removed moves are stored in 'out' (six values per move).
+// Returns the number of moves removed from the queue.
+int __visible
+lookahead_flush(struct lookahead_queue *lq, int lazy, double *out)
+{
+    struct lookahead_move *moves = lq->moves;
+    int update_flush_count = lazy;
+    int flush_count = lq->count;
+    // Traverse queue from last to first move and determine maximum
+    // junction speed assuming the robot comes to a complete stop
+    // after the last move.
+    int delayed = 0;
+    double next_end_v2 = 0., next_smoothed_v2 = 0., peak_cruise_v2 = 0.;
+    int i;
+    for (i = flush_count - 1; i >= 0; i--) {
+        struct lookahead_move *m = &moves[i];
+        double reachable_start_v2 = next_end_v2 + m->delta_v2;
+        double start_v2 = dmin(m->max_start_v2, reachable_start_v2);
+        double reachable_smoothed_v2 = next_smoothed_v2 + m->smooth_delta_v2;
+        double smoothed_v2 = dmin(m->max_smoothed_v2, reachable_smoothed_v2);
+        if (smoothed_v2 < reachable_smoothed_v2) {
+            // It's possible for this move to accelerate
+            if (smoothed_v2 + m->smooth_delta_v2 > next_smoothed_v2
+                || delayed) {
+                // This move can decelerate or this is a full accel
+                // move after a full decel move
+                if (update_flush_count && peak_cruise_v2) {
+                    flush_count = i;
+                    update_flush_count = 0;
+                }
+                peak_cruise_v2 = dmin(m->max_cruise_v2, (
+                    smoothed_v2 + reachable_smoothed_v2) * .5);
+                if (delayed) {
+                    // Propagate peak_cruise_v2 to any delayed moves
+                    if (!update_flush_count && i < flush_count) {
+                        double mc_v2 = peak_cruise_v2;
+                        int j;
+                        for (j = i + 1; j <= i + delayed; j++) {
+                            struct lookahead_move *dm = &moves[j];
+                            double ms_v2 = dm->delayed_start_v2;
+                            double me_v2 = dm->delayed_end_v2;
+                            mc_v2 = dmin(mc_v2, ms_v2);
+                            set_junction(dm, &out[j * 6], dmin(ms_v2, mc_v2)
+                                         , mc_v2, dmin(me_v2, mc_v2));
+                        }
+                    }
+                    delayed = 0;
+                }
+            }
+            if (!update_flush_count && i < flush_count) {
+                double cruise_v2 = (start_v2 + reachable_start_v2) * .5;
+                cruise_v2 = dmin(cruise_v2, m->max_cruise_v2);
+                cruise_v2 = dmin(cruise_v2, peak_cruise_v2);
+                set_junction(m, &out[i * 6], dmin(start_v2, cruise_v2)
+                             , cruise_v2, dmin(next_end_v2, cruise_v2));
+            }
+        } else {
+            // Delay calculating this move until peak_cruise_v2 is known
+            m->delayed_start_v2 = start_v2;
+            m->delayed_end_v2 = next_end_v2;
+            delayed++;
+        }
+        next_end_v2 = start_v2;
+        next_smoothed_v2 = smoothed_v2;
+    }
+    if (update_flush_count || !flush_count)
+        return 0;
+    // Remove processed moves from the queue
+    lq->count -= flush_count;
+    memmove(moves, &moves[flush_count], lq->count * sizeof(*moves));
+    return flush_count;
+}
@@ -472,6 +472,7 @@ class PrinterConfig:
         self.deprecate_warnings = []
         self.status_raw_config = {}
         self.status_warnings = []
+        self.status_version = 0
     def get_printer(self):
         return self.printer
     def read_config(self, filename):
@@ -495,12 +496,14 @@ class PrinterConfig:
         self.printer.set_rollover_info("config", "\n".join(lines))
     def check_unused_options(self, config):
         self.validate.check_unused(config.fileconfig)
+        self.status_version += 1
     # Deprecation warnings
     def runtime_warning(self, msg):
         logging.warning(msg)
         res = {'type': 'runtime_warning', 'message': msg}
         self.runtime_warnings.append(res)
         self.status_warnings = self.runtime_warnings + self.deprecate_warnings
+        self.status_version += 1
     def deprecate(self, section, option, value=None, msg=None):
         key = (section, option, value)
         if key in self.deprecated and self.deprecated[key] == msg:
@@ -517,6 +520,7 @@ class PrinterConfig:
             res['option'] = option
             self.deprecate_warnings.append(res)
         self.status_warnings = self.runtime_warnings + self.deprecate_warnings
+        self.status_version += 1
     # Status reporting
     def _build_status_config(self, config):
         self.status_raw_config = {}
@@ -524,6 +528,9 @@ class PrinterConfig:
             self.status_raw_config[section.get_name()] = section_status = {}
             for option in section.get_prefix_options(''):
                 section_status[option] = section.get(option, note_valid=False)
+        self.status_version += 1
+    def get_status_version(self):
+        return self.status_version
     def get_status(self, eventtime):
         status = {'config': self.status_raw_config,
                   'warnings': self.status_warnings}
@@ -533,5 +540,7 @@ class PrinterConfig:
     # Autosave functions
     def set(self, section, option, value):
         self.autosave.set(section, option, value)
+        self.status_version += 1
     def remove_section(self, section):
         self.autosave.remove_section(section)
+        self.status_version += 1
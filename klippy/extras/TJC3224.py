@@ -1,5 +1,6 @@
 import time
 import math
+import collections
 
 class TJC3224_LCD:
     """
@@ -19,8 +20,10 @@ class TJC3224_LCD:
 
     # Data frame structure
     data_frame_head = b"\xAA"
-    data_frame_tail = [0xCC, 0x33, 0xC3, 0x3C]
-    data_frame = []
+    data_frame_tail = b"\xCC\x33\xC3\x3C"
+
+    # Transmit pacing (bytes per serial_bridge_send message)
+    tx_chunk_size = 40
 
     # Font size registers (for unicode and 8 bit text mode)
     font_8x8 = 0x00
@@ -56,15 +59,29 @@ class TJC3224_LCD:
     direction_up = 0x02
     direction_down = 0x03
 
-    def __init__(self, serial):
+    def __init__(self, serial, reactor=None, baud=115200):
         """
         Initializes the TJC3224_LCD object.
 
         Args:
             serial : Serial object to send messages.
+            reactor : Reactor used to pace transmission. When None, frames
+                are written to the serial object as soon as they are sent.
+            baud : Baud rate of the display link, used for pacing.
         """
         self.serial = serial
-    
+        self.reactor = reactor
+        self.baud = baud
+        self.data_frame = bytearray(self.data_frame_head)
+        # Command batching
+        self.batch_depth = 0
+        self.pending = bytearray()
+        self.tx_queue = collections.deque()
+        self.tx_timer = None
+        if reactor is not None:
+            self.tx_timer = reactor.register_timer(self._transmit_event)
+
+
     def init_display(self):
         print("Sending handshake... ")
         while not self.handshake():
@@ -120,18 +137,76 @@ class TJC3224_LCD:
         """
         Sends the prepared data frame to the display according to the T5L_TA serial protocol.
 
-        Sends the current contents of the data frame, followed by a predefined
-        tail sequence. After sending, the data frame is reset to the head sequence.
+        Queues the current contents of the data frame, followed by a predefined
+        tail sequence. After queuing, the data frame is reset to the head
+        sequence. Outside of a batch the frame is flushed immediately, inside
+        a batch it is held until the outermost end_batch() call.
         """
-        # Write the current data frame and tail sequence to the serial connection
-        self.serial.write(self.data_frame)
-        self.serial.write(self.data_frame_tail)
+        self.pending += self.data_frame
+        self.pending += self.data_frame_tail
 
         # Reset the data frame to the head sequence for the next transmission
-        self.data_frame = self.data_frame_head
+        self.data_frame = bytearray(self.data_frame_head)
+
+        if not self.batch_depth:
+            self.flush()
+
+    def begin_batch(self):
+        """
+        Start gathering frames into a single buffer.
+
+        Calls may be nested, frames are only flushed when the outermost
+        batch is closed with end_batch().
+        """
+        self.batch_depth += 1
+
+    def end_batch(self):
+        """
+        Close a batch started with begin_batch() and flush the gathered frames.
+        """
+        if self.batch_depth:
+            self.batch_depth -= 1
+        if not self.batch_depth:
+            self.flush()
+
+    def flush(self):
+        """
+        Hand all pending frames to the serial bridge.
+
+        With a reactor the buffer is split into bridge sized chunks that are
+        written from a reactor timer, paced at the display baud rate so the
+        bridge transmit buffer on the mcu is not overrun.
+        """
+        if not self.pending:
+            return
+        data = bytes(self.pending)
+        self.pending = bytearray()
+        if self.reactor is None:
+            self.serial.write(data)
+            return
+        was_idle = not self.tx_queue
+        for i in range(0, len(data), self.tx_chunk_size):
+            self.tx_queue.append(data[i:i + self.tx_chunk_size])
+        if was_idle:
+            self.reactor.update_timer(self.tx_timer, self.reactor.NOW)
+
+    def discard_pending(self):
+        """
+        Drop all queued and batched frames (eg, on mcu disconnect).
+        """
+        self.pending = bytearray()
+        self.tx_queue.clear()
+        self.batch_depth = 0
 
-        # Delay to allow for proper transmission
-        time.sleep(0.001)
+    def _transmit_event(self, eventtime):
+        if not self.tx_queue:
+            return self.reactor.NEVER
+        chunk = self.tx_queue.popleft()
+        self.serial.write(chunk)
+        if not self.tx_queue:
+            return self.reactor.NEVER
+        # 10 bits per byte on the wire (8N1)
+        return eventtime + len(chunk) * 10. / self.baud
 
     def handshake(self):
         """
@@ -39,6 +39,13 @@ class AccelQueryHelper:
         self.request_start_time = self.request_end_time = print_time
         self.msgs = []
         self.samples = []
+        self.numpy = self.sample_cb = None
+        self.stream_count = 0
+    def stream_samples(self, np, sample_cb):
+        # Pass each batch of samples to sample_cb() as an (N, 4) array
+        # instead of storing them
+        self.numpy = np
+        self.sample_cb = sample_cb
     def finish_measurements(self):
         toolhead = self.printer.lookup_object('toolhead')
         self.request_end_time = toolhead.get_last_move_time()
@@ -47,12 +54,21 @@ class AccelQueryHelper:
     def handle_batch(self, msg):
         if self.is_finished:
             return False
+        if self.sample_cb is not None:
+            data = self.numpy.array(msg['data'], dtype=float).reshape(-1, 4)
+            data = data[data[:,0] >= self.request_start_time]
+            if len(data):
+                self.stream_count += len(data)
+                self.sample_cb(data)
+            return True
         if len(self.msgs) >= 10000:
             # Avoid filling up memory with too many samples
             return False
         self.msgs.append(msg)
         return True
     def has_valid_samples(self):
+        if self.sample_cb is not None:
+            return self.stream_count > 0
         for msg in self.msgs:
             data = msg['data']
             first_sample_time = data[0][0]
@@ -85,6 +101,16 @@ class AccelQueryHelper:
                 count += 1
         del samples[count:]
         return self.samples
+    def get_sample_array(self, np):
+        # Return the samples as an (N, 4) array of (time, x, y, z)
+        datas = [np.array(m['data'], dtype=float).reshape(-1, 4)
+                 for m in self.msgs]
+        if not datas:
+            return np.zeros((0, 4))
+        data = np.concatenate(datas)
+        times = data[:,0]
+        return data[(times >= self.request_start_time)
+                    & (times <= self.request_end_time)]
     def write_to_file(self, filename):
         def write_impl():
             try:
@@ -184,6 +210,17 @@ def read_axes_map(config, scale_x, scale_y, scale_z):
         raise config.error("Invalid axes_map parameter")
     return [am[a.strip()] for a in axes_map]
 
+# Helper to convert raw (x, y, z) sample rows to accelerations (using
+# numpy arrays from FixedFreqReader.pull_sample_array)
+def convert_accel_array(np, times, raw_xyz, axes_map):
+    (x_pos, x_scale), (y_pos, y_scale), (z_pos, z_scale) = axes_map
+    out = np.empty((len(times), 4))
+    out[:,0] = times
+    out[:,1] = raw_xyz[:,x_pos] * x_scale
+    out[:,2] = raw_xyz[:,y_pos] * y_scale
+    out[:,3] = raw_xyz[:,z_pos] * z_scale
+    return np.round(out, 6).tolist()
+
 BATCH_UPDATES = 0.100
 
 # Printer class that controls ADXL345 chip
@@ -216,7 +253,8 @@ class ADXL345:
         self.name = config.get_name().split()[-1]
         hdr = ('time', 'x_acceleration', 'y_acceleration', 'z_acceleration')
         self.batch_bulk.add_mux_endpoint("adxl345/dump_adxl345", "sensor",
-                                         self.name, {'header': hdr})
+                                         self.name, {'header': hdr},
+                                         binary_format='<dfff')
     def _build_config(self):
         cmdqueue = self.spi.get_command_queue()
         self.query_adxl345_cmd = self.mcu.lookup_command(
@@ -259,6 +297,17 @@ class ADXL345:
             samples[count] = (round(ptime, 6), x, y, z)
             count += 1
         del samples[count:]
+    def _convert_sample_array(self, np, times, values):
+        values = values.astype(np.int32)
+        xlow, ylow, zlow, xzhigh, yzhigh = values.T
+        valid = (yzhigh & 0x80) == 0
+        self.last_error_count += len(valid) - int(np.count_nonzero(valid))
+        rx = (xlow | ((xzhigh & 0x1f) << 8)) - ((xzhigh & 0x10) << 9)
+        ry = (ylow | ((yzhigh & 0x1f) << 8)) - ((yzhigh & 0x10) << 9)
+        rz = ((zlow | ((xzhigh & 0xe0) << 3) | ((yzhigh & 0xe0) << 6))
+              - ((yzhigh & 0x40) << 7))
+        raw_xyz = np.column_stack((rx, ry, rz))[valid]
+        return convert_accel_array(np, times[valid], raw_xyz, self.axes_map)
     # Start, stop, and process message batches
     def _start_measurements(self):
         # In case of miswiring, testing ADXL345 device ID prevents treating
@@ -291,8 +340,13 @@ class ADXL345:
         self.ffreader.note_end()
         logging.info("ADXL345 finished '%s' measurements", self.name)
     def _process_batch(self, eventtime):
-        samples = self.ffreader.pull_samples()
-        self._convert_samples(samples)
+        np = self.ffreader.get_numpy()
+        if np is not None:
+            samples = self._convert_sample_array(
+                np, *self.ffreader.pull_sample_array())
+        else:
+            samples = self.ffreader.pull_samples()
+            self._convert_samples(samples)
         if not samples:
             return {}
         return {'data': samples, 'errors': self.last_error_count,
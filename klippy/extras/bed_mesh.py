@@ -3,7 +3,7 @@
 # Copyright (C) 2018-2019 Eric Callahan <arksine.code@gmail.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, math, json, collections
+import logging, math, json, collections, os, struct, zlib
 from . import probe
 
 PROFILE_VERSION = 1
@@ -12,6 +12,8 @@ PROFILE_OPTIONS = {
     'x_count': int, 'y_count': int, 'mesh_x_pps': int, 'mesh_y_pps': int,
     'algo': str, 'tension': float
 }
+PROFILE_FILE_MAGIC = b"KBEDMESH"
+PROFILE_FILE_VERSION = 1
 
 class BedMeshError(Exception):
     pass
@@ -130,6 +132,7 @@ class BedMesh:
         gcode_move = self.printer.load_object(config, 'gcode_move')
         gcode_move.set_move_transform(self)
         # initialize status dict
+        self.status_version = 0
         self.update_status()
     def handle_connect(self):
         self.toolhead = self.printer.lookup_object('toolhead')
@@ -204,30 +207,40 @@ class BedMesh:
             final_z_adj = factor * z_adj + self.fade_target
             self.last_position[:] = [x, y, z - final_z_adj, e]
         return list(self.last_position)
+    def _split_moves(self, moves):
+        # Apply the mesh to a sequence of (newpos, speed) moves
+        for newpos, speed in moves:
+            factor = self.get_z_factor(newpos[2])
+            if self.z_mesh is None or not factor:
+                # No mesh calibrated, or mesh leveling phased out.
+                x, y, z, e = newpos
+                if self.log_fade_complete:
+                    self.log_fade_complete = False
+                    logging.info(
+                        "bed_mesh fade complete: Current Z: %.4f "
+                        "fade_target: %.4f " % (z, self.fade_target))
+                yield [x, y, z + self.fade_target, e], speed
+            else:
+                self.splitter.build_move(self.last_position, newpos, factor)
+                while not self.splitter.traverse_complete:
+                    split_move = self.splitter.split()
+                    if split_move:
+                        yield split_move, speed
+                    else:
+                        raise self.gcode.error(
+                            "Mesh Leveling: Error splitting move ")
+            self.last_position[:] = newpos
     def move(self, newpos, speed):
-        factor = self.get_z_factor(newpos[2])
-        if self.z_mesh is None or not factor:
-            # No mesh calibrated, or mesh leveling phased out.
-            x, y, z, e = newpos
-            if self.log_fade_complete:
-                self.log_fade_complete = False
-                logging.info(
-                    "bed_mesh fade complete: Current Z: %.4f fade_target: %.4f "
-                    % (z, self.fade_target))
-            self.toolhead.move([x, y, z + self.fade_target, e], speed)
-        else:
-            self.splitter.build_move(self.last_position, newpos, factor)
-            while not self.splitter.traverse_complete:
-                split_move = self.splitter.split()
-                if split_move:
-                    self.toolhead.move(split_move, speed)
-                else:
-                    raise self.gcode.error(
-                        "Mesh Leveling: Error splitting move ")
-        self.last_position[:] = newpos
+        for split_move, split_speed in self._split_moves([(newpos, speed)]):
+            self.toolhead.move(split_move, split_speed)
+    def move_batch(self, moves):
+        self.toolhead.move_batch(self._split_moves(moves))
     def get_status(self, eventtime=None):
         return self.status
+    def get_status_version(self):
+        return self.status_version
     def update_status(self):
+        self.status_version += 1
         self.status = {
             "profile_name": "",
             "mesh_min": (0., 0.),
@@ -291,7 +304,7 @@ class BedMesh:
         eventtime = self.printer.get_reactor().monotonic()
         prb = self.printer.lookup_object("probe", None)
         th_sts = self.printer.lookup_object("toolhead").get_status(eventtime)
-        result = {"current_mesh": {}, "profiles": self.pmgr.get_profiles()}
+        result = {"current_mesh": {}, "profiles": self.pmgr.dump_profiles()}
         if self.z_mesh is not None:
             result["current_mesh"] = {
                 "name": self.z_mesh.get_profile_name(),
@@ -1257,59 +1270,185 @@ class MoveSplitter:
     def __init__(self, config, gcode):
         self.split_delta_z = config.getfloat(
             'split_delta_z', .025, minval=0.01)
-        self.move_check_distance = config.getfloat(
-            'move_check_distance', 5., minval=3.)
+        if config.getfloat('move_check_distance', None) is not None:
+            config.deprecate('move_check_distance')
         self.z_mesh = None
         self.fade_offset = 0.
+        self.z_range = 0.
         self.gcode = gcode
     def initialize(self, mesh, fade_offset):
         self.z_mesh = mesh
         self.fade_offset = fade_offset
+        self.z_range = 0.
+        if mesh is not None:
+            z_min, z_max = mesh.get_z_range()
+            self.z_range = z_max - z_min
     def build_move(self, prev_pos, next_pos, factor):
         self.prev_pos = tuple(prev_pos)
         self.next_pos = tuple(next_pos)
         self.current_pos = list(prev_pos)
         self.z_factor = factor
-        self.z_offset = self._calc_z_offset(prev_pos)
         self.traverse_complete = False
-        self.distance_checked = 0.
         axes_d = [self.next_pos[i] - self.prev_pos[i] for i in range(4)]
-        self.total_move_length = math.sqrt(sum([d*d for d in axes_d[:3]]))
         self.axis_move = [not isclose(d, 0., abs_tol=1e-10) for d in axes_d]
+        self.splits = []
+        self.end_z_offset = None
+        if ((self.axis_move[0] or self.axis_move[1])
+            and abs(factor) * self.z_range > self.split_delta_z):
+            # X and/or Y axis move over a mesh that is not flat enough
+            # to skip splitting (a single move always stays within the
+            # z range of the mesh), split if necessary
+            self.splits = self._calc_splits()
+            self.splits.reverse()
     def _calc_z_offset(self, pos):
         z = self.z_mesh.calc_z(pos[0], pos[1])
         offset = self.fade_offset
         return self.z_factor * (z - offset) + offset
-    def _set_next_move(self, distance_from_prev):
-        t = distance_from_prev / self.total_move_length
-        if t > 1. or t < 0.:
-            raise self.gcode.error(
-                "bed_mesh: Slice distance is negative "
-                "or greater than entire move length")
+    def _calc_crossings(self):
+        # Find where the move crosses the lines of the mesh grid (the
+        # mesh is bilinear between these lines)
+        crossings = [0., 1.]
+        zm = self.z_mesh
+        mesh_params = ((zm.mesh_x_min, zm.mesh_x_dist, zm.mesh_x_count),
+                       (zm.mesh_y_min, zm.mesh_y_dist, zm.mesh_y_count))
+        for axis, (mesh_min, mesh_dist, mesh_cnt) in enumerate(mesh_params):
+            if not self.axis_move[axis]:
+                continue
+            offset = zm.mesh_offsets[axis]
+            start = self.prev_pos[axis] + offset
+            move_d = self.next_pos[axis] + offset - start
+            low, high = sorted([start, start + move_d])
+            first = max(int(math.ceil((low - mesh_min) / mesh_dist)), 0)
+            last = min(int(math.floor((high - mesh_min) / mesh_dist)),
+                       mesh_cnt - 1)
+            for i in range(first, last + 1):
+                t = (mesh_min + i * mesh_dist - start) / move_d
+                if t > 0. and t < 1.:
+                    crossings.append(t)
+        crossings.sort()
+        return crossings
+    def _calc_splits(self):
+        # Between two crossings of the grid lines the move stays in one
+        # mesh cell, where its z offset is a quadratic a + b*t + c*t^2
+        # built directly from the cell coefficients.  Its largest
+        # deviation from a chord over a span dt is |c|*dt^2/4, so cells
+        # are only subdivided when that exceeds half of split_delta_z.
+        # The points are then merged while a chord stays within
+        # split_delta_z less the deviation of the pieces next to each
+        # point, tracking the range of valid chord slopes.
+        split_delta_z = self.split_delta_z
+        max_dev = .5 * split_delta_z
+        zm = self.z_mesh
+        coeffs = zm.mesh_coeffs
+        factor = self.z_factor
+        offset = self.fade_offset
+        # Position along each axis in units of mesh cells: f0 + fd * t
+        x_cnt, y_cnt = zm.mesh_x_count, zm.mesh_y_count
+        row_size = x_cnt - 1
+        fx0 = (self.prev_pos[0] + zm.mesh_offsets[0]
+               - zm.mesh_x_min) / zm.mesh_x_dist
+        fxd = (self.next_pos[0] - self.prev_pos[0]) / zm.mesh_x_dist
+        fy0 = (self.prev_pos[1] + zm.mesh_offsets[1]
+               - zm.mesh_y_min) / zm.mesh_y_dist
+        fyd = (self.next_pos[1] - self.prev_pos[1]) / zm.mesh_y_dist
+        crossings = self._calc_crossings()
+        splits = []
+        start_t = last_t = 0.
+        start_z = last_z = None
+        last_dev = 0.
+        inf = float('inf')
+        slope_min, slope_max = -inf, inf
+        for t in crossings[1:]:
+            if t - last_t < 1e-9:
+                # Move crosses both grid lines at the same point
+                continue
+            # Find the cell and the position within it (positions
+            # outside of the mesh are clamped as in ZMesh.calc_z())
+            mid_t = (last_t + t) * .5
+            f = fx0 + fxd * mid_t
+            if f <= 0.:
+                xidx, xa, xb = 0, 0., 0.
+            elif f >= x_cnt - 1:
+                xidx, xa, xb = x_cnt - 2, 1., 0.
+            else:
+                xidx = int(f)
+                xa, xb = fx0 - xidx, fxd
+            f = fy0 + fyd * mid_t
+            if f <= 0.:
+                yidx, ya, yb = 0, 0., 0.
+            elif f >= y_cnt - 1:
+                yidx, ya, yb = y_cnt - 2, 1., 0.
+            else:
+                yidx = int(f)
+                ya, yb = fy0 - yidx, fyd
+            # Quadratic z offset along the move within this cell
+            i = (yidx * row_size + xidx) * 4
+            c0, c1, c2, c3 = coeffs[i:i+4]
+            qa = factor * (c0 + c1 * xa + (c2 + c3 * xa) * ya - offset) + offset
+            qb = factor * (c1 * xb + c2 * yb + c3 * (xa * yb + ya * xb))
+            qc = factor * c3 * xb * yb
+            if start_z is None:
+                start_z = last_z = qa
+            dt = t - last_t
+            dev = .25 * abs(qc) * dt * dt
+            if dev > max_dev:
+                count = int(math.ceil(math.sqrt(dev / max_dev)))
+                points = [lerp(float(j) / count, last_t, t)
+                          for j in range(1, count)]
+                points.append(t)
+                dev /= count * count
+            else:
+                points = (t,)
+            tol = split_delta_z - dev
+            if dev > last_dev and last_t > start_t:
+                # Tighten the limit of the point at the cell boundary
+                dt = last_t - start_t
+                low = (last_z - tol - start_z) / dt
+                if low > slope_min:
+                    slope_min = low
+                high = (last_z + tol - start_z) / dt
+                if high < slope_max:
+                    slope_max = high
+            last_dev = dev
+            for pt in points:
+                pz = qa + (qb + qc * pt) * pt
+                dt = pt - start_t
+                slope = (pz - start_z) / dt
+                if slope < slope_min or slope > slope_max:
+                    # Split the move at the previous point
+                    splits.append((last_t, last_z))
+                    start_t, start_z = last_t, last_z
+                    dt = pt - start_t
+                    slope_min, slope_max = -inf, inf
+                low = (pz - tol - start_z) / dt
+                if low > slope_min:
+                    slope_min = low
+                high = (pz + tol - start_z) / dt
+                if high < slope_max:
+                    slope_max = high
+                last_t, last_z = pt, pz
+        self.end_z_offset = last_z
+        return splits
+    def _set_next_move(self, t):
         for i in range(4):
             if self.axis_move[i]:
                 self.current_pos[i] = lerp(
                     t, self.prev_pos[i], self.next_pos[i])
     def split(self):
         if not self.traverse_complete:
-            if self.axis_move[0] or self.axis_move[1]:
-                # X and/or Y axis move, traverse if necessary
-                while self.distance_checked + self.move_check_distance \
-                        < self.total_move_length:
-                    self.distance_checked += self.move_check_distance
-                    self._set_next_move(self.distance_checked)
-                    next_z = self._calc_z_offset(self.current_pos)
-                    if abs(next_z - self.z_offset) >= self.split_delta_z:
-                        self.z_offset = next_z
-                        return self.current_pos[0], self.current_pos[1], \
-                            self.current_pos[2] + self.z_offset, \
-                            self.current_pos[3]
+            if self.splits:
+                t, z_offset = self.splits.pop()
+                self._set_next_move(t)
+                return self.current_pos[0], self.current_pos[1], \
+                    self.current_pos[2] + z_offset, self.current_pos[3]
             # end of move reached
             self.current_pos[:] = self.next_pos
-            self.z_offset = self._calc_z_offset(self.current_pos)
+            z_offset = self.end_z_offset
+            if z_offset is None:
+                z_offset = self._calc_z_offset(self.current_pos)
             # Its okay to add Z-Offset to the final move, since it will not be
             # used again.
-            self.current_pos[2] += self.z_offset
+            self.current_pos[2] += z_offset
             self.traverse_complete = True
             return self.current_pos
         else:
@@ -1321,6 +1460,8 @@ class ZMesh:
     def __init__(self, params, name):
         self.profile_name = name or "adaptive-%X" % (id(self),)
         self.probed_matrix = self.mesh_matrix = None
+        self.mesh_coeffs = self.np_coeffs = None
+        self.numpy = None
         self.mesh_params = params
         self.mesh_offsets = [0., 0.]
         logging.debug('bed_mesh: probe/mesh parameters:')
@@ -1404,7 +1545,9 @@ class ZMesh:
     def build_mesh(self, z_matrix):
         self.probed_matrix = z_matrix
         self._sample(z_matrix)
-        self.print_mesh(logging.debug)
+        self._build_coefficients()
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            self.print_mesh(logging.debug)
     def set_zero_reference(self, xpos, ypos):
         offset = self.calc_z(xpos, ypos)
         logging.info(
@@ -1415,6 +1558,7 @@ class ZMesh:
             for yidx in range(len(matrix)):
                 for xidx in range(len(matrix[yidx])):
                     matrix[yidx][xidx] -= offset
+        self._build_coefficients()
     def set_mesh_offsets(self, offsets):
         for i, o in enumerate(offsets):
             if o is not None:
@@ -1423,17 +1567,64 @@ class ZMesh:
         return self.mesh_x_min + self.mesh_x_dist * index
     def get_y_coordinate(self, index):
         return self.mesh_y_min + self.mesh_y_dist * index
+    def _build_coefficients(self):
+        # Store the bilinear coefficients of each mesh cell in a flat
+        # list, four per cell in row major order.  Within a cell
+        # z = c0 + c1*tx + c2*ty + c3*tx*ty
+        tbl = self.mesh_matrix
+        coeffs = []
+        for row, next_row in zip(tbl, tbl[1:]):
+            for xidx in range(len(row) - 1):
+                z00, z10 = row[xidx], row[xidx+1]
+                z01, z11 = next_row[xidx], next_row[xidx+1]
+                coeffs.extend((z00, z10 - z00, z01 - z00,
+                               z00 - z10 - z01 + z11))
+        self.mesh_coeffs = coeffs
+        self.np_coeffs = None
     def calc_z(self, x, y):
-        if self.mesh_matrix is not None:
-            tbl = self.mesh_matrix
-            tx, xidx = self._get_linear_index(x + self.mesh_offsets[0], 0)
-            ty, yidx = self._get_linear_index(y + self.mesh_offsets[1], 1)
-            z0 = lerp(tx, tbl[yidx][xidx], tbl[yidx][xidx+1])
-            z1 = lerp(tx, tbl[yidx+1][xidx], tbl[yidx+1][xidx+1])
-            return lerp(ty, z0, z1)
-        else:
+        coeffs = self.mesh_coeffs
+        if coeffs is None:
             # No mesh table generated, no z-adjustment
             return 0.
+        x_cnt = self.mesh_x_count
+        fx = (x + self.mesh_offsets[0] - self.mesh_x_min) / self.mesh_x_dist
+        xidx = min(max(int(math.floor(fx)), 0), x_cnt - 2)
+        tx = min(max(fx - xidx, 0.), 1.)
+        fy = (y + self.mesh_offsets[1] - self.mesh_y_min) / self.mesh_y_dist
+        yidx = min(max(int(math.floor(fy)), 0), self.mesh_y_count - 2)
+        ty = min(max(fy - yidx, 0.), 1.)
+        i = (yidx * (x_cnt - 1) + xidx) * 4
+        return (coeffs[i] + coeffs[i+1] * tx
+                + (coeffs[i+2] + coeffs[i+3] * tx) * ty)
+    def get_numpy(self):
+        # Return the numpy module if it is available
+        if self.numpy is None:
+            self.numpy = False
+            try:
+                import numpy
+                self.numpy = numpy
+            except ImportError:
+                pass
+        return self.numpy or None
+    def calc_z_many(self, xs, ys):
+        # Return a list with the z adjustment of each x, y pair
+        np = self.get_numpy()
+        if np is None or self.mesh_coeffs is None:
+            return [self.calc_z(x, y) for x, y in zip(xs, ys)]
+        if self.np_coeffs is None:
+            self.np_coeffs = np.array(self.mesh_coeffs).reshape(-1, 4)
+        x_cnt = self.mesh_x_count
+        fx = ((np.asarray(xs, dtype=np.float64) + self.mesh_offsets[0]
+               - self.mesh_x_min) / self.mesh_x_dist)
+        xidx = np.clip(np.floor(fx), 0, x_cnt - 2).astype(np.intp)
+        tx = np.clip(fx - xidx, 0., 1.)
+        fy = ((np.asarray(ys, dtype=np.float64) + self.mesh_offsets[1]
+               - self.mesh_y_min) / self.mesh_y_dist)
+        yidx = np.clip(np.floor(fy), 0, self.mesh_y_count - 2).astype(np.intp)
+        ty = np.clip(fy - yidx, 0., 1.)
+        c = self.np_coeffs[yidx * (x_cnt - 1) + xidx]
+        z = c[:, 0] + c[:, 1] * tx + (c[:, 2] + c[:, 3] * tx) * ty
+        return z.tolist()
     def get_z_range(self):
         if self.mesh_matrix is not None:
             mesh_min = min([min(x) for x in self.mesh_matrix])
@@ -1451,52 +1642,15 @@ class ZMesh:
             return round(avg_z, 2)
         else:
             return 0.
-    def _get_linear_index(self, coord, axis):
-        if axis == 0:
-            # X-axis
-            mesh_min = self.mesh_x_min
-            mesh_cnt = self.mesh_x_count
-            mesh_dist = self.mesh_x_dist
-            cfunc = self.get_x_coordinate
-        else:
-            # Y-axis
-            mesh_min = self.mesh_y_min
-            mesh_cnt = self.mesh_y_count
-            mesh_dist = self.mesh_y_dist
-            cfunc = self.get_y_coordinate
-        t = 0.
-        idx = int(math.floor((coord - mesh_min) / mesh_dist))
-        idx = constrain(idx, 0, mesh_cnt - 2)
-        t = (coord - cfunc(idx)) / mesh_dist
-        return constrain(t, 0., 1.), idx
     def _sample_direct(self, z_matrix):
         self.mesh_matrix = z_matrix
     def _sample_lagrange(self, z_matrix):
-        x_mult = self.x_mult
-        y_mult = self.y_mult
-        self.mesh_matrix = \
-            [[0. if ((i % x_mult) or (j % y_mult))
-             else z_matrix[j//y_mult][i//x_mult]
-             for i in range(self.mesh_x_count)]
-             for j in range(self.mesh_y_count)]
         xpts, ypts = self._get_lagrange_coords()
-        # Interpolate X coordinates
-        for i in range(self.mesh_y_count):
-            # only interpolate X-rows that have probed coordinates
-            if i % y_mult != 0:
-                continue
-            for j in range(self.mesh_x_count):
-                if j % x_mult == 0:
-                    continue
-                x = self.get_x_coordinate(j)
-                self.mesh_matrix[i][j] = self._calc_lagrange(xpts, x, i, 0)
-        # Interpolate Y coordinates
-        for i in range(self.mesh_x_count):
-            for j in range(self.mesh_y_count):
-                if j % y_mult == 0:
-                    continue
-                y = self.get_y_coordinate(j)
-                self.mesh_matrix[j][i] = self._calc_lagrange(ypts, y, i, 1)
+        x_weights = self._get_lagrange_weights(
+            xpts, self.x_mult, self.mesh_x_count, self.get_x_coordinate)
+        y_weights = self._get_lagrange_weights(
+            ypts, self.y_mult, self.mesh_y_count, self.get_y_coordinate)
+        self._interpolate(z_matrix, x_weights, y_weights)
     def _get_lagrange_coords(self):
         xpts = []
         ypts = []
@@ -1505,122 +1659,208 @@ class ZMesh:
         for j in range(self.mesh_params['y_count']):
             ypts.append(self.get_y_coordinate(j * self.y_mult))
         return xpts, ypts
-    def _calc_lagrange(self, lpts, c, vec, axis=0):
+    def _get_lagrange_weights(self, lpts, mult, mesh_cnt, cfunc):
         pt_cnt = len(lpts)
-        total = 0.
-        for i in range(pt_cnt):
-            n = 1.
-            d = 1.
-            for j in range(pt_cnt):
-                if j == i:
-                    continue
-                n *= (c - lpts[j])
-                d *= (lpts[i] - lpts[j])
-            if axis == 0:
-                # Calc X-Axis
-                z = self.mesh_matrix[vec][i*self.x_mult]
-            else:
-                # Calc Y-Axis
-                z = self.mesh_matrix[i*self.y_mult][vec]
-            total += z * n / d
-        return total
+        weights = []
+        for idx in range(mesh_cnt):
+            if idx % mult == 0:
+                # Probed point
+                weights.append([(idx // mult, 1.)])
+                continue
+            c = cfunc(idx)
+            wts = []
+            for i in range(pt_cnt):
+                n = 1.
+                d = 1.
+                for j in range(pt_cnt):
+                    if j == i:
+                        continue
+                    n *= (c - lpts[j])
+                    d *= (lpts[i] - lpts[j])
+                wts.append((i, n / d))
+            weights.append(wts)
+        return weights
     def _sample_bicubic(self, z_matrix):
         # should work for any number of probe points above 3x3
-        x_mult = self.x_mult
-        y_mult = self.y_mult
         c = self.mesh_params['tension']
-        self.mesh_matrix = \
-            [[0. if ((i % x_mult) or (j % y_mult))
-             else z_matrix[j//y_mult][i//x_mult]
-             for i in range(self.mesh_x_count)]
-             for j in range(self.mesh_y_count)]
-        # Interpolate X values
-        for y in range(self.mesh_y_count):
-            if y % y_mult != 0:
+        x_weights = self._get_bicubic_weights(
+            self.x_mult, self.mesh_x_count, self.mesh_params['x_count'], c)
+        y_weights = self._get_bicubic_weights(
+            self.y_mult, self.mesh_y_count, self.mesh_params['y_count'], c)
+        self._interpolate(z_matrix, x_weights, y_weights)
+    def _get_bicubic_weights(self, mult, mesh_cnt, pt_cnt, tension):
+        # Weights of the control points of a cardinal spline, the end
+        # points are repeated at the edges of the mesh
+        weights = []
+        for idx in range(mesh_cnt):
+            i, rem = divmod(idx, mult)
+            if not rem:
+                # Probed point
+                weights.append([(i, 1.)])
                 continue
-            for x in range(self.mesh_x_count):
-                if x % x_mult == 0:
-                    continue
-                pts = self._get_x_ctl_pts(x, y)
-                self.mesh_matrix[y][x] = self._cardinal_spline(pts, c)
-        # Interpolate Y values
-        for x in range(self.mesh_x_count):
-            for y in range(self.mesh_y_count):
-                if y % y_mult == 0:
-                    continue
-                pts = self._get_y_ctl_pts(x, y)
-                self.mesh_matrix[y][x] = self._cardinal_spline(pts, c)
-    def _get_x_ctl_pts(self, x, y):
-        # Fetch control points and t for a X value in the mesh
-        x_mult = self.x_mult
-        x_row = self.mesh_matrix[y]
-        last_pt = self.mesh_x_count - 1 - x_mult
-        if x < x_mult:
-            p0 = p1 = x_row[0]
-            p2 = x_row[x_mult]
-            p3 = x_row[2*x_mult]
-            t = x / float(x_mult)
-        elif x > last_pt:
-            p0 = x_row[last_pt - x_mult]
-            p1 = x_row[last_pt]
-            p2 = p3 = x_row[last_pt + x_mult]
-            t = (x - last_pt) / float(x_mult)
-        else:
-            found = False
-            for i in range(x_mult, last_pt, x_mult):
-                if x > i and x < (i + x_mult):
-                    p0 = x_row[i - x_mult]
-                    p1 = x_row[i]
-                    p2 = x_row[i + x_mult]
-                    p3 = x_row[i + 2*x_mult]
-                    t = (x - i) / float(x_mult)
-                    found = True
-                    break
-            if not found:
-                raise BedMeshError(
-                    "bed_mesh: Error finding x control points")
-        return p0, p1, p2, p3, t
-    def _get_y_ctl_pts(self, x, y):
-        # Fetch control points and t for a Y value in the mesh
-        y_mult = self.y_mult
-        last_pt = self.mesh_y_count - 1 - y_mult
-        y_col = self.mesh_matrix
-        if y < y_mult:
-            p0 = p1 = y_col[0][x]
-            p2 = y_col[y_mult][x]
-            p3 = y_col[2*y_mult][x]
-            t = y / float(y_mult)
-        elif y > last_pt:
-            p0 = y_col[last_pt - y_mult][x]
-            p1 = y_col[last_pt][x]
-            p2 = p3 = y_col[last_pt + y_mult][x]
-            t = (y - last_pt) / float(y_mult)
-        else:
-            found = False
-            for i in range(y_mult, last_pt, y_mult):
-                if y > i and y < (i + y_mult):
-                    p0 = y_col[i - y_mult][x]
-                    p1 = y_col[i][x]
-                    p2 = y_col[i + y_mult][x]
-                    p3 = y_col[i + 2*y_mult][x]
-                    t = (y - i) / float(y_mult)
-                    found = True
-                    break
-            if not found:
+            t = rem / float(mult)
+            t2 = t*t
+            t3 = t2*t
+            h00 = 2*t3 - 3*t2 + 1
+            h01 = -2*t3 + 3*t2
+            h10 = t3 - 2*t2 + t
+            h11 = t3 - t2
+            wts = collections.OrderedDict()
+            for pt, w in ((max(i - 1, 0), -tension * h10),
+                          (i, h00 - tension * h11),
+                          (i + 1, h01 + tension * h10),
+                          (min(i + 2, pt_cnt - 1), tension * h11)):
+                wts[pt] = wts.get(pt, 0.) + w
+            weights.append(list(wts.items()))
+        return weights
+    def _interpolate(self, z_matrix, x_weights, y_weights):
+        # The interpolation is separable, each row of probed points is
+        # interpolated along X and the result is then interpolated
+        # along Y.  The weights of each mesh point are a list of
+        # (probe index, weight) pairs.
+        np = self.get_numpy()
+        if np is not None:
+            wx = np.zeros((len(x_weights), len(z_matrix[0])))
+            for idx, wts in enumerate(x_weights):
+                for i, w in wts:
+                    wx[idx, i] = w
+            wy = np.zeros((len(y_weights), len(z_matrix)))
+            for idx, wts in enumerate(y_weights):
+                for i, w in wts:
+                    wy[idx, i] = w
+            z = np.array(z_matrix, dtype=np.float64)
+            self.mesh_matrix = wy.dot(z.dot(wx.T)).tolist()
+            return
+        x_rows = [[sum([z_row[i] * w for i, w in wts]) for wts in x_weights]
+                  for z_row in z_matrix]
+        self.mesh_matrix = [
+            [sum([x_rows[i][x] * w for i, w in wts])
+             for x in range(self.mesh_x_count)]
+            for wts in y_weights]
+
+
+# Binary storage of mesh profiles in a file separate from printer.cfg.
+# The file has a header followed by one record per profile.  Each
+# record holds the profile version, name, its mesh parameters (as
+# json), its probed points (as little endian doubles) and a crc32 of
+# all of them.  Only the names and parameters are read at startup, the
+# points of a profile are read when it is loaded.
+class ProfileFile:
+    HEADER = struct.Struct("<8sHH")
+    RECORD = struct.Struct("<HHHI")
+    def __init__(self, filename):
+        self.filename = filename
+        # name -> (mesh_params, record offset, record size, points offset)
+        self.records = collections.OrderedDict()
+        # name -> profile version of records that can not be used
+        self.incompatible = collections.OrderedDict()
+        self.unreadable = False
+    def load(self):
+        self.records.clear()
+        self.incompatible.clear()
+        self.unreadable = False
+        if not os.path.exists(self.filename):
+            return
+        try:
+            self._load()
+        except:
+            self.records.clear()
+            self.incompatible.clear()
+            self.unreadable = True
+            raise
+    def _load(self):
+        with open(self.filename, "rb") as f:
+            data = f.read(self.HEADER.size)
+            if len(data) < self.HEADER.size:
+                raise BedMeshError("bed_mesh: Invalid profile file '%s'"
+                                   % (self.filename,))
+            magic, version, count = self.HEADER.unpack(data)
+            if magic != PROFILE_FILE_MAGIC or version != PROFILE_FILE_VERSION:
                 raise BedMeshError(
-                    "bed_mesh: Error finding y control points")
-        return p0, p1, p2, p3, t
-    def _cardinal_spline(self, p, tension):
-        t = p[4]
-        t2 = t*t
-        t3 = t2*t
-        m1 = tension * (p[2] - p[0])
-        m2 = tension * (p[3] - p[1])
-        a = p[1] * (2*t3 - 3*t2 + 1)
-        b = p[2] * (-2*t3 + 3*t2)
-        c = m1 * (t3 - 2*t2 + t)
-        d = m2 * (t3 - t2)
-        return a + b + c + d
+                    "bed_mesh: Profile file '%s' is not compatible with"
+                    " this version of bed_mesh" % (self.filename,))
+            for i in range(count):
+                offset = f.tell()
+                data = f.read(self.RECORD.size)
+                if len(data) < self.RECORD.size:
+                    raise BedMeshError("bed_mesh: Truncated profile file '%s'"
+                                       % (self.filename,))
+                prof_version, name_len, params_len, crc = \
+                    self.RECORD.unpack(data)
+                data = f.read(name_len + params_len)
+                if len(data) < name_len + params_len:
+                    raise BedMeshError("bed_mesh: Truncated profile file '%s'"
+                                       % (self.filename,))
+                name = data[:name_len].decode()
+                params = json.loads(
+                    data[name_len:], object_pairs_hook=collections.OrderedDict)
+                points_offset = f.tell()
+                points_size = 8 * params['x_count'] * params['y_count']
+                f.seek(points_size, os.SEEK_CUR)
+                if prof_version != PROFILE_VERSION:
+                    self.incompatible[name] = prof_version
+                    continue
+                self.records[name] = (params, offset, f.tell() - offset,
+                                      points_offset)
+    def get_profile_params(self):
+        return dict([(name, r[0]) for name, r in self.records.items()])
+    def read_points(self, name):
+        params, offset, size, points_offset = self.records[name]
+        with open(self.filename, "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+        if len(data) < size:
+            raise BedMeshError("bed_mesh: Truncated profile file '%s'"
+                               % (self.filename,))
+        crc = self.RECORD.unpack_from(data)[3]
+        if zlib.crc32(data[self.RECORD.size:]) != crc:
+            raise BedMeshError("bed_mesh: Checksum mismatch for profile [%s]"
+                               " in '%s'" % (name, self.filename))
+        x_cnt = params['x_count']
+        y_cnt = params['y_count']
+        zvals = struct.unpack_from("<%dd" % (x_cnt * y_cnt,), data,
+                                   points_offset - offset)
+        return [list(zvals[i*x_cnt:(i+1)*x_cnt]) for i in range(y_cnt)]
+    def _pack_record(self, name, params, points):
+        name_data = name.encode()
+        params_data = json.dumps(params, separators=(',', ':')).encode()
+        zvals = [z for line in points for z in line]
+        body = (name_data + params_data
+                + struct.pack("<%dd" % (len(zvals),), *zvals))
+        return self.RECORD.pack(PROFILE_VERSION, len(name_data),
+                                len(params_data), zlib.crc32(body)) + body
+    def _write(self, new_records):
+        # Copy the unchanged records and atomically replace the file
+        if self.unreadable and os.path.exists(self.filename):
+            # Keep a copy of a file that could not be read
+            backup = self.filename + ".bak"
+            logging.info("bed_mesh: Moving unreadable profile file"
+                         " '%s' to '%s'" % (self.filename, backup))
+            os.rename(self.filename, backup)
+            self.unreadable = False
+        data = []
+        if self.records:
+            with open(self.filename, "rb") as f:
+                for name, (params, offset, size, pts_offset) in \
+                        self.records.items():
+                    if name in new_records:
+                        continue
+                    f.seek(offset)
+                    data.append(f.read(size))
+        for name, record in new_records.items():
+            if record is not None:
+                data.append(self._pack_record(name, *record))
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "wb") as f:
+            f.write(self.HEADER.pack(PROFILE_FILE_MAGIC, PROFILE_FILE_VERSION,
+                                     len(data)))
+            f.write(b"".join(data))
+        os.rename(tmp_filename, self.filename)
+        self.load()
+    def save_profile(self, name, params, points):
+        self._write({name: (params, points)})
+    def remove_profile(self, name):
+        self._write({name: None})
 
 
 class ProfileManager:
@@ -1630,7 +1870,10 @@ class ProfileManager:
         self.gcode = self.printer.lookup_object('gcode')
         self.bedmesh = bedmesh
         self.profiles = {}
+        self.config_profiles = set()
         self.incompatible_profiles = []
+        self.profile_file = None
+        profile_file = config.get('profile_file', None)
         # Fetch stored profiles from Config
         stored_profs = config.get_prefix_sections(self.name)
         stored_profs = [s for s in stored_profs
@@ -1646,6 +1889,7 @@ class ProfileManager:
                 self.incompatible_profiles.append(name)
                 continue
             self.profiles[name] = {}
+            self.config_profiles.add(name)
             zvals = profile.getlists('points', seps=(',', '\n'), parser=float)
             self.profiles[name]['points'] = zvals
             self.profiles[name]['mesh_params'] = params = \
@@ -1657,12 +1901,48 @@ class ProfileManager:
                     params[key] = profile.getfloat(key)
                 elif t is str:
                     params[key] = profile.get(key)
+        # Fetch stored profiles from the profile file, their points are
+        # only read when the profile is loaded
+        if profile_file is not None:
+            self.profile_file = ProfileFile(os.path.expanduser(profile_file))
+            try:
+                self.profile_file.load()
+            except (BedMeshError, IOError, OSError, KeyError, TypeError,
+                    ValueError, struct.error) as e:
+                # Start without the profiles of the file
+                logging.exception("bed_mesh: Unable to read profile file")
+                pconfig = self.printer.lookup_object('configfile')
+                pconfig.runtime_warning(
+                    "bed_mesh: Unable to read profile file '%s': %s\n"
+                    "Its profiles are not available, the file will be"
+                    " moved to '%s.bak' when a profile is saved"
+                    % (profile_file, str(e), profile_file))
+            for name, version in self.profile_file.incompatible.items():
+                logging.info(
+                    "bed_mesh: Profile [%s] in the profile file is not"
+                    " compatible with this version\nof bed_mesh.  Profile"
+                    " Version: %d Current Version: %d "
+                    % (name, version, PROFILE_VERSION))
+                if name not in self.profiles:
+                    self.incompatible_profiles.append(name)
+            for name, params in self.profile_file.get_profile_params().items():
+                self.profiles[name] = {'mesh_params': params}
         # Register GCode
         self.gcode.register_command(
             'BED_MESH_PROFILE', self.cmd_BED_MESH_PROFILE,
             desc=self.cmd_BED_MESH_PROFILE_help)
     def get_profiles(self):
         return self.profiles
+    def dump_profiles(self):
+        # The points of profiles stored in the profile file are not kept
+        # in memory, read them for a full dump of the profiles
+        profiles = {}
+        for name, profile in self.profiles.items():
+            if 'points' not in profile:
+                profile = dict(profile)
+                profile['points'] = self._get_profile_points(name, profile)
+            profiles[name] = profile
+        return profiles
     def _check_incompatible_profiles(self):
         if self.incompatible_profiles:
             configfile = self.printer.lookup_object('configfile')
@@ -1674,7 +1954,7 @@ class ProfileManager:
                 "The SAVE_CONFIG command will update the printer config\n"
                 "file and restart the printer" %
                 (('\n').join(self.incompatible_profiles)))
-    def save_profile(self, prof_name):
+    def save_profile(self, prof_name, to_file=False):
         z_mesh = self.bedmesh.get_mesh()
         if z_mesh is None:
             self.gcode.respond_info(
@@ -1683,6 +1963,13 @@ class ProfileManager:
             return
         probed_matrix = z_mesh.get_probed_matrix()
         mesh_params = z_mesh.get_mesh_params()
+        if self.profile_file is not None:
+            if to_file:
+                self._save_profile_file(prof_name, probed_matrix, mesh_params)
+            else:
+                self._save_profile_session(
+                    prof_name, probed_matrix, mesh_params)
+            return
         configfile = self.printer.lookup_object('configfile')
         cfg_name = self.name + " " + prof_name
         # set params
@@ -1696,6 +1983,7 @@ class ProfileManager:
         configfile.set(cfg_name, 'points', z_values)
         for key, value in mesh_params.items():
             configfile.set(cfg_name, key, value)
+        self.config_profiles.add(prof_name)
         # save copy in local storage
         # ensure any self.profiles returned as status remains immutable
         profiles = dict(self.profiles)
@@ -1709,12 +1997,58 @@ class ProfileManager:
             "for the current session.  The SAVE_CONFIG command will\n"
             "update the printer config file and restart the printer."
             % (prof_name))
+    def _save_profile_file(self, prof_name, probed_matrix, mesh_params):
+        try:
+            self.profile_file.save_profile(
+                prof_name, mesh_params, probed_matrix)
+        except (BedMeshError, IOError, OSError) as e:
+            logging.exception("bed_mesh: Unable to save profile")
+            raise self.gcode.error(
+                "bed_mesh: Unable to save profile [%s]: %s"
+                % (prof_name, str(e)))
+        # Only the mesh parameters are kept in local storage, the points
+        # are read from the profile file when the profile is loaded
+        profiles = dict(self.profiles)
+        profiles[prof_name] = {
+            'mesh_params': collections.OrderedDict(mesh_params)}
+        self.profiles = profiles
+        self.bedmesh.update_status()
+        self.gcode.respond_info(
+            "Bed Mesh state has been saved to profile [%s]\n"
+            "in the profile file %s"
+            % (prof_name, self.profile_file.filename))
+    def _save_profile_session(self, prof_name, probed_matrix, mesh_params):
+        # Profiles saved by BED_MESH_CALIBRATE are only written to the
+        # profile file on an explicit BED_MESH_PROFILE SAVE
+        profiles = dict(self.profiles)
+        profiles[prof_name] = {
+            'points': probed_matrix,
+            'mesh_params': collections.OrderedDict(mesh_params)}
+        self.profiles = profiles
+        self.bedmesh.update_status()
+        self.gcode.respond_info(
+            "Bed Mesh state has been saved to profile [%s]\n"
+            "for the current session.  The BED_MESH_PROFILE SAVE=%s\n"
+            "command will store it in the profile file."
+            % (prof_name, prof_name))
+    def cmd_save_profile(self, prof_name):
+        self.save_profile(prof_name, to_file=True)
+    def _get_profile_points(self, prof_name, profile):
+        if 'points' in profile:
+            return profile['points']
+        try:
+            return self.profile_file.read_points(prof_name)
+        except (BedMeshError, IOError, OSError, KeyError) as e:
+            logging.exception("bed_mesh: Unable to read profile")
+            raise self.gcode.error(
+                "bed_mesh: Unable to read profile [%s]: %s"
+                % (prof_name, str(e)))
     def load_profile(self, prof_name):
         profile = self.profiles.get(prof_name, None)
         if profile is None:
             raise self.gcode.error(
                 "bed_mesh: Unknown profile [%s]" % prof_name)
-        probed_matrix = profile['points']
+        probed_matrix = self._get_profile_points(prof_name, profile)
         mesh_params = profile['mesh_params']
         z_mesh = ZMesh(mesh_params, prof_name)
         try:
@@ -1726,10 +2060,31 @@ class ProfileManager:
         if prof_name in self.profiles:
             configfile = self.printer.lookup_object('configfile')
             configfile.remove_section('bed_mesh ' + prof_name)
+            in_config = prof_name in self.config_profiles
+            self.config_profiles.discard(prof_name)
             profiles = dict(self.profiles)
             del profiles[prof_name]
             self.profiles = profiles
             self.bedmesh.update_status()
+            if (self.profile_file is not None
+                    and prof_name in self.profile_file.records):
+                try:
+                    self.profile_file.remove_profile(prof_name)
+                except (BedMeshError, IOError, OSError) as e:
+                    logging.exception("bed_mesh: Unable to remove profile")
+                    raise self.gcode.error(
+                        "bed_mesh: Unable to remove profile [%s]: %s"
+                        % (prof_name, str(e)))
+                self.gcode.respond_info(
+                    "Profile [%s] removed from the profile file %s"
+                    % (prof_name, self.profile_file.filename))
+                if not in_config:
+                    return
+            elif not in_config:
+                self.gcode.respond_info(
+                    "Profile [%s] removed from storage for this session."
+                    % (prof_name,))
+                return
             self.gcode.respond_info(
                 "Profile [%s] removed from storage for this session.\n"
                 "The SAVE_CONFIG command will update the printer\n"
@@ -1741,7 +2096,7 @@ class ProfileManager:
     def cmd_BED_MESH_PROFILE(self, gcmd):
         options = collections.OrderedDict({
             'LOAD': self.load_profile,
-            'SAVE': self.save_profile,
+            'SAVE': self.cmd_save_profile,
             'REMOVE': self.remove_profile
         })
         for key in options:
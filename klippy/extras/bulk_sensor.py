@@ -3,7 +3,8 @@
 # Copyright (C) 2020-2023  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, threading, struct
+import logging, threading, struct, base64, itertools
+import webhooks
 
 # This "bulk sensor" module facilitates the processing of sensor chip
 # measurements that do not require the host to respond with low
@@ -19,6 +20,31 @@ import logging, threading, struct
 
 BATCH_INTERVAL = 0.500
 
+# Webhooks clients of endpoints that provide a binary row format
+# (eg, '<dfff' - a little-endian double timestamp followed by a float
+# for each acceleration axis) may request the 'data' rows of a batch
+# in that packed form.  The result is base64 encoded so that it may
+# still be sent in a json message.
+DATA_FORMATS = ('json', 'binary')
+
+def pack_binary_batch(msg, fmt):
+    data = msg.get('data')
+    if not data:
+        return msg
+    row_size = len(fmt) - 1
+    try:
+        if any(len(row) != row_size for row in data):
+            return msg
+        packed = struct.pack('<' + fmt[1:] * len(data),
+                             *itertools.chain.from_iterable(data))
+    except (TypeError, struct.error):
+        # Not numeric data - send as json
+        return msg
+    msg = dict(msg)
+    msg['data'] = base64.b64encode(packed).decode()
+    msg['data_format'] = fmt
+    return msg
+
 # Helper to process accumulated messages in periodic batches
 class BatchBulkHelper:
     def __init__(self, printer, batch_cb, start_cb=None, stop_cb=None,
@@ -36,6 +62,8 @@ class BatchBulkHelper:
         self.batch_timer = None
         self.client_cbs = []
         self.webhooks_start_resp = {}
+        self.binary_format = None
+        self.last_encoded = {}
     # Periodic batch processing
     def _start(self):
         if self.is_started:
@@ -84,32 +112,53 @@ class BatchBulkHelper:
                 if not self.client_cbs:
                     self._stop()
                     return self.printer.get_reactor().NEVER
+        self.last_encoded.clear()
         return eventtime + self.batch_interval
     # Client registration
     def add_client(self, client_cb):
         self.client_cbs.append(client_cb)
         self._start()
     # Webhooks registration
+    def get_encoded_batch(self, msg, data_format='json'):
+        # Encode a batch once (per data format) for all webhooks clients
+        encoded = self.last_encoded.get(data_format)
+        if encoded is None or encoded[0] is not msg:
+            if data_format == 'binary':
+                msg = pack_binary_batch(msg, self.binary_format)
+            wh = self.printer.lookup_object('webhooks')
+            encoded = self.last_encoded[data_format] = (
+                msg, wh.encode_params(msg))
+        return encoded[1]
     def _add_api_client(self, web_request):
-        whbatch = BatchWebhooksClient(web_request)
+        data_format = web_request.get_str('data_format', 'json')
+        if (data_format not in DATA_FORMATS
+            or (data_format == 'binary' and self.binary_format is None)):
+            raise web_request.error("Invalid data_format '%s'" % (data_format,))
+        whbatch = BatchWebhooksClient(web_request, self, data_format)
         self.add_client(whbatch.handle_batch)
         web_request.send(self.webhooks_start_resp)
-    def add_mux_endpoint(self, path, key, value, webhooks_start_resp):
+    def add_mux_endpoint(self, path, key, value, webhooks_start_resp,
+                         binary_format=None):
         self.webhooks_start_resp = webhooks_start_resp
+        self.binary_format = binary_format
         wh = self.printer.lookup_object('webhooks')
         wh.register_mux_endpoint(path, key, value, self._add_api_client)
 
 # A webhooks wrapper for use by BatchBulkHelper
 class BatchWebhooksClient:
-    def __init__(self, web_request):
+    def __init__(self, web_request, batch_helper, data_format='json'):
         self.cconn = web_request.get_client_connection()
-        self.template = web_request.get_dict('response_template', {})
+        self.template = webhooks.ResponseTemplate(
+            web_request.get_dict('response_template', {}))
+        self.batch_helper = batch_helper
+        self.data_format = data_format
     def handle_batch(self, msg):
         if self.cconn.is_closed():
             return False
-        tmp = dict(self.template)
-        tmp['params'] = msg
-        self.cconn.send(tmp)
+        data = self.batch_helper.get_encoded_batch(msg, self.data_format)
+        if data is not None:
+            # Batches may be dropped if the client falls too far behind
+            self.cconn.send_encoded(self.template.build(data), droppable=True)
         return True
 
 # Helper class to store incoming messages in a queue
@@ -200,6 +249,23 @@ class ClockSyncRegression:
 
 MAX_BULK_MSG_SIZE = 51
 
+# Map struct sample formats to numpy dtypes
+STRUCT_TO_DTYPE = {'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2',
+                   'i': 'i4', 'I': 'u4'}
+STRUCT_BYTE_ORDER = {'<': '<', '>': '>', '!': '>', '=': '=', '@': '='}
+
+# Determine the numpy dtype and number of fields of a fixed size sample
+# (all fields must have the same type).  Returns None if not possible.
+def lookup_sample_dtype(unpack_fmt):
+    byte_order = STRUCT_BYTE_ORDER.get(unpack_fmt[:1])
+    if byte_order is None:
+        byte_order = '='
+    else:
+        unpack_fmt = unpack_fmt[1:]
+    if len(set(unpack_fmt)) != 1 or unpack_fmt[0] not in STRUCT_TO_DTYPE:
+        return None
+    return byte_order + STRUCT_TO_DTYPE[unpack_fmt[0]], len(unpack_fmt)
+
 # Read sensor_bulk_data and calculate timestamps for devices that take
 # samples at a fixed frequency (and produce fixed data size samples).
 class FixedFreqReader:
@@ -210,6 +276,8 @@ class FixedFreqReader:
         self.unpack_from = unpack.unpack_from
         self.bytes_per_sample = unpack.size
         self.samples_per_block = MAX_BULK_MSG_SIZE // self.bytes_per_sample
+        self.sample_dtype = lookup_sample_dtype(unpack_fmt)
+        self.numpy = None
         self.last_sequence = self.max_query_duration = 0
         self.last_overflows = 0
         self.bulk_queue = self.oid = self.query_status_cmd = None
@@ -224,6 +292,17 @@ class FixedFreqReader:
         self.bulk_queue = BulkDataQueue(self.mcu, oid=oid)
     def get_last_overflows(self):
         return self.last_overflows
+    def get_numpy(self):
+        # Return the numpy module if pull_sample_array() may be used
+        if self.numpy is None:
+            self.numpy = False
+            if self.sample_dtype is not None:
+                try:
+                    import numpy
+                    self.numpy = numpy
+                except ImportError:
+                    pass
+        return self.numpy or None
     def _clear_duration_filter(self):
         self.max_query_duration = 1 << 31
     def note_start(self):
@@ -295,3 +374,42 @@ class FixedFreqReader:
         self.clock_sync.set_last_chip_clock(seq * samples_per_block + i)
         del samples[count:]
         return samples
+    # Convert sensor_bulk_data responses into numpy arrays.  Returns a
+    # tuple (times, values) where 'values' contains a row of unpacked
+    # fields for each sample.  Requires get_numpy() to not be None.
+    def pull_sample_array(self):
+        np = self.numpy
+        dtype, fields_per_sample = self.sample_dtype
+        # Query MCU for sample timing and update clock synchronization
+        self._update_clock()
+        # Pull sensor_bulk_data messages from local queue
+        raw_samples = self.bulk_queue.pull_queue()
+        if not raw_samples:
+            return np.zeros(0), np.zeros((0, fields_per_sample), dtype)
+        # Locate the samples of every message
+        last_sequence = self.last_sequence
+        time_base, chip_base, inv_freq = self.clock_sync.get_time_translation()
+        bytes_per_sample = self.bytes_per_sample
+        samples_per_block = self.samples_per_block
+        datas = []
+        msg_cdiffs = []
+        counts = []
+        for params in raw_samples:
+            seq_diff = (params['sequence'] - last_sequence) & 0xffff
+            seq_diff -= (seq_diff & 0x8000) << 1
+            seq = last_sequence + seq_diff
+            data = params['data']
+            count = len(data) // bytes_per_sample
+            datas.append(data[:count * bytes_per_sample])
+            msg_cdiffs.append(seq * samples_per_block - chip_base)
+            counts.append(count)
+        self.clock_sync.set_last_chip_clock(seq * samples_per_block + count - 1)
+        # Unpack all samples and calculate their times
+        values = np.frombuffer(b"".join(datas), dtype)
+        values = values.reshape(-1, fields_per_sample)
+        counts = np.array(counts)
+        starts = np.cumsum(counts) - counts
+        msg_pos = np.arange(len(values)) - np.repeat(starts, counts)
+        msg_cdiffs = np.repeat(np.array(msg_cdiffs), counts)
+        times = time_base + (msg_cdiffs + msg_pos) * inv_freq
+        return times, values
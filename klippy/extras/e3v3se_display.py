@@ -53,6 +53,31 @@ class select_t:
             self.now = v - 1
         return self.changed()
 
+class widget_t:
+    """
+    Retained state of an area of the screen that is only redrawn when the
+    value shown in it changes.
+    """
+    def __init__(self, box=None):
+        # (x_start, y_start, x_end, y_end) cleared before a redraw, or None
+        # for widgets that fully overwrite their own background
+        self.box = box
+        self.value = None
+        self.blank = False
+
+    def invalidate(self, blank=False):
+        # Force a redraw on next update, blank is set when the area is
+        # already known to be cleared
+        self.value = None
+        self.blank = blank
+
+    def changed(self, value):
+        if value == self.value:
+            return False
+        self.value = value
+        return True
+
+
 class E3V3SEMenuKeys(MenuKeys):
     """
     E3V3SEMenuKeys is a subclass of MenuKeys designed to
@@ -138,6 +163,7 @@ class E3V3SEPrinterSerialBridge(PrinterSerialBridge):
         self.mcu.register_config_callback(self.build_config)
 
         self.input_buffer = ""
+        self.setup_pipeline(config, True)
 
         self.serial_bridge = self.printer.load_object(config, "serial_bridge")
         self.serial_bridge.setup_bridge(self)
@@ -565,6 +591,8 @@ class E3v3seDisplay:
         self._logging = config.getboolean("logging", False)
         self.gcode = self.printer.lookup_object("gcode")
         self.printer.register_event_handler("klippy:ready", self.handle_ready)
+        self.printer.register_event_handler("klippy:disconnect",
+                                            self.handle_disconnect)
         self.encoder_state = self.ENCODER_DIFF_NO
         language = config.get("language", "english")
         self.selected_language = self.languages[language]
@@ -593,13 +621,40 @@ class E3v3seDisplay:
         self.serial_bridge.register_callback(
             self._handle_serial_bridge_response)
 
-        self.lcd = TJC3224_LCD(self.serial_bridge)
+        # A pipelined bridge does its own pacing, so frames are handed over
+        # directly without pacing them in the lcd
+        lcd_reactor = self.reactor
+        if self.serial_bridge.pipelined:
+            lcd_reactor = None
+        self.lcd = TJC3224_LCD(self.serial_bridge, lcd_reactor,
+                               self.serial_bridge.baud)
         self.checkkey = self.MainMenu
         self.pd = PrinterData(config)
 
         self._update_interval = 1
         self._update_timer = self.reactor.register_timer(self.EachMomentUpdate)
 
+        # Retained widgets of the status area (bottom of the screen)
+        row_1 = (self.STATUS_Y, 293)
+        row_2 = (294, self.lcd.screen_height - 1)
+        self.status_widgets = {
+            "nozzle": widget_t((0, row_1[0], 98, row_1[1])),
+            "bed": widget_t((0, row_2[0], 98, row_2[1])),
+            "feedrate": widget_t((99, row_1[0], 164, row_1[1])),
+            "flow": widget_t((99, row_2[0], 164, row_2[1])),
+            "fan": widget_t((165, row_1[0], self.lcd.screen_width - 1,
+                             row_1[1])),
+            "z_offset": widget_t((165, row_2[0], self.lcd.screen_width - 1,
+                                  row_2[1])),
+        }
+        # Retained widgets of the printing screen, these are drawn with
+        # their own background so they don't need to be cleared
+        self.progress_widgets = {
+            "bar": widget_t(),
+            "elapsed": widget_t(),
+            "remain": widget_t(),
+        }
+
     def key_event(self, key, eventtime):
         if key == 'click':
             self.encoder_state = self.ENCODER_DIFF_ENTER
@@ -614,7 +669,11 @@ class E3v3seDisplay:
         elif key == 'fast_down':
             self.encoder_state = self.ENCODER_DIFF_FAST_CW
 
-        self.encoder_has_data()
+        self.lcd.begin_batch()
+        try:
+            self.encoder_has_data()
+        finally:
+            self.lcd.end_batch()
 
     def get_encoder_state(self):
         last_state = self.encoder_state
@@ -628,8 +687,12 @@ class E3v3seDisplay:
     def cmd_IconFinder(self, gcmd):
         self.checkkey = self.IconFinder
         self.select_icon_finder.reset()
-        self.Clear_Screen()
-        self.Draw_IconFinder()
+        self.lcd.begin_batch()
+        try:
+            self.Clear_Screen()
+            self.Draw_IconFinder()
+        finally:
+            self.lcd.end_batch()
 
     def send_text(self, text):
         self.serial_bridge.send_text(text)
@@ -655,6 +718,9 @@ class E3v3seDisplay:
         except Exception as e: 
             self.error("Error registering M117: %s" % e)
 
+    def handle_disconnect(self):
+        self.lcd.discard_pending()
+
     def handle_mcu_error(self):
         self.show_popup(self.printer.get_state_message())
 
@@ -691,7 +757,7 @@ class E3v3seDisplay:
         self.last_status = self.pd.status
         if self.pd.status == "printing":
             self.Goto_PrintProcess()
-            self.Draw_Status_Area(with_update)
+            self.Draw_Status_Area()
         elif self.pd.status in ["operational", "complete", "standby", "cancelled"]:
             self.Goto_MainMenu()
         else:
@@ -2464,74 +2530,57 @@ class E3v3seDisplay:
 
     # --------------------------------------------------------------#
 
-    def Draw_Status_Area(self, with_update=True):
-        #  Clear the bottom area of the screen
-        self.lcd.draw_rectangle(
-            1,
-            self.color_background_black,
-            0,
-            self.STATUS_Y,
-            self.lcd.screen_width,
-            self.lcd.screen_height - 1,
-        )
-
-        # nozzle temp area
-        if self.pd.nozzleIsHeating():
-            self.lcd.draw_icon(True, self.GIF_ICON, self.icon_nozzle_heating_0, 6, 262)
-        else:
-            self.lcd.draw_icon(True, self.ICON, self.icon_hotend_temp, 6, 262)
-
-        self.lcd.draw_int_value(
-            True,
-            True,
-            0,
-            self.lcd.font_8x8,
-            self.color_yellow if self.pd.nozzleIsHeating() else self.color_white,
-            self.color_background_black,
-            3,
-            26,
-            268,
-            self.pd.thermalManager["temp_hotend"][0]["celsius"],
-        )
-        self.lcd.draw_string(
-            False,
-            self.lcd.font_8x8,
-            self.color_white,
-            self.color_background_black,
-            26 + 3 * self.STAT_CHR_W + 4,
-            268,
-            "/",
-        )
-        self.lcd.draw_int_value(
-            False,
-            True,
-            0,
-            self.lcd.font_8x8,
-            self.color_white,
-            self.color_background_black,
-            3,
-            26 + 3 * self.STAT_CHR_W + 5,
-            268,
-            self.pd.thermalManager["temp_hotend"][0]["target"],
-        )
+    def Draw_Status_Area(self):
+        #  Clear the bottom area of the screen and draw every widget
+        self.Clear_Status_Area()
+        self.Update_Status_Area()
+
+    def Update_Status_Area(self):
+        # Only widgets whose value changed since they were last drawn are
+        # cleared and redrawn
+        self.Draw_Status_Nozzle()
+        self.Draw_Status_Bed()
+        self.Draw_Status_Percent(
+            "feedrate", self.icon_speed, 99, 262, self.pd.feedrate_percentage)
+        self.Draw_Status_Percent(
+            "flow", self.icon_MaxSpeedE, 99, 294, self.pd.extrusion_multiplier)
+        self.Draw_Status_Percent(
+            "fan", self.icon_FanSpeed, 165, 262, self.pd.fan_speed)
+        self.Draw_Status_ZOffset()
+
+    def Invalidate_Widgets(self, widgets, blank=False):
+        for widget in widgets.values():
+            widget.invalidate(blank)
+
+    def Widget_Changed(self, widget, value):
+        if not widget.changed(value):
+            return False
+        if widget.box is not None and not widget.blank:
+            self.lcd.draw_rectangle(
+                1, self.color_background_black, *widget.box)
+        widget.blank = False
+        return True
 
-        # bed temp area
-        if self.pd.bedIsHeating():
-            self.lcd.draw_icon(True, self.GIF_ICON, self.icon_bed_heating_0, 6, 294)
+    def Draw_Status_Temperature(self, widget, icon, heating_icon, y,
+                                heating, celsius, target):
+        if not self.Widget_Changed(widget, (heating, celsius, target)):
+            return
+        if heating:
+            self.lcd.draw_icon(True, self.GIF_ICON, heating_icon, 6, y)
         else:
-            self.lcd.draw_icon(True, self.ICON, self.icon_bedtemp, 6, 294)
+            self.lcd.draw_icon(True, self.ICON, icon, 6, y)
 
         self.lcd.draw_int_value(
             True,
             True,
             0,
             self.lcd.font_8x8,
-            self.color_yellow if self.pd.bedIsHeating() else self.color_white,
+            self.color_yellow if heating else self.color_white,
             self.color_background_black,
             3,
             26,
-            300,
-            self.pd.thermalManager["temp_bed"]["celsius"],
+            y + 6,
+            celsius,
         )
         self.lcd.draw_string(
             False,
@@ -2539,7 +2588,7 @@ class E3v3seDisplay:
             self.color_white,
             self.color_background_black,
             26 + 3 * self.STAT_CHR_W + 4,
-            300,
+            y + 6,
             "/",
         )
         self.lcd.draw_int_value(
@@ -2551,60 +2600,41 @@ class E3v3seDisplay:
             self.color_background_black,
             3,
             26 + 3 * self.STAT_CHR_W + 5,
-            300,
-            self.pd.thermalManager["temp_bed"]["target"],
+            y + 6,
+            target,
         )
 
-        # speed area
-        self.lcd.draw_icon(True, self.ICON, self.icon_speed, 99, 262)
-        self.lcd.draw_int_value(
-            True,
-            True,
-            0,
-            self.lcd.font_8x8,
-            self.color_white,
-            self.color_background_black,
-            3,
-            99 + 2 * self.STAT_CHR_W,
-            268,
-            self.pd.feedrate_percentage,
-        )
-        self.lcd.draw_string(
-            False,
-            self.lcd.font_8x8,
-            self.color_white,
-            self.color_background_black,
-            99 + 5 * self.STAT_CHR_W + 2,
-            268,
-            "%",
+    def Draw_Status_Nozzle(self):
+        # nozzle temp area
+        hotend = self.pd.thermalManager["temp_hotend"][0]
+        self.Draw_Status_Temperature(
+            self.status_widgets["nozzle"],
+            self.icon_hotend_temp,
+            self.icon_nozzle_heating_0,
+            262,
+            self.pd.nozzleIsHeating(),
+            hotend["celsius"],
+            hotend["target"],
         )
 
-        # extrude area
-        self.lcd.draw_icon(True, self.ICON, self.icon_MaxSpeedE, 99, 294)
-        self.lcd.draw_int_value(
-            True,
-            True,
-            0,
-            self.lcd.font_8x8,
-            self.color_white,
-            self.color_background_black,
-            3,
-            99 + 2 * self.STAT_CHR_W,
-            300,
-            self.pd.extrusion_multiplier,
-        )
-        self.lcd.draw_string(
-            False,
-            self.lcd.font_8x8,
-            self.color_white,
-            self.color_background_black,
-            99 + 5 * self.STAT_CHR_W + 2,
-            300,
-            "%",
+    def Draw_Status_Bed(self):
+        # bed temp area
+        bed = self.pd.thermalManager["temp_bed"]
+        self.Draw_Status_Temperature(
+            self.status_widgets["bed"],
+            self.icon_bedtemp,
+            self.icon_bed_heating_0,
+            294,
+            self.pd.bedIsHeating(),
+            bed["celsius"],
+            bed["target"],
         )
 
-        # fan speed area
-        self.lcd.draw_icon(True, self.ICON, self.icon_FanSpeed, 165, 262)
+    def Draw_Status_Percent(self, name, icon, x, y, value):
+        # speed, extrude and fan speed areas
+        if not self.Widget_Changed(self.status_widgets[name], value):
+            return
+        self.lcd.draw_icon(True, self.ICON, icon, x, y)
         self.lcd.draw_int_value(
             True,
             True,
@@ -2613,21 +2643,25 @@ class E3v3seDisplay:
             self.color_white,
             self.color_background_black,
             3,
-            165 + 2 * self.STAT_CHR_W,
-            268,
-            self.pd.fan_speed,
+            x + 2 * self.STAT_CHR_W,
+            y + 6,
+            value,
         )
         self.lcd.draw_string(
             False,
             self.lcd.font_8x8,
             self.color_white,
             self.color_background_black,
-            165 + 5 * self.STAT_CHR_W + 2,
-            268,
+            x + 5 * self.STAT_CHR_W + 2,
+            y + 6,
             "%",
         )
 
+    def Draw_Status_ZOffset(self):
         # Z offset area
+        value = self.pd.BABY_Z_VAR
+        if not self.Widget_Changed(self.status_widgets["z_offset"], value):
+            return
         self.lcd.draw_icon(True, self.ICON, self.icon_z_offset, 165, 294)
         self.lcd.draw_signed_float(
             True,
@@ -2638,12 +2672,9 @@ class E3v3seDisplay:
             3,
             191,
             300,
-            self.pd.BABY_Z_VAR * 1000,
+            value * 1000,
         )
 
-        if with_update:
-            time.sleep(0.005)
-
     def Draw_Title(self, title):
         self.lcd.draw_string(
             False,
@@ -2774,7 +2805,7 @@ class E3v3seDisplay:
     # Display an SD item
     def Draw_SDItem(self, item, row=0):
         fl = self.pd.GetFiles()[item]
-        if len(self.pd.fl[item].split('/')) > self.pd.subdirIndex + 1:
+        if self.pd.isDir(item):
             self.Draw_Menu_Line(row, self.icon_more, fl)
         else:
             self.Draw_Menu_Line(row, self.icon_file, fl)
@@ -2835,11 +2866,18 @@ class E3v3seDisplay:
     def Draw_Print_ProgressBar(self, Percentrecord=None):
         if not Percentrecord:
             Percentrecord = self.pd.getPercent()
-        progress_icon_id = self.icon_progress_0 + Percentrecord
+        progress_icon_id = self.icon_progress_0 + int(Percentrecord)
+        if not self.Widget_Changed(self.progress_widgets["bar"],
+                                   progress_icon_id):
+            return
         self.lcd.draw_icon(True, self.GIF_ICON, progress_icon_id, 12, 75)
 
     def Draw_Print_ProgressElapsed(self):
         elapsed = self.pd.duration()  # print timer
+        if not self.Widget_Changed(self.progress_widgets["elapsed"],
+                                   (int(elapsed / 3600),
+                                    int((elapsed % 3600) / 60))):
+            return
         self.lcd.draw_int_value(
             True,
             True,
@@ -2878,6 +2916,10 @@ class E3v3seDisplay:
         remain_time = self.pd.remain()
         if not remain_time:
             return  # time remaining is None during warmup.
+        if not self.Widget_Changed(self.progress_widgets["remain"],
+                                   (int(remain_time / 3600),
+                                    int((remain_time % 3600) / 60))):
+            return
         self.lcd.draw_int_value(
             True,
             True,
@@ -3747,6 +3789,7 @@ class E3v3seDisplay:
             self.lcd.screen_width,
             self.STATUS_Y,
         )
+        self.Invalidate_Widgets(self.progress_widgets, blank=True)
 
     def Clear_Status_Area(self):
         self.lcd.draw_rectangle(
@@ -3757,6 +3800,7 @@ class E3v3seDisplay:
             self.lcd.screen_width,
             self.lcd.screen_height,
         )
+        self.Invalidate_Widgets(self.status_widgets, blank=True)
 
     def Clear_Main_Window(self):
         self.Clear_Title_Bar()
@@ -3777,6 +3821,8 @@ class E3v3seDisplay:
             self.lcd.screen_width,
             self.lcd.screen_height,
         )
+        self.Invalidate_Widgets(self.progress_widgets, blank=True)
+        self.Invalidate_Widgets(self.status_widgets, blank=True)
 
     def Popup_window_PauseOrStop(self):
         self.Clear_Main_Window()
@@ -3888,11 +3934,15 @@ class E3v3seDisplay:
         self.lcd.draw_rectangle(0, self.color_white, 80, 154, 160, 185)
 
     def show_popup(self, message=""):
+        self.lcd.begin_batch()
         try:
             if not message or len(message) == 0:
                 return
 
             self.time_since_movement = 0
+            # The popup may be drawn over any retained widget
+            self.Invalidate_Widgets(self.progress_widgets)
+            self.Invalidate_Widgets(self.status_widgets)
             if self.checkkey != self.MessagePopup:
                 self.popup_caller = self.checkkey
             self.checkkey = self.MessagePopup
@@ -3934,6 +3984,8 @@ class E3v3seDisplay:
             # I imagine that on an extreme scenario where firmware_restart is called and this tries to communicate with the LCD
             # This could error out, very unlikely scenario, but either way it's better to catch it and log it
             self.error("Error in show_popup: %s" % e)
+        finally:
+            self.lcd.end_batch()
 
     def Erase_Menu_Cursor(self, line):
         self.lcd.draw_rectangle(
@@ -3990,7 +4042,7 @@ class E3v3seDisplay:
         self.index_file = self.MROWS
         self.Clear_Menu_Area()  # Leave title bar unchanged, clear only middle of screen
         self.Draw_Back_First()
-        fl = self.pd.GetFiles()
+        fl = self.pd.GetFiles(refresh=True)
         ed = len(fl)
         if ed > 0:
             if ed > self.MROWS:
@@ -4234,8 +4286,16 @@ class E3v3seDisplay:
     # --------------------------------------------------------------#
 
     def EachMomentUpdate(self, eventtime):
-        # variable update
-        update = self.pd.update_variable()
+        # Gather everything drawn in this pass into a single transmission
+        self.lcd.begin_batch()
+        try:
+            return self._each_moment_update(eventtime)
+        finally:
+            self.lcd.end_batch()
+
+    def _each_moment_update(self, eventtime):
+        # Fields sampled as changed since the last frame
+        update = bool(self.pd.pop_dirty())
         if self.last_status != self.pd.status:
             self.last_status = self.pd.status
             print(self.pd.status)
@@ -4292,10 +4352,10 @@ class E3v3seDisplay:
             if self.pd.ishomed():
                 self.CompletedHoming()
 
-        # If not in the following, draw the status area
+        # If not in the following, redraw the changed parts of the status area
         status_area_blocklist = [self.MainMenu, self.MessagePopup, self.Misc, self.ManualProbeProcess, self.IconFinder]
         if update and self.checkkey not in status_area_blocklist:
-            self.Draw_Status_Area(update)
+            self.Update_Status_Area()
 
         # Check for errors and/or incoming messages
         if self.display_status is not None and self.display_status.message and len(self.display_status.message) > 0 and self.last_display_status != self.display_status.message:
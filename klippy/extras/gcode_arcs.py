@@ -152,6 +152,7 @@ class ArcSupport:
                 e_base = currentPos[3]
             e_per_move = (asE - e_base) / segments
 
+        moves = []
         for i in range(1, int(segments) + 1):
             dist_Helical = i * linear_per_segment
             c_theta = i * theta_per_segment
@@ -168,7 +169,7 @@ class ArcSupport:
 
             if i == segments:
                 c = targetPos
-            # Convert coords into G1 commands
+            # Convert coords into G1 parameters
             g1_params = {'X': c[0], 'Y': c[1], 'Z': c[2]}
             if e_per_move:
                 g1_params['E'] = e_base + e_per_move
@@ -176,8 +177,8 @@ class ArcSupport:
                     e_base += e_per_move
             if asF is not None:
                 g1_params['F'] = asF
-            g1_gcmd = self.gcode.create_gcode_command("G1", "G1", g1_params)
-            self.gcode_move.cmd_G1(g1_gcmd)
+            moves.append(g1_params)
+        self.gcode_move.move_batch(gcmd, moves)
 
 def load_config(config):
     return ArcSupport(config)
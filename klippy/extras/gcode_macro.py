@@ -3,7 +3,11 @@
 # Copyright (C) 2018-2021  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import traceback, logging, ast, copy, json
+import traceback, logging, ast, copy, json, os
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 import jinja2
 
 
@@ -11,6 +15,103 @@ import jinja2
 # Template handling
 ######################################################################
 
+# Copy a value from a get_status() dict for use in a template
+def copy_status_value(value):
+    if type(value) is dict:
+        return StatusView(value)
+    if isinstance(value, (str, int, float, type(None))):
+        return value
+    return copy.deepcopy(value)
+
+# Copy-on-write view of a get_status() dict.  Values are only copied
+# when a template reads them (and nested dicts are wrapped in another
+# view), so a template that reads printer.toolhead.position does not
+# copy the rest of the status.  The view makes a private copy of its
+# contents if a template modifies it.
+class StatusView(MutableMapping):
+    def __init__(self, status):
+        self._status = status
+        self._values = {}
+        self._copy = None
+    def __getitem__(self, key):
+        if self._copy is not None:
+            return self._copy[key]
+        if key in self._values:
+            return self._values[key]
+        self._values[key] = res = copy_status_value(self._status[key])
+        return res
+    def __contains__(self, key):
+        if self._copy is not None:
+            return key in self._copy
+        return key in self._status
+    def __iter__(self):
+        if self._copy is not None:
+            return iter(self._copy)
+        return iter(self._status)
+    def __len__(self):
+        if self._copy is not None:
+            return len(self._copy)
+        return len(self._status)
+    def _get_copy(self):
+        if self._copy is None:
+            self._copy = dict([(key, self[key]) for key in self._status])
+        return self._copy
+    def __setitem__(self, key, value):
+        self._get_copy()[key] = value
+    def __delitem__(self, key):
+        del self._get_copy()[key]
+    def copy(self):
+        return dict(self.items())
+    def __repr__(self):
+        return repr(self.copy())
+    __str__ = __repr__
+
+# Replace any status views in a value with plain dicts
+def unwrap_status(value):
+    if isinstance(value, (StatusView, dict)):
+        return dict([(k, unwrap_status(v)) for k, v in value.items()])
+    if type(value) in (list, tuple):
+        return [unwrap_status(v) for v in value]
+    return value
+
+def _json_default(value):
+    if isinstance(value, StatusView):
+        return value.copy()
+    raise TypeError("Object of type %s is not JSON serializable"
+                    % (type(value).__name__,))
+
+# Compiled templates are kept in memory, so they are not compiled again
+# on a printer restart, and optionally in a directory on disk
+class TemplateBytecodeCache(jinja2.BytecodeCache):
+    def __init__(self):
+        self.bytecode = {}
+        self.file_cache = None
+    def set_directory(self, directory):
+        self.file_cache = None
+        if directory is not None:
+            self.file_cache = jinja2.FileSystemBytecodeCache(directory)
+    def load_bytecode(self, bucket):
+        code = self.bytecode.get(bucket.key)
+        if code is not None:
+            bucket.bytecode_from_string(code)
+        if bucket.code is None and self.file_cache is not None:
+            try:
+                self.file_cache.load_bytecode(bucket)
+            except Exception:
+                logging.exception("Unable to load template bytecode")
+                bucket.reset()
+            if bucket.code is not None:
+                self.bytecode[bucket.key] = bucket.bytecode_to_string()
+    def dump_bytecode(self, bucket):
+        self.bytecode[bucket.key] = bucket.bytecode_to_string()
+        if self.file_cache is not None:
+            try:
+                self.file_cache.dump_bytecode(bucket)
+            except Exception:
+                logging.exception("Unable to store template bytecode")
+
+bytecode_cache = TemplateBytecodeCache()
+
 # Wrapper for access to printer object get_status() methods
 class GetStatusWrapper:
     def __init__(self, printer, eventtime=None):
@@ -26,7 +127,7 @@ class GetStatusWrapper:
             raise KeyError(val)
         if self.eventtime is None:
             self.eventtime = self.printer.get_reactor().monotonic()
-        self.cache[sval] = res = copy.deepcopy(po.get_status(self.eventtime))
+        self.cache[sval] = res = StatusView(po.get_status(self.eventtime))
         return res
     def __contains__(self, val):
         try:
@@ -43,18 +144,23 @@ class GetStatusWrapper:
 class TemplateWrapper:
     def __init__(self, printer, env, name, script):
         self.printer = printer
+        self.reactor = printer.get_reactor()
         self.name = name
         self.gcode = self.printer.lookup_object('gcode')
         gcode_macro = self.printer.lookup_object('gcode_macro')
         self.create_template_context = gcode_macro.create_template_context
+        self.render_count = 0
+        self.render_time = self.render_max = 0.
         try:
-            self.template = env.from_string(script)
+            self.template = gcode_macro.compile_template(env, name, script)
         except Exception as e:
             msg = "Error loading template '%s': %s" % (
                  name, traceback.format_exception_only(type(e), e)[-1])
             logging.exception(msg)
             raise printer.config_error(msg)
+        gcode_macro.register_template(self)
     def render(self, context=None):
+        start_time = self.reactor.monotonic()
         if context is None:
             context = self.create_template_context()
         try:
@@ -64,6 +170,14 @@ class TemplateWrapper:
                 self.name, traceback.format_exception_only(type(e), e)[-1])
             logging.exception(msg)
             raise self.gcode.error(msg)
+        finally:
+            render_time = self.reactor.monotonic() - start_time
+            self.render_count += 1
+            self.render_time += render_time
+            self.render_max = max(self.render_max, render_time)
+    def get_render_stats(self):
+        return {'count': self.render_count, 'total': self.render_time,
+                'max': self.render_max}
     def run_gcode_from_command(self, context=None):
         self.gcode.run_script_from_command(self.render(context))
 
@@ -71,7 +185,39 @@ class TemplateWrapper:
 class PrinterGCodeMacro:
     def __init__(self, config):
         self.printer = config.get_printer()
-        self.env = jinja2.Environment('{%', '%}', '{', '}')
+        cache_directory = config.get('cache_directory', None)
+        if cache_directory is not None:
+            cache_directory = os.path.expanduser(cache_directory)
+            if not os.path.isdir(cache_directory):
+                raise config.error("Template cache directory '%s' not found"
+                                   % (cache_directory,))
+        bytecode_cache.set_directory(cache_directory)
+        # Templates are compiled via a loader so that compiled templates
+        # may be found in the bytecode cache
+        self.scripts = {}
+        self.env = jinja2.Environment(
+            '{%', '%}', '{', '}',
+            loader=jinja2.FunctionLoader(self.scripts.get),
+            bytecode_cache=bytecode_cache, cache_size=0)
+        self.env.policies['json.dumps_kwargs'] = {
+            'sort_keys': True, 'default': _json_default}
+        self.templates = []
+        webhooks = self.printer.lookup_object('webhooks')
+        webhooks.register_endpoint("gcode_macro/dump_render_times",
+                                   self._handle_dump_render_times)
+    def compile_template(self, env, name, script):
+        if env is not self.env:
+            return env.from_string(script)
+        self.scripts[name] = script
+        try:
+            return env.get_template(name)
+        finally:
+            del self.scripts[name]
+    def register_template(self, template):
+        self.templates.append(template)
+    def _handle_dump_render_times(self, web_request):
+        web_request.send({'templates': dict(
+            [(t.name, t.get_render_stats()) for t in self.templates])})
     def load_template(self, config, option, default=None):
         name = "%s:%s" % (config.get_name(), option)
         if default is None:
@@ -90,7 +236,7 @@ class PrinterGCodeMacro:
     def _action_call_remote_method(self, method, **kwargs):
         webhooks = self.printer.lookup_object('webhooks')
         try:
-            webhooks.call_remote_method(method, **kwargs)
+            webhooks.call_remote_method(method, **unwrap_status(kwargs))
         except self.printer.command_error:
             logging.exception("Remote Call Error")
         return ""
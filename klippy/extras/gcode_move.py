@@ -110,9 +110,8 @@ class GCodeMove:
         if self.is_printer_ready:
             self.last_position = self.position_with_transform()
     # G-Code movement commands
-    def cmd_G1(self, gcmd):
-        # Move
-        params = gcmd.get_command_parameters()
+    def _update_position(self, gcmd, params):
+        # Apply the parameters of a G1 style move to last_position/speed
         try:
             for pos, axis in enumerate('XYZ'):
                 if axis in params:
@@ -140,7 +139,25 @@ class GCodeMove:
         except ValueError as e:
             raise gcmd.error("Unable to parse move '%s'"
                              % (gcmd.get_commandline(),))
+    def cmd_G1(self, gcmd):
+        # Move
+        self._update_position(gcmd, gcmd.get_command_parameters())
         self.move_with_transform(self.last_position, self.speed)
+    def _iter_batch_moves(self, gcmd, params_list):
+        # The position is updated as each move is queued
+        for params in params_list:
+            self._update_position(gcmd, params)
+            yield list(self.last_position), self.speed
+    def move_batch(self, gcmd, params_list):
+        # Queue a list of G1 style moves generated by a single command
+        moves = self._iter_batch_moves(gcmd, params_list)
+        if self.move_transform is None:
+            self.printer.lookup_object('toolhead').move_batch(moves)
+        elif hasattr(self.move_transform, 'move_batch'):
+            self.move_transform.move_batch(moves)
+        else:
+            for newpos, speed in moves:
+                self.move_with_transform(newpos, speed)
     # G-Code coordinate manipulation
     def cmd_G20(self, gcmd):
         # Set units to inches
@@ -91,7 +91,8 @@ class LIS2DW:
         self.name = config.get_name().split()[-1]
         hdr = ('time', 'x_acceleration', 'y_acceleration', 'z_acceleration')
         self.batch_bulk.add_mux_endpoint("lis2dw/dump_lis2dw", "sensor",
-                                         self.name, {'header': hdr})
+                                         self.name, {'header': hdr},
+                                         binary_format='<dfff')
     def _build_config(self):
         cmdqueue = self.bus.get_command_queue()
         self.query_lis2dw_cmd = self.mcu.lookup_command(
@@ -192,8 +193,14 @@ class LIS2DW:
         logging.info("LIS2DW finished '%s' measurements", self.name)
         self.set_reg(REG_LIS2DW_FIFO_CTRL, 0x00)
     def _process_batch(self, eventtime):
-        samples = self.ffreader.pull_samples()
-        self._convert_samples(samples)
+        np = self.ffreader.get_numpy()
+        if np is not None:
+            times, raw_xyz = self.ffreader.pull_sample_array()
+            samples = adxl345.convert_accel_array(np, times, raw_xyz,
+                                                  self.axes_map)
+        else:
+            samples = self.ffreader.pull_samples()
+            self._convert_samples(samples)
         if not samples:
             return {}
         return {'data': samples, 'errors': self.last_error_count,
@@ -82,7 +82,8 @@ class MPU9250:
         self.name = config.get_name().split()[-1]
         hdr = ('time', 'x_acceleration', 'y_acceleration', 'z_acceleration')
         self.batch_bulk.add_mux_endpoint("mpu9250/dump_mpu9250", "sensor",
-                                         self.name, {'header': hdr})
+                                         self.name, {'header': hdr},
+                                         binary_format='<dfff')
     def _build_config(self):
         cmdqueue = self.i2c.get_command_queue()
         self.mcu.add_config_cmd("config_mpu9250 oid=%d i2c_oid=%d"
@@ -161,8 +162,14 @@ class MPU9250:
         self.set_reg(REG_PWR_MGMT_1, SET_PWR_MGMT_1_SLEEP)
         self.set_reg(REG_PWR_MGMT_2, SET_PWR_MGMT_2_OFF)
     def _process_batch(self, eventtime):
-        samples = self.ffreader.pull_samples()
-        self._convert_samples(samples)
+        np = self.ffreader.get_numpy()
+        if np is not None:
+            times, raw_xyz = self.ffreader.pull_sample_array()
+            samples = adxl345.convert_accel_array(np, times, raw_xyz,
+                                                  self.axes_map)
+        else:
+            samples = self.ffreader.pull_samples()
+            self._convert_samples(samples)
         if not samples:
             return {}
         return {'data': samples, 'errors': self.last_error_count,
@@ -5,6 +5,9 @@ with no to minimal changes. All credits go to the original author.
 """
 import logging
 
+# Status sampling interval used until the hotend report time is known
+DEFAULT_SAMPLE_INTERVAL = 0.300
+
 
 class xyze_t:
     x = 0.0
@@ -144,9 +147,11 @@ class PrinterData:
         material_preset_t("PLA", 200, 60),
         material_preset_t("ABS", 210, 100),
     ]
-    subdirs = []
     subdirIndex = 0
     fl = []
+    names = []
+    dir_count = 0
+    files_path = None
     subdirPath = ''
 
     MACHINE_SIZE = "220x220x250"
@@ -162,11 +167,37 @@ class PrinterData:
         self._logging = config.getboolean("logging", False)
         self.gcode = self.printer.lookup_object("gcode")
         self.status = None
+        self.job_Info = {}
+        self.virtual_sdcard_stats = {}
+        # Fields changed since the display last called pop_dirty()
+        self.dirty = set()
+        self.sample_interval = DEFAULT_SAMPLE_INTERVAL
 
     def handle_ready(self):
+        # Cache the status objects used by the display
+        self.gcode_move = self.printer.lookup_object("gcode_move")
+        self.heater_bed = self.printer.lookup_object("heater_bed")
+        self.extruder = self.printer.lookup_object("extruder")
+        self.fan = self.printer.lookup_object("fan")
+        self.print_stats = self.printer.lookup_object("print_stats")
+        self.virtual_sdcard = self.printer.lookup_object("virtual_sdcard")
+        # Sample at the rate the hotend temperature is reported
+        sensor = self.extruder.get_heater().sensor
+        self.sample_interval = sensor.get_report_time_delta()
         self.update_variable()
         self.get_additional_values()
- 
+        self.reactor.register_timer(self._sample_event, self.reactor.NOW)
+
+    def _sample_event(self, eventtime):
+        self.update_variable(eventtime)
+        return eventtime + self.sample_interval
+
+    def pop_dirty(self):
+        # Return (and clear) the fields changed since the last call, so a
+        # field is reported at most once per display frame
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
 
     def get_additional_values(self):
         toolhead = self.printer.lookup_object(
@@ -224,50 +255,32 @@ class PrinterData:
         self.log("postREST called")
 
 
-    def GetFiles(self):
-        sdcard = self.printer.lookup_object('virtual_sdcard')
-        files = sdcard.get_file_list(True)
-        self.subdirIndex = len(self.subdirPath.split('/')) if self.subdirPath else 0
-        self.fl = []
-        self.names = []
-        self.subdirs = []
-
-        # Find all folders in current subdirectory
-        for file, _ in files:
-            path = file.split('/')
-            if(file.startswith(self.subdirPath)):
-                name = path[self.subdirIndex]
-                if len(path) > self.subdirIndex + 1:
-                    if not name in self.subdirs:
-                        self.subdirs.append(name) # add to checked subdirs
-                        self.names.append(name) # add only the name
-                        self.fl.append(file) # add full filepath
-
-        # Find all files
-        for file, _ in files:
-            path = file.split('/')
-            if file.startswith(self.subdirPath) :
-                name = path[self.subdirIndex]
-                if len(path) == self.subdirIndex + 1:
-                    self.names.append(path[self.subdirIndex])
-                    self.fl.append(file)
-        
+    def GetFiles(self, refresh=False):
+        # The listing of the current folder is kept until it is reopened,
+        # so paging through it doesn't touch the filesystem
+        if refresh or self.files_path != self.subdirPath:
+            sdcard = self.printer.lookup_object('virtual_sdcard')
+            dirs, files = sdcard.get_dir_listing(self.subdirPath)
+            prefix = self.subdirPath + '/' if self.subdirPath else ''
+            self.subdirIndex = 0
+            if self.subdirPath:
+                self.subdirIndex = len(self.subdirPath.split('/'))
+            self.names = dirs + files
+            self.fl = [prefix + name for name in self.names]
+            self.dir_count = len(dirs)
+            self.files_path = self.subdirPath
         return self.names
+
+    def isDir(self, index):
+        # Folders are listed before files
+        return index < self.dir_count
     
     def selectFile(self, index):
-        file = self.fl[index]
-        if len(file.split('/')) == self.subdirIndex + 1:
+        if not self.isDir(index):
             return True
-        else:
-            if(self.subdirPath):
-                currentPath = self.subdirPath.split('/')
-            else:
-                currentPath = []
-            newDir = file.split('/')[self.subdirIndex]
-            self.subdirIndex += 1
-            currentPath.append(newDir)
-            self.subdirPath = '/'.join(currentPath)
-            return False
+        self.subdirIndex += 1
+        self.subdirPath = self.fl[index]
+        return False
 
     def fileListBack(self):
         self.subdirIndex -= 1
@@ -275,69 +288,69 @@ class PrinterData:
         path.pop(-1)
         self.subdirPath = '/'.join(path)
 
-    def update_variable(self):
-        gcm = self.printer.lookup_object(
-            "gcode_move").get_status(self.reactor.monotonic())
+    def update_variable(self, eventtime=None):
+        if eventtime is None:
+            eventtime = self.reactor.monotonic()
+        gcm = self.gcode_move.get_status(eventtime)
         z_offset = gcm["homing_origin"][2]  # z offset
         extrusionMultiplier = gcm["extrude_factor"] * 100  # flow rate percent
         self.absolute_moves = gcm["absolute_coordinates"]  # absolute or relative
         self.absolute_extrude = gcm["absolute_extrude"]  # absolute or relative
-        speed = gcm["speed"]  # current speed in mm/s
         print_speed = gcm["speed_factor"] * 100  # print speed percent
-        bed = self.printer.lookup_object(
-            "heater_bed").get_status(self.reactor.monotonic())
-        extruder = self.printer.lookup_object(
-            "extruder").get_status(self.reactor.monotonic())
-        fan = self.printer.lookup_object(
-            "fan").get_status(self.reactor.monotonic())
+        bed = self.heater_bed.get_status(eventtime)
+        extruder = self.extruder.get_status(eventtime)
+        fan = self.fan.get_status(eventtime)
         fanSpeed = fan['speed'] * 100
-        Update = False
+        dirty = set()
         try:
             if self.thermalManager["temp_bed"]["celsius"] != int(bed["temperature"]):
                 self.thermalManager["temp_bed"]["celsius"] = int(bed["temperature"])
-                Update = True
+                dirty.add("bed_temp")
             if self.thermalManager["temp_bed"]["target"] != int(bed["target"]):
                 self.thermalManager["temp_bed"]["target"] = int(bed["target"])
-                Update = True
+                dirty.add("bed_target")
             if self.thermalManager["temp_hotend"][0]["celsius"] != int(
                 extruder["temperature"]
             ):
                 self.thermalManager["temp_hotend"][0]["celsius"] = int(
                     extruder["temperature"]
                 )
-                Update = True
+                dirty.add("nozzle_temp")
             if self.thermalManager["temp_hotend"][0]["target"] != int(
                 extruder["target"]
             ):
                 self.thermalManager["temp_hotend"][0]["target"] = int(
                     extruder["target"]
                 )
-                Update = True
+                dirty.add("nozzle_target")
             if self.thermalManager["fan_speed"][0] != int(fan["speed"] * 100):
                 self.thermalManager["fan_speed"][0] = int(fan["speed"] * 100)
-                Update = True
+                dirty.add("fan_speed")
             if self.feedrate_percentage != print_speed:
                 self.feedrate_percentage = print_speed
-                Update = True
+                dirty.add("feedrate")
             if self.extrusion_multiplier != extrusionMultiplier:
                 self.extrusion_multiplier = extrusionMultiplier
-                Update = True
+                dirty.add("flow")
             if self.fan_speed != fanSpeed:
                 self.fan_speed = fanSpeed
-                Update = True
+                dirty.add("fan_speed")
             if self.BABY_Z_VAR != z_offset:
                 self.BABY_Z_VAR = z_offset
                 self.HMI_ValueStruct.offset_value = z_offset * 100
-                Update = True
+                dirty.add("z_offset")
         except:
             pass  # missing key, shouldn't happen, fixes misses on conditionals ¯\_(ツ)_/¯
-        self.job_Info = self.printer.lookup_object(
-            "print_stats").get_status(self.reactor.monotonic())
+        self.virtual_sdcard_stats = self.virtual_sdcard.get_status(eventtime)
+        self.job_Info = self.print_stats.get_status(eventtime)
         if self.job_Info:
             self.file_name = self.job_Info["filename"]
-            self.status = self.job_Info["state"]
+            if self.status != self.job_Info["state"]:
+                self.status = self.job_Info["state"]
+                dirty.add("status")
             self.HMI_flag.print_finish = self.getPercent() == 100.0
-        return Update
+        self.dirty |= dirty
+        return bool(dirty)
 
     def printingIsPaused(self):
         return (
@@ -346,16 +359,12 @@ class PrinterData:
         )
 
     def getPercent(self):
-        self.virtual_sdcard_stats = self.printer.lookup_object(
-            "virtual_sdcard").get_status(self.reactor.monotonic())
         if self.virtual_sdcard_stats:
             if self.virtual_sdcard_stats["is_active"]:
                 return self.virtual_sdcard_stats["progress"] * 100
         return 0
 
     def duration(self):
-        self.virtual_sdcard_stats = self.printer.lookup_object(
-            "virtual_sdcard").get_status(self.reactor.monotonic())
         if self.virtual_sdcard_stats:
             if self.virtual_sdcard_stats["is_active"]:
                 return self.job_Info["print_duration"]
@@ -417,14 +426,12 @@ class PrinterData:
         self.setExtTemp(exttemp)
     
     def bedIsHeating(self):
-        bed = self.printer.lookup_object(
-            "heater_bed").get_status(self.reactor.monotonic())
-        return (int(bed["target"]) > int(bed["temperature"])) if bed else False
+        bed = self.thermalManager["temp_bed"]
+        return bed["target"] > bed["celsius"]
          
     def nozzleIsHeating(self):
-        extruder = self.printer.lookup_object(
-            "extruder").get_status(self.reactor.monotonic())
-        return (int(extruder["target"]) > int(extruder["temperature"])) if extruder else False
+        extruder = self.thermalManager["temp_hotend"][0]
+        return extruder["target"] > extruder["celsius"]
     
     
     def openAndPrintFile(self, file):
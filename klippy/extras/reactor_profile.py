@@ -0,0 +1,37 @@
+# Reactor callback profiling and stall detection
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+
+class ReactorProfile:
+    def __init__(self, config):
+        self.printer = config.get_printer()
+        stall_threshold = config.getfloat('stall_threshold', 0.100,
+                                          above=0.)
+        self.profiler = self.printer.get_reactor().setup_profiling(
+            stall_threshold)
+        self.last_stalls = 0
+        self.printer.register_event_handler("klippy:disconnect",
+                                            self._handle_disconnect)
+        # Register webhook
+        webhooks = self.printer.lookup_object('webhooks')
+        webhooks.register_endpoint("reactor_profile/dump",
+                                   self._handle_dump)
+    def _handle_disconnect(self):
+        self.profiler.stop()
+    def _handle_dump(self, web_request):
+        web_request.send(self.profiler.get_status())
+    def stats(self, eventtime):
+        callbacks = self.profiler.callbacks
+        if not callbacks:
+            return (False, "reactor_max=0.000")
+        name, hist = max(callbacks.items(), key=lambda i: i[1].max)
+        stalls = sum([h.stalls for h in callbacks.values()])
+        new_stalls = stalls - self.last_stalls
+        self.last_stalls = stalls
+        return (new_stalls > 0, "reactor_max=%.3f(%s) reactor_stalls=%d"
+                % (hist.max, name, stalls))
+
+def load_config(config):
+    return ReactorProfile(config)
@@ -258,6 +258,13 @@ class ResonanceTester:
                     for chip in accel_chips:
                         aclient = chip.start_internal_client()
                         raw_values.append((axis, aclient, chip.name))
+                # Process the samples during the test unless the raw
+                # data must also be written out
+                streams = {}
+                if helper is not None and raw_name_suffix is None:
+                    for chip_axis, aclient, chip_name in raw_values:
+                        streams[aclient] = helper.stream_accelerometer_data(
+                                aclient)
 
                 # Generate moves
                 test_seq = self.generator.gen_test()
@@ -280,7 +287,8 @@ class ResonanceTester:
                         raise gcmd.error(
                             "accelerometer '%s' measured no data" % (
                                 chip_name,))
-                    new_data = helper.process_accelerometer_data(aclient)
+                    new_data = helper.process_accelerometer_data(
+                            streams.get(aclient, aclient))
                     if calibration_data[axis] is None:
                         calibration_data[axis] = new_data
                     else:
@@ -3,9 +3,15 @@
 # Copyright (C) 2019-2020  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, re
+import logging, re, collections
+import msgproto
 
 QUERY_TIME = 0.2
+# Size of the firmware transmit buffer of a bridge (SERIAL_BRIDGE_RX_BUFF_SIZE)
+TX_BUFFER_SIZE = 192
+# Largest text that fits in a single serial_bridge_send message (the msgid
+# and oid may each take two bytes, plus one byte for the string length)
+MAX_CHUNK_SIZE = msgproto.MESSAGE_PAYLOAD_MAX - 5
 
 class SerialBridge:
     def __init__(self, config):
@@ -115,10 +121,22 @@ class PrinterSerialBridge:
         self.mcu.register_config_callback(self.build_config)
 
         self.input_buffer = ""
+        self.setup_pipeline(config, False)
 
         self.serial_bridge = self.printer.load_object(config, "serial_bridge")
         self.serial_bridge.setup_bridge(self)
 
+    def setup_pipeline(self, config, default):
+        # High throughput mode: outgoing data is queued, sent in mcu sized
+        # chunks and throttled so the firmware transmit buffer never overflows
+        self.pipelined = config.getboolean("pipelined", default)
+        self.tx_queue = collections.deque()
+        self.tx_credits = TX_BUFFER_SIZE
+        self.tx_credit_time = 0.
+        self.tx_timer = None
+        if self.pipelined:
+            self.tx_timer = self.reactor.register_timer(self._transmit_event)
+
     def register_callback(self, callback):
         self.callbacks.append(callback)
 
@@ -129,6 +147,9 @@ class PrinterSerialBridge:
         self.send_serial(msg.encode('utf-8'))
     
     def write(self, msg):
+        if self.pipelined:
+            self.queue_send(msg)
+            return
         #byte_debug = ' '.join(['0x{:02x}'.format(byte) for byte in msg])
         #self.log("Sending bytes: " + byte_debug)
         self.serial_bridge_send_cmd.send([self.oid, msg, 4])
@@ -139,13 +160,39 @@ class PrinterSerialBridge:
             self.warn("Can't send message in a disconnected state")
             return
 
-        chunks = self.chunkstring(
-            msg + self.serial_bridge.perform_replacement(self.eol), 40)
+        msg = msg + self.serial_bridge.perform_replacement(self.eol)
+        if self.pipelined:
+            self.queue_send(msg)
+            return
+        chunks = self.chunkstring(msg, 40)
         for chunk in chunks:
-            byte_debug = ' '.join(['0x{:02x}'.format(byte) for byte in chunk])
-            self.log("Sending message: " + byte_debug)
+            self.log_bytes("Sending message: ", chunk)
             self.serial_bridge_send_cmd.send([self.oid, chunk, 4])
 
+    def queue_send(self, msg):
+        was_idle = not self.tx_queue
+        self.tx_queue.extend(self.chunkstring(bytes(msg), MAX_CHUNK_SIZE))
+        if was_idle and self.tx_queue:
+            self.reactor.update_timer(self.tx_timer, self.reactor.NOW)
+
+    def _transmit_event(self, eventtime):
+        # The firmware does not acknowledge transmitted bytes, so credits
+        # are returned as the bytes drain from its buffer at the baud rate
+        byte_time = 10. / self.baud
+        elapsed = max(0., eventtime - self.tx_credit_time)
+        self.tx_credits = min(TX_BUFFER_SIZE,
+                              self.tx_credits + int(elapsed / byte_time))
+        self.tx_credit_time = eventtime
+        while self.tx_queue and len(self.tx_queue[0]) <= self.tx_credits:
+            chunk = self.tx_queue.popleft()
+            self.log_bytes("Sending message: ", chunk)
+            self.serial_bridge_send_cmd.send([self.oid, chunk])
+            self.tx_credits -= len(chunk)
+        if not self.tx_queue:
+            return self.reactor.NEVER
+        missing = len(self.tx_queue[0]) - self.tx_credits
+        return eventtime + missing * byte_time
+
     def build_config(self):
         rest_ticks = self.mcu.seconds_to_clock(QUERY_TIME)
         clock = self.mcu.get_query_slot(self.oid)
@@ -177,11 +224,16 @@ class PrinterSerialBridge:
 
     def handle_disconnect(self):
         self._ready = False
+        self.tx_queue.clear()
 
     def log(self, msg, *args, **kwargs):
         if self._logging:
             logging.info("SERIAL BRIDGE %s: " % (self.name) + str(msg) )
 
+    def log_bytes(self, prefix, data):
+        if self._logging:
+            self.log(prefix + ' '.join(['0x{:02x}'.format(b) for b in data]))
+
     def warn(self, msg, *args, **kwargs):
         logging.warning("SERIAL BRIDGE %s: " % (self.name) + str(msg))
 
@@ -15,6 +15,13 @@ TEST_DAMPING_RATIOS=[0.075, 0.1, 0.15]
 
 AUTOTUNE_SHAPERS = ['zv', 'mzv', 'ei', '2hump_ei', '3hump_ei']
 
+# Number of test frequencies evaluated at once while fitting a shaper
+FIT_BLOCK_SIZE = 64
+
+# Just some empirically chosen value which produces good projections
+# for max_accel without much smoothing
+TARGET_SMOOTHING = 0.12
+
 ######################################################################
 # Frequency response calculation and shaper auto-tuning
 ######################################################################
@@ -55,6 +62,113 @@ class CalibrationData:
         return self._psd_map[axis]
 
 
+# Incrementally calculate the power spectral density of accelerometer
+# samples (using Welch's algorithm) as they arrive.  Only the samples
+# of the last incomplete window are kept in memory.
+class FreqResponseAccumulator:
+    def __init__(self, numpy):
+        self.numpy = numpy
+        self.nfft = None
+        self.window = None
+        self.pending = None
+        self.psd_sums = None
+        self.n_windows = self.sample_count = 0
+        self.first_time = self.last_time = 0.
+    def add_samples(self, data):
+        np = self.numpy
+        if self.pending is None:
+            self.pending = data
+            self.first_time = data[0,0]
+        else:
+            self.pending = np.concatenate((self.pending, data))
+        self.sample_count += len(data)
+        self.last_time = data[-1,0]
+        if self.nfft is None:
+            # Choose the window size once the sampling rate is known
+            T = self.last_time - self.first_time
+            if T < WINDOW_T_SEC:
+                return
+            sampling_freq = self.sample_count / T
+            self.nfft = 1 << int(sampling_freq * WINDOW_T_SEC - 1).bit_length()
+            self.window = np.kaiser(self.nfft, 6.)
+            self.psd_sums = np.zeros((3, self.nfft // 2 + 1))
+        nfft = self.nfft
+        step = nfft - nfft // 2
+        n_windows = (len(self.pending) - nfft // 2) // step
+        if n_windows <= 0:
+            return
+        # Accumulate the frequency response of each complete window
+        x = self.pending[:(n_windows - 1) * step + nfft, 1:]
+        strides = (x.strides[0], step * x.strides[0], x.strides[1])
+        x = np.lib.stride_tricks.as_strided(
+                x, shape=(nfft, n_windows, 3), strides=strides,
+                writeable=False)
+        x = self.window[:, None, None] * (x - np.mean(x, axis=0))
+        result = np.fft.rfft(x, n=nfft, axis=0)
+        self.psd_sums += (result.real**2 + result.imag**2).sum(axis=1).T
+        self.n_windows += n_windows
+        self.pending = self.pending[n_windows * step:].copy()
+    def get_calibration_data(self):
+        np = self.numpy
+        if not self.n_windows:
+            return None
+        sampling_freq = self.sample_count / (self.last_time - self.first_time)
+        # Compensation for windowing loss
+        scale = 1.0 / (self.window**2).sum()
+        px, py, pz = self.psd_sums * (scale / (sampling_freq * self.n_windows))
+        # For one-sided FFT output the response must be doubled, except
+        # the last point for unpaired Nyquist frequency (assuming even nfft)
+        # and the 'DC' term (0 Hz)
+        for psd in (px, py, pz):
+            psd[1:-1] *= 2.
+        freqs = np.fft.rfftfreq(self.nfft, 1. / sampling_freq)
+        return CalibrationData(freqs, px+py+pz, px, py, pz)
+
+
+# The impulse times of all shapers scale with 1/shaper_freq, so the
+# smoothing of a shaper type (for a given damping ratio) is
+#   max((c_scv * scv + c_90 * accel / freq) / freq, c_180 * accel / freq**2)
+# and only these coefficients need to be calculated for each shaper type.
+class ShaperSmoothing:
+    def __init__(self, shaper_cfg, damping_ratio):
+        A, T = shaper_cfg.init_func(1., damping_ratio)
+        inv_D = 1. / sum(A)
+        n = len(T)
+        # Calculate input shaper shift
+        ts = sum([A[i] * T[i] for i in range(n)]) * inv_D
+        # Calculate offset coefficients for 90 and 180 degrees turn
+        c_scv = c_90 = c_180 = 0.
+        for i in range(n):
+            if T[i] >= ts:
+                c_scv += A[i] * (T[i]-ts)
+                c_90 += A[i] * .5 * (T[i]-ts)**2
+            c_180 += A[i] * .5 * (T[i]-ts)**2
+        self.c_scv = c_scv * inv_D * math.sqrt(2.)
+        self.c_90 = c_90 * inv_D * math.sqrt(2.)
+        self.c_180 = c_180 * inv_D
+    def get_smoothing(self, freq, accel=5000, scv=5.):
+        inv_freq = 1. / freq
+        offset_90 = (self.c_scv * scv + self.c_90 * accel * inv_freq) * inv_freq
+        offset_180 = self.c_180 * accel * inv_freq**2
+        return max(offset_90, offset_180)
+    def get_max_accel(self, freq, scv, smoothing=TARGET_SMOOTHING):
+        # Maximum acceleration that keeps the smoothing within the target
+        max_accel = smoothing * freq**2 / self.c_180
+        if self.c_90:
+            max_accel = min(max_accel, (smoothing * freq - self.c_scv * scv)
+                            * freq / self.c_90)
+        return max(max_accel, 0.)
+
+shaper_smoothing_cache = {}
+def get_shaper_smoothing(shaper_cfg, damping_ratio):
+    key = (shaper_cfg.name, damping_ratio)
+    smoothing = shaper_smoothing_cache.get(key)
+    if smoothing is None:
+        smoothing = ShaperSmoothing(shaper_cfg, damping_ratio)
+        shaper_smoothing_cache[key] = smoothing
+    return smoothing
+
+
 CalibrationResult = collections.namedtuple(
         'CalibrationResult',
         ('name', 'freq', 'vals', 'vibrs', 'smoothing', 'score', 'max_accel'))
@@ -72,11 +186,15 @@ class ShaperCalibrate:
                     "docs/Measuring_Resonances.md for more details).")
 
     def background_process_exec(self, method, args):
+        return self.background_process_exec_all(method, [args])[0]
+
+    def background_process_exec_all(self, method, args_list):
+        # Run method(*args) for each entry of 'args_list' in parallel
+        # background processes (at most one per cpu)
         if self.printer is None:
-            return method(*args)
+            return [method(*args) for args in args_list]
         import queuelogger
-        parent_conn, child_conn = multiprocessing.Pipe()
-        def wrapper():
+        def wrapper(args, child_conn):
             queuelogger.clear_bg_logging()
             try:
                 res = method(*args)
@@ -86,26 +204,51 @@ class ShaperCalibrate:
                 return
             child_conn.send((False, res))
             child_conn.close()
-        # Start a process to perform the calculation
-        calc_proc = multiprocessing.Process(target=wrapper)
-        calc_proc.daemon = True
-        calc_proc.start()
-        # Wait for the process to finish
+        results = [None] * len(args_list)
+        pending = list(enumerate(args_list))
+        running = []
+        max_procs = multiprocessing.cpu_count()
         reactor = self.printer.get_reactor()
         gcode = self.printer.lookup_object("gcode")
         eventtime = last_report_time = reactor.monotonic()
-        while calc_proc.is_alive():
+        while pending or running:
+            # Start a process for each calculation (up to max_procs)
+            while pending and len(running) < max_procs:
+                index, args = pending.pop(0)
+                parent_conn, child_conn = multiprocessing.Pipe()
+                calc_proc = multiprocessing.Process(
+                        target=wrapper, args=(args, child_conn))
+                calc_proc.daemon = True
+                calc_proc.start()
+                running.append((index, calc_proc, parent_conn))
+            # Collect the results of finished processes
+            num_running = len(running)
+            for entry in list(running):
+                index, calc_proc, parent_conn = entry
+                if parent_conn.poll():
+                    is_err, res = parent_conn.recv()
+                elif not calc_proc.is_alive():
+                    is_err, res = True, "Process exited without result"
+                else:
+                    continue
+                if is_err:
+                    for _, proc, conn in running:
+                        proc.terminate()
+                        conn.close()
+                    raise self.error("Error in remote calculation: %s"
+                                     % (res,))
+                calc_proc.join()
+                parent_conn.close()
+                results[index] = res
+                running.remove(entry)
+            if len(running) < num_running:
+                # Start the next calculations without waiting
+                continue
             if eventtime > last_report_time + 5.:
                 last_report_time = eventtime
                 gcode.respond_info("Wait for calculations..", log=False)
             eventtime = reactor.pause(eventtime + .1)
-        # Return results
-        is_err, res = parent_conn.recv()
-        if is_err:
-            raise self.error("Error in remote calculation: %s" % (res,))
-        calc_proc.join()
-        parent_conn.close()
-        return res
+        return results
 
     def _split_into_windows(self, x, window_size, overlap):
         # Memory-efficient algorithm to split an input 'x' into a series
@@ -154,10 +297,9 @@ class ShaperCalibrate:
         if isinstance(raw_values, np.ndarray):
             data = raw_values
         else:
-            samples = raw_values.get_samples()
-            if not samples:
+            data = raw_values.get_sample_array(np)
+            if not len(data):
                 return None
-            data = np.array(samples)
 
         N = data.shape[0]
         T = data[-1,0] - data[0,0]
@@ -174,39 +316,52 @@ class ShaperCalibrate:
         fz, pz = self._psd(data[:,3], SAMPLING_FREQ, M)
         return CalibrationData(fx, px+py+pz, px, py, pz)
 
+    def stream_accelerometer_data(self, aclient):
+        # Calculate the frequency response while the samples arrive
+        accumulator = FreqResponseAccumulator(self.numpy)
+        aclient.stream_samples(self.numpy, accumulator.add_samples)
+        return accumulator
+
     def process_accelerometer_data(self, data):
-        calibration_data = self.background_process_exec(
-                self.calc_freq_response, (data,))
+        if isinstance(data, FreqResponseAccumulator):
+            # Only the final scaling of the accumulated data remains
+            calibration_data = data.get_calibration_data()
+        else:
+            calibration_data = self.background_process_exec(
+                    self.calc_freq_response, (data,))
         if calibration_data is None:
             raise self.error(
                     "Internal error processing accelerometer data %s" % (data,))
         calibration_data.set_numpy(self.numpy)
         return calibration_data
 
-    def _estimate_shaper(self, shaper, test_damping_ratio, test_freqs):
+    def _estimate_shapers(self, A, T, test_damping_ratio, test_freqs):
+        # Estimate the response of a set of shapers, 'A' and 'T' are the
+        # (num_shapers, num_impulses) amplitudes and times of the shapers
         np = self.numpy
 
-        A, T = np.array(shaper[0]), np.array(shaper[1])
-        inv_D = 1. / A.sum()
+        inv_D = 1. / A.sum(axis=1)
 
         omega = 2. * math.pi * test_freqs
         damping = test_damping_ratio * omega
         omega_d = omega * math.sqrt(1. - test_damping_ratio**2)
-        W = A * np.exp(np.outer(-damping, (T[-1] - T)))
-        S = W * np.sin(np.outer(omega_d, T))
-        C = W * np.cos(np.outer(omega_d, T))
-        return np.sqrt(S.sum(axis=1)**2 + C.sum(axis=1)**2) * inv_D
+        W = A[:,None,:] * np.exp(
+                -damping[None,:,None] * (T[:,-1:] - T)[:,None,:])
+        S = W * np.sin(omega_d[None,:,None] * T[:,None,:])
+        C = W * np.cos(omega_d[None,:,None] * T[:,None,:])
+        return np.sqrt(S.sum(axis=2)**2 + C.sum(axis=2)**2) * inv_D[:,None]
 
-    def _estimate_remaining_vibrations(self, shaper, test_damping_ratio,
+    def _estimate_remaining_vibrations(self, A, T, test_damping_ratio,
                                        freq_bins, psd):
-        vals = self._estimate_shaper(shaper, test_damping_ratio, freq_bins)
+        np = self.numpy
+        vals = self._estimate_shapers(A, T, test_damping_ratio, freq_bins)
         # The input shaper can only reduce the amplitude of vibrations by
         # SHAPER_VIBRATION_REDUCTION times, so all vibrations below that
         # threshold can be igonred
         vibr_threshold = psd.max() / shaper_defs.SHAPER_VIBRATION_REDUCTION
-        remaining_vibrations = self.numpy.maximum(
-                vals * psd - vibr_threshold, 0).sum()
-        all_vibrations = self.numpy.maximum(psd - vibr_threshold, 0).sum()
+        remaining_vibrations = np.maximum(
+                vals * psd - vibr_threshold, 0).sum(axis=1)
+        all_vibrations = np.maximum(psd - vibr_threshold, 0).sum()
         return (remaining_vibrations / all_vibrations, vals)
 
     def _get_shaper_smoothing(self, shaper, accel=5000, scv=5.):
@@ -254,44 +409,63 @@ class ShaperCalibrate:
         psd = calibration_data.psd_sum[freq_bins <= max_freq]
         freq_bins = freq_bins[freq_bins <= max_freq]
 
-        best_res = None
-        results = []
-        for test_freq in test_freqs[::-1]:
-            shaper_vibrations = 0.
-            shaper_vals = np.zeros(shape=freq_bins.shape)
-            shaper = shaper_cfg.init_func(test_freq, damping_ratio)
-            shaper_smoothing = self._get_shaper_smoothing(shaper, scv=scv)
-            if max_smoothing and shaper_smoothing > max_smoothing and best_res:
-                return best_res
-            # Exact damping ratio of the printer is unknown, pessimizing
-            # remaining vibrations over possible damping values
+        test_freqs = test_freqs[::-1]
+        shapers = [shaper_cfg.init_func(test_freq, damping_ratio)
+                   for test_freq in test_freqs]
+        shaper_smoothing = get_shaper_smoothing(shaper_cfg, damping_ratio)
+        smoothings = [shaper_smoothing.get_smoothing(test_freq, scv=scv)
+                      for test_freq in test_freqs]
+        # Frequencies with too much smoothing end the search
+        count = len(shapers)
+        if max_smoothing:
+            for i in range(1, count):
+                if smoothings[i] > max_smoothing:
+                    count = i
+                    break
+        A = np.array([shaper[0] for shaper in shapers[:count]])
+        T = np.array([shaper[1] for shaper in shapers[:count]])
+
+        # Exact damping ratio of the printer is unknown, pessimizing
+        # remaining vibrations over possible damping values.  All test
+        # frequencies are evaluated at once (in blocks to limit memory).
+        shaper_vibrations = np.zeros(shape=(count,))
+        shaper_vals = np.zeros(shape=(count,) + freq_bins.shape)
+        for i in range(0, count, FIT_BLOCK_SIZE):
+            block = slice(i, i + FIT_BLOCK_SIZE)
             for dr in test_damping_ratios:
                 vibrations, vals = self._estimate_remaining_vibrations(
-                        shaper, dr, freq_bins, psd)
-                shaper_vals = np.maximum(shaper_vals, vals)
-                if vibrations > shaper_vibrations:
-                    shaper_vibrations = vibrations
-            max_accel = self.find_shaper_max_accel(shaper, scv)
+                        A[block], T[block], dr, freq_bins, psd)
+                shaper_vals[block] = np.maximum(shaper_vals[block], vals)
+                shaper_vibrations[block] = np.maximum(
+                        shaper_vibrations[block], vibrations)
+
+        best = None
+        scores = []
+        for i in range(count):
+            vibrs = shaper_vibrations[i]
             # The score trying to minimize vibrations, but also accounting
             # the growth of smoothing. The formula itself does not have any
             # special meaning, it simply shows good results on real user data
-            shaper_score = shaper_smoothing * (shaper_vibrations**1.5 +
-                                               shaper_vibrations * .2 + .01)
-            results.append(
-                    CalibrationResult(
-                        name=shaper_cfg.name, freq=test_freq, vals=shaper_vals,
-                        vibrs=shaper_vibrations, smoothing=shaper_smoothing,
-                        score=shaper_score, max_accel=max_accel))
-            if best_res is None or best_res.vibrs > results[-1].vibrs:
+            scores.append(smoothings[i] * (vibrs**1.5 + vibrs * .2 + .01))
+            if best is None or shaper_vibrations[best] > vibrs:
                 # The current frequency is better for the shaper.
-                best_res = results[-1]
-        # Try to find an 'optimal' shapper configuration: the one that is not
-        # much worse than the 'best' one, but gives much less smoothing
-        selected = best_res
-        for res in results[::-1]:
-            if res.vibrs < best_res.vibrs * 1.1 and res.score < selected.score:
-                selected = res
-        return selected
+                best = i
+        selected = best
+        if count == len(shapers):
+            # Try to find an 'optimal' shapper configuration: the one that
+            # is not much worse than the 'best' one, but gives much less
+            # smoothing
+            for i in range(count-1, -1, -1):
+                if (shaper_vibrations[i] < shaper_vibrations[best] * 1.1
+                        and scores[i] < scores[selected]):
+                    selected = i
+        # Only the selected configuration needs its max_accel calculated
+        i = selected
+        return CalibrationResult(
+                name=shaper_cfg.name, freq=test_freqs[i], vals=shaper_vals[i],
+                vibrs=shaper_vibrations[i], smoothing=smoothings[i],
+                score=scores[i],
+                max_accel=shaper_smoothing.get_max_accel(test_freqs[i], scv))
 
     def _bisect(self, func):
         left = right = 1.
@@ -312,9 +486,6 @@ class ShaperCalibrate:
         return left
 
     def find_shaper_max_accel(self, shaper, scv):
-        # Just some empirically chosen value which produces good projections
-        # for max_accel without much smoothing
-        TARGET_SMOOTHING = 0.12
         max_accel = self._bisect(lambda test_accel: self._get_shaper_smoothing(
             shaper, test_accel, scv) <= TARGET_SMOOTHING)
         return max_accel
@@ -326,12 +497,14 @@ class ShaperCalibrate:
         best_shaper = None
         all_shapers = []
         shapers = shapers or AUTOTUNE_SHAPERS
-        for shaper_cfg in shaper_defs.INPUT_SHAPERS:
-            if shaper_cfg.name not in shapers:
-                continue
-            shaper = self.background_process_exec(self.fit_shaper, (
-                shaper_cfg, calibration_data, shaper_freqs, damping_ratio,
-                scv, max_smoothing, test_damping_ratios, max_freq))
+        # Fit all shapers in parallel
+        shaper_cfgs = [shaper_cfg for shaper_cfg in shaper_defs.INPUT_SHAPERS
+                       if shaper_cfg.name in shapers]
+        fitted_shapers = self.background_process_exec_all(self.fit_shaper, [
+            (shaper_cfg, calibration_data, shaper_freqs, damping_ratio,
+             scv, max_smoothing, test_damping_ratios, max_freq)
+            for shaper_cfg in shaper_cfgs])
+        for shaper in fitted_shapers:
             if logger is not None:
                 logger("Fitted shaper '%s' frequency = %.1f Hz "
                        "(vibrations = %.1f%%, smoothing ~= %.3f)" % (
@@ -3,9 +3,10 @@
 # Copyright (C) 2018-2024  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, sys, logging, io
+import os, logging, io
 
 VALID_GCODE_EXTS = ['gcode', 'g', 'gco']
+READ_SIZE = 65536
 
 DEFAULT_ERROR_GCODE = """
 {% if 'heaters' in printer %}
@@ -13,6 +14,14 @@ DEFAULT_ERROR_GCODE = """
 {% endif %}
 """
 
+class DirectoryNode:
+    def __init__(self, mtime, dirs, files):
+        self.mtime = mtime
+        self.dirs = dirs
+        self.files = files
+        self.gcode_dirs = []
+        self.has_gcode = bool(files)
+
 class VirtualSD:
     def __init__(self, config):
         self.printer = config.get_printer()
@@ -23,6 +32,8 @@ class VirtualSD:
         self.sdcard_dirname = os.path.normpath(os.path.expanduser(sd))
         self.current_file = None
         self.file_position = self.file_size = 0
+        # Cached directory tree (relative path -> DirectoryNode)
+        self.dir_index = {}
         # Print Stat Tracking
         self.print_stats = self.printer.load_object(config, 'print_stats')
         # Work timer
@@ -89,6 +100,57 @@ class VirtualSD:
             except:
                 logging.exception("virtual_sdcard get_file_list")
                 raise self.gcode.error("Unable to get file list")
+    def _drop_index(self, path):
+        prefix = path + '/'
+        for key in [k for k in self.dir_index
+                    if k == path or k.startswith(prefix)]:
+            del self.dir_index[key]
+    def _index_dir(self, path):
+        full_path = os.path.join(self.sdcard_dirname, path)
+        try:
+            mtime = os.stat(full_path).st_mtime
+        except os.error:
+            self._drop_index(path)
+            return None
+        node = self.dir_index.get(path)
+        if node is None or node.mtime != mtime:
+            # Directory entries changed - rescan it
+            try:
+                names = os.listdir(full_path)
+            except os.error:
+                logging.exception("virtual_sdcard index")
+                self._drop_index(path)
+                return None
+            dirs = []
+            files = []
+            for name in names:
+                if os.path.isdir(os.path.join(full_path, name)):
+                    dirs.append(name)
+                elif name[name.rfind('.')+1:] in VALID_GCODE_EXTS:
+                    files.append(name)
+            if node is not None:
+                for name in node.dirs:
+                    if name not in dirs:
+                        self._drop_index(os.path.join(path, name))
+            node = DirectoryNode(mtime, sorted(dirs, key=str.lower),
+                                 sorted(files, key=str.lower))
+            self.dir_index[path] = node
+        # Subdirectory contents don't change the mtime of this directory,
+        # so children are always revalidated (one stat per directory)
+        node.gcode_dirs = []
+        for name in node.dirs:
+            child = self._index_dir(os.path.join(path, name))
+            if child is not None and child.has_gcode:
+                node.gcode_dirs.append(name)
+        node.has_gcode = bool(node.files or node.gcode_dirs)
+        return node
+    def get_dir_listing(self, path=''):
+        # Return the subdirectories (that contain g-code files) and g-code
+        # files of a directory relative to the sdcard root
+        node = self._index_dir(path)
+        if node is None:
+            return [], []
+        return list(node.gcode_dirs), list(node.files)
     def get_status(self, eventtime):
         return {
             'file_path': self.file_path(),
@@ -183,7 +245,7 @@ class VirtualSD:
             if fname not in flist:
                 fname = files_by_lower[fname.lower()]
             fname = os.path.join(self.sdcard_dirname, fname)
-            f = io.open(fname, 'r', newline='')
+            f = io.open(fname, 'rb')
             f.seek(0, os.SEEK_END)
             fsize = f.tell()
             f.seek(0)
@@ -233,14 +295,14 @@ class VirtualSD:
             return self.reactor.NEVER
         self.print_stats.note_start()
         gcode_mutex = self.gcode.get_mutex()
-        partial_input = ""
+        partial_input = b""
         lines = []
         error_message = None
         while not self.must_pause_work:
             if not lines:
                 # Read more data
                 try:
-                    data = self.current_file.read(8192)
+                    data = self.current_file.read(READ_SIZE)
                 except:
                     logging.exception("virtual_sdcard read")
                     break
@@ -251,7 +313,7 @@ class VirtualSD:
                     logging.info("Finished SD card print")
                     self.gcode.respond_raw("Done printing file")
                     break
-                lines = data.split('\n')
+                lines = data.split(b'\n')
                 lines[0] = partial_input + lines[0]
                 partial_input = lines.pop()
                 lines.reverse()
@@ -264,13 +326,11 @@ class VirtualSD:
             # Dispatch command
             self.cmd_from_sd = True
             line = lines.pop()
-            if sys.version_info.major >= 3:
-                next_file_position = self.file_position + len(line.encode()) + 1
-            else:
-                next_file_position = self.file_position + len(line) + 1
+            # Lines are kept as bytes so the position is tracked in bytes
+            next_file_position = self.file_position + len(line) + 1
             self.next_file_position = next_file_position
             try:
-                self.gcode.run_script(line)
+                self.gcode.run_script(line.decode('utf-8', 'replace'))
             except self.gcode.error as e:
                 error_message = str(e)
                 try:
@@ -292,7 +352,7 @@ class VirtualSD:
                     self.work_timer = None
                     return self.reactor.NEVER
                 lines = []
-                partial_input = ""
+                partial_input = b""
         logging.info("Exiting SD card print (position %d)", self.file_position)
         self.work_timer = None
         self.cmd_from_sd = False
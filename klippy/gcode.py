@@ -10,6 +10,9 @@ class CommandError(Exception):
 
 Coord = collections.namedtuple('Coord', ('x', 'y', 'z', 'e'))
 
+# Maximum number of lines kept in the gcode parse cache
+PARSE_CACHE_SIZE = 256
+
 class GCodeCommand:
     error = CommandError
     def __init__(self, gcode, command, commandline, params, need_ack):
@@ -104,6 +107,7 @@ class GCodeDispatch:
         self.mux_commands = {}
         self.gcode_help = {}
         self.status_commands = {}
+        self.parse_cache = {}
         # Register commands needed before config file is loaded
         handlers = ['M110', 'M112', 'M115',
                     'RESTART', 'FIRMWARE_RESTART', 'ECHO', 'STATUS', 'HELP']
@@ -188,23 +192,59 @@ class GCodeDispatch:
         self._respond_state("Ready")
     # Parse input into commands
     args_r = re.compile('([A-Z_]+|[A-Z*])')
+    number_chars = '0123456789.-+'
+    def _parse_simple(self, line):
+        # Fast path for lines made only of letter+number words (eg,
+        # "G1 X10 Y20 E.5") - returns None if the line needs a full parse
+        number_chars = self.number_chars
+        params = {}
+        words = line.upper().split()
+        for word in words:
+            key = word[0]
+            value = word[1:]
+            if (not value or not ('A' <= key <= 'Z')
+                or value.strip(number_chars)):
+                return None
+            params[key] = value
+        if not words:
+            return '', params
+        cmd = words[0]
+        if cmd[0] == 'N':
+            # Line numbers are handled by the full parser
+            return None
+        return cmd, params
+    def _parse_line(self, line):
+        # Break line into parts and determine command
+        parts = self.args_r.split(line.upper())
+        if ''.join(parts[:2]) == 'N':
+            # Skip line number at start of command
+            cmd = ''.join(parts[3:5]).strip()
+        else:
+            cmd = ''.join(parts[:3]).strip()
+        # Build gcode "params" dictionary
+        params = { parts[i]: parts[i+1].strip()
+                   for i in range(1, len(parts), 2) }
+        return cmd, params
     def _process_commands(self, commands, need_ack=True):
+        parse_cache = self.parse_cache
         for line in commands:
             # Ignore comments and leading/trailing spaces
             line = origline = line.strip()
             cpos = line.find(';')
             if cpos >= 0:
                 line = line[:cpos]
-            # Break line into parts and determine command
-            parts = self.args_r.split(line.upper())
-            if ''.join(parts[:2]) == 'N':
-                # Skip line number at start of command
-                cmd = ''.join(parts[3:5]).strip()
+            parsed = self._parse_simple(line)
+            if parsed is not None:
+                cmd, params = parsed
             else:
-                cmd = ''.join(parts[:3]).strip()
-            # Build gcode "params" dictionary
-            params = { parts[i]: parts[i+1].strip()
-                       for i in range(1, len(parts), 2) }
+                # Other lines are often repeated (eg, macros, M117), so
+                # cache the result of the full parse
+                parsed = parse_cache.get(line)
+                if parsed is None:
+                    if len(parse_cache) >= PARSE_CACHE_SIZE:
+                        parse_cache.clear()
+                    parsed = parse_cache[line] = self._parse_line(line)
+                cmd, params = parsed[0], dict(parsed[1])
             gcmd = GCodeCommand(self, cmd, origline, params, need_ack)
             # Invoke handler for command
             handler = self.gcode_handlers.get(cmd, self.cmd_default)
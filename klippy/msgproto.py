@@ -159,6 +159,36 @@ def convert_msg_format(msgformat):
         msgformat = msgformat.replace(c, '%s')
     return msgformat
 
+# Generate a specialized parse function for a list of (name, type)
+# parameters.  Integer and string decoding is inlined so that a
+# message is decoded without a method call per parameter.
+def compile_parser(msgid_len, param_names):
+    code = ["def parse(s, pos):", "    pos += %d" % (msgid_len,),
+            "    out = {}"]
+    env = {}
+    for i, (name, t) in enumerate(param_names):
+        if type(t) in (PT_uint32, PT_int32, PT_uint16, PT_int16, PT_byte):
+            # Values 0-95 are encoded in a single byte
+            code += ["    v = s[pos]", "    pos += 1", "    if v >= 0x60:",
+                     "        c = v", "        v &= 0x7f",
+                     "        if (c & 0x60) == 0x60:", "            v |= -0x20",
+                     "        while c & 0x80:", "            c = s[pos]",
+                     "            pos += 1",
+                     "            v = (v<<7) | (c & 0x7f)"]
+            if not t.signed:
+                code.append("        v &= 0xffffffff")
+            code.append("    out[%r] = v" % (name,))
+        elif isinstance(t, PT_string):
+            code += ["    l = s[pos]",
+                     "    out[%r] = bytes(bytearray(s[pos+1:pos+l+1]))"
+                     % (name,), "    pos += l + 1"]
+        else:
+            env['t%d' % (i,)] = t.parse
+            code.append("    out[%r], pos = t%d(s, pos)" % (name, i))
+    code.append("    return out, pos")
+    exec("\n".join(code), env)
+    return env['parse']
+
 class MessageFormat:
     def __init__(self, msgid_bytes, msgformat, enumerations={}):
         self.msgid_bytes = msgid_bytes
@@ -168,6 +198,8 @@ class MessageFormat:
         self.param_names = lookup_params(msgformat, enumerations)
         self.param_types = [t for name, t in self.param_names]
         self.name_to_type = dict(self.param_names)
+        # Use a generated parse(s, pos) function for this message
+        self.parse = compile_parser(len(msgid_bytes), self.param_names)
     def encode(self, params):
         out = list(self.msgid_bytes)
         for i, t in enumerate(self.param_types):
@@ -178,13 +210,6 @@ class MessageFormat:
         for name, t in self.param_names:
             t.encode(out, params[name])
         return out
-    def parse(self, s, pos):
-        pos += len(self.msgid_bytes)
-        out = {}
-        for name, t in self.param_names:
-            v, pos = t.parse(s, pos)
-            out[name] = v
-        return out, pos
     def format_params(self, params):
         out = []
         for name, t in self.param_names:
@@ -282,7 +307,9 @@ class MessageParser:
             return "%s %s" % (name, msg)
         return str(params)
     def parse(self, s):
-        msgid, param_pos = self.msgid_parser.parse(s, MESSAGE_HEADER_SIZE)
+        msgid = s[MESSAGE_HEADER_SIZE]
+        if msgid >= 0x60:
+            msgid, param_pos = self.msgid_parser.parse(s, MESSAGE_HEADER_SIZE)
         mid = self.messages_by_id.get(msgid, self.unknown)
         params, pos = mid.parse(s, MESSAGE_HEADER_SIZE)
         if pos != len(s)-MESSAGE_TRAILER_SIZE:
@@ -3,7 +3,8 @@
 # Copyright (C) 2016-2020  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, gc, select, math, time, logging, queue
+import os, gc, sys, select, math, time, logging, queue, heapq
+import threading, traceback, bisect
 import greenlet
 import chelper, util
 
@@ -49,6 +50,111 @@ class ReactorCallback:
         self.completion.complete(res)
         return self.reactor.NEVER
 
+# Histogram bucket upper limits (in seconds) for callback profiling
+PROFILE_BUCKETS = (.0001, .0005, .001, .005, .010, .050, .100, .500, 1.)
+
+class ReactorProfileHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(PROFILE_BUCKETS) + 1)
+        self.count = self.stalls = 0
+        self.total = self.max = 0.
+    def add(self, duration, is_stall):
+        self.counts[bisect.bisect_left(PROFILE_BUCKETS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        if is_stall:
+            self.stalls += 1
+    def get_status(self):
+        return {'count': self.count, 'total': self.total, 'max': self.max,
+                'stalls': self.stalls, 'buckets': list(self.counts)}
+
+def _callback_name(callback):
+    obj = getattr(callback, '__self__', None)
+    if isinstance(obj, ReactorCallback):
+        callback = obj.callback
+    name = getattr(callback, '__qualname__', None)
+    if name is None:
+        return repr(callback)
+    module = getattr(callback, '__module__', None)
+    if module:
+        return "%s.%s" % (module, name)
+    return name
+
+# Track the wall time of reactor callbacks and report stalls
+class ReactorProfiler:
+    def __init__(self, stall_threshold):
+        self.stall_threshold = stall_threshold
+        self.callbacks = {}
+        self.pauses = {}
+        # Currently running callback - [name, slice_start, stall_reported]
+        self.current = None
+        self.thread_ident = threading.get_ident()
+        self.watchdog_active = True
+        self.watchdog = threading.Thread(target=self._watchdog_thread,
+                                         daemon=True)
+        self.watchdog.start()
+    def stop(self):
+        self.watchdog_active = False
+    def _record(self, hists, name, duration):
+        hist = hists.get(name)
+        if hist is None:
+            hist = hists[name] = ReactorProfileHistogram()
+        hist.add(duration, duration > self.stall_threshold)
+    def _end_slice(self):
+        cur = self.current
+        if cur is not None:
+            self._record(self.callbacks, cur[0], time.perf_counter() - cur[1])
+    def wrap(self, callback):
+        name = []
+        def profiled_callback(eventtime):
+            if not name:
+                name.append(_callback_name(callback))
+            prev = self.current
+            self.current = [name[0], time.perf_counter(), False]
+            try:
+                return callback(eventtime)
+            finally:
+                self._end_slice()
+                self.current = prev
+        return profiled_callback
+    def pause_begin(self):
+        # The running callback is giving up the reactor
+        self._end_slice()
+        cur = self.current
+        self.current = None
+        return cur, time.perf_counter()
+    def pause_end(self, state):
+        cur, pause_start = state
+        now = time.perf_counter()
+        if cur is not None:
+            self._record(self.pauses, cur[0], now - pause_start)
+            cur[1] = now
+            cur[2] = False
+        self.current = cur
+    def get_status(self):
+        return {
+            'stall_threshold': self.stall_threshold,
+            'callbacks': {n: h.get_status()
+                          for n, h in self.callbacks.items()},
+            'pauses': {n: h.get_status() for n, h in self.pauses.items()}}
+    def _watchdog_thread(self):
+        check_time = max(.010, self.stall_threshold * .5)
+        while self.watchdog_active:
+            time.sleep(check_time)
+            cur = self.current
+            if cur is None or cur[2]:
+                continue
+            run_time = time.perf_counter() - cur[1]
+            if run_time < self.stall_threshold:
+                continue
+            cur[2] = True
+            frame = sys._current_frames().get(self.thread_ident)
+            stack = ''.join(traceback.format_stack(frame)) if frame else ''
+            logging.warning("Reactor stall: %s running for %.3fs\n%s",
+                            cur[0], run_time, stack)
+
 class ReactorFileHandler:
     def __init__(self, fd, read_callback, write_callback):
         self.fd = fd
@@ -101,8 +207,12 @@ class SelectReactor:
         # Python garbage collection
         self._check_gc = gc_checking
         self._last_gc_times = [0., 0., 0.]
-        # Timers
-        self._timers = []
+        # Timers (pending wakeups are tracked in a heap of
+        # (waketime, seq, timer) entries - entries that no longer match
+        # the timer's waketime are discarded when they reach the top)
+        self._timers = set()
+        self._timer_heap = []
+        self._timer_seq = 0
         self._next_timer = self.NEVER
         # Callbacks
         self._pipe_fds = None
@@ -114,24 +224,55 @@ class SelectReactor:
         self._g_dispatch = None
         self._greenlets = []
         self._all_greenlets = []
+        # Optional callback profiling
+        self._profiler = None
     def get_gc_stats(self):
         return tuple(self._last_gc_times)
+    # Profiling
+    def setup_profiling(self, stall_threshold):
+        if self._profiler is not None:
+            return self._profiler
+        self._profiler = profiler = ReactorProfiler(stall_threshold)
+        for t in self._timers:
+            if not isinstance(getattr(t.callback, '__self__', None),
+                              greenlet.greenlet):
+                t.callback = profiler.wrap(t.callback)
+        return profiler
+    def get_profiler(self):
+        return self._profiler
+    def _wrap_callback(self, callback):
+        if self._profiler is None or callback is None:
+            return callback
+        return self._profiler.wrap(callback)
     # Timers
+    def _schedule_timer(self, timer_handler, waketime):
+        if waketime >= self.NEVER:
+            return
+        timer_heap = self._timer_heap
+        if len(timer_heap) > 4 * len(self._timers) + 64:
+            # Too many stale entries - rebuild the heap
+            timer_heap[:] = [e for e in timer_heap if e[2].waketime == e[0]]
+            heapq.heapify(timer_heap)
+        self._timer_seq += 1
+        heapq.heappush(timer_heap, (waketime, self._timer_seq, timer_handler))
     def update_timer(self, timer_handler, waketime):
+        if waketime == timer_handler.waketime:
+            return
         timer_handler.waketime = waketime
-        self._next_timer = min(self._next_timer, waketime)
+        if timer_handler in self._timers:
+            self._schedule_timer(timer_handler, waketime)
+            self._next_timer = min(self._next_timer, waketime)
     def register_timer(self, callback, waketime=NEVER):
+        return self._register_timer(self._wrap_callback(callback), waketime)
+    def _register_timer(self, callback, waketime):
         timer_handler = ReactorTimer(callback, waketime)
-        timers = list(self._timers)
-        timers.append(timer_handler)
-        self._timers = timers
+        self._timers.add(timer_handler)
+        self._schedule_timer(timer_handler, waketime)
         self._next_timer = min(self._next_timer, waketime)
         return timer_handler
     def unregister_timer(self, timer_handler):
         timer_handler.waketime = self.NEVER
-        timers = list(self._timers)
-        timers.pop(timers.index(timer_handler))
-        self._timers = timers
+        self._timers.remove(timer_handler)
     def _check_timers(self, eventtime, busy):
         if eventtime < self._next_timer:
             if busy:
@@ -149,19 +290,35 @@ class SelectReactor:
                     gc.collect(gc_level)
                     return 0.
             return min(1., max(.001, self._next_timer - eventtime))
-        self._next_timer = self.NEVER
         g_dispatch = self._g_dispatch
-        for t in self._timers:
-            waketime = t.waketime
-            if eventtime >= waketime:
-                t.waketime = self.NEVER
-                t.waketime = waketime = t.callback(eventtime)
-                if g_dispatch is not self._g_dispatch:
-                    self._next_timer = min(self._next_timer, waketime)
-                    self._end_greenlet(g_dispatch)
-                    return 0.
-            self._next_timer = min(self._next_timer, waketime)
+        timer_heap = self._timer_heap
+        # Timers scheduled while dispatching are run on the next pass
+        seq_limit = self._timer_seq
+        while timer_heap:
+            waketime, seq, t = timer_heap[0]
+            if t.waketime != waketime:
+                # Stale entry (timer was updated or unregistered)
+                heapq.heappop(timer_heap)
+                continue
+            if eventtime < waketime or seq > seq_limit:
+                break
+            heapq.heappop(timer_heap)
+            t.waketime = self.NEVER
+            t.waketime = waketime = t.callback(eventtime)
+            if t in self._timers:
+                self._schedule_timer(t, waketime)
+            if g_dispatch is not self._g_dispatch:
+                self._update_next_timer()
+                self._end_greenlet(g_dispatch)
+                return 0.
+        self._update_next_timer()
         return 0.
+    def _update_next_timer(self):
+        timer_heap = self._timer_heap
+        if timer_heap:
+            self._next_timer = timer_heap[0][0]
+        else:
+            self._next_timer = self.NEVER
     # Callbacks and Completions
     def completion(self):
         return ReactorCompletion(self)
@@ -211,7 +368,12 @@ class SelectReactor:
             if self._g_dispatch is None:
                 return self._sys_pause(waketime)
             # Switch to _check_timers (via g.timer.callback return)
-            return self._g_dispatch.switch(waketime)
+            if self._profiler is None:
+                return self._g_dispatch.switch(waketime)
+            state = self._profiler.pause_begin()
+            eventtime = self._g_dispatch.switch(waketime)
+            self._profiler.pause_end(state)
+            return eventtime
         # Pausing the dispatch greenlet - prepare a new greenlet to do dispatch
         if self._greenlets:
             g_next = self._greenlets.pop()
@@ -219,10 +381,15 @@ class SelectReactor:
             g_next = ReactorGreenlet(run=self._dispatch_loop)
             self._all_greenlets.append(g_next)
         g_next.parent = g.parent
-        g.timer = self.register_timer(g.switch, waketime)
+        g.timer = self._register_timer(g.switch, waketime)
         self._next_timer = self.NOW
         # Switch to _dispatch_loop (via _end_greenlet or direct)
-        eventtime = g_next.switch()
+        if self._profiler is None:
+            eventtime = g_next.switch()
+        else:
+            state = self._profiler.pause_begin()
+            eventtime = g_next.switch()
+            self._profiler.pause_end(state)
         # This greenlet activated from g.timer.callback (via _check_timers)
         return eventtime
     def _end_greenlet(self, g_old):
@@ -239,7 +406,9 @@ class SelectReactor:
         return ReactorMutex(self, is_locked)
     # File descriptors
     def register_fd(self, fd, read_callback, write_callback=None):
-        file_handler = ReactorFileHandler(fd, read_callback, write_callback)
+        file_handler = ReactorFileHandler(
+            fd, self._wrap_callback(read_callback),
+            self._wrap_callback(write_callback))
         self.set_fd_wake(file_handler, True, False)
         return file_handler
     def unregister_fd(self, file_handler):
@@ -293,6 +462,8 @@ class SelectReactor:
     def end(self):
         self._process = False
     def finalize(self):
+        if self._profiler is not None:
+            self._profiler.stop()
         self._g_dispatch = None
         self._greenlets = []
         for g in self._all_greenlets:
@@ -313,7 +484,9 @@ class PollReactor(SelectReactor):
         self._fds = {}
     # File descriptors
     def register_fd(self, fd, read_callback, write_callback=None):
-        file_handler = ReactorFileHandler(fd, read_callback, write_callback)
+        file_handler = ReactorFileHandler(
+            fd, self._wrap_callback(read_callback),
+            self._wrap_callback(write_callback))
         fds = self._fds.copy()
         fds[fd] = file_handler
         self._fds = fds
@@ -364,9 +537,11 @@ class EPollReactor(SelectReactor):
         self._fds = {}
     # File descriptors
     def register_fd(self, fd, read_callback, write_callback=None):
-        file_handler = ReactorFileHandler(fd, read_callback, write_callback)
+        file_handler = ReactorFileHandler(
+            fd, self._wrap_callback(read_callback),
+            self._wrap_callback(write_callback))
         fds = self._fds.copy()
-        fds[fd] = read_callback
+        fds[fd] = file_handler
         self._fds = fds
         self._epoll.register(fd, select.EPOLLIN | select.EPOLLHUP)
         return file_handler
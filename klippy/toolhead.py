@@ -12,23 +12,32 @@ import mcu, chelper, kinematics.extruder
 
 # Class to track each move request
 class Move:
+    # Many moves may be held in the lookahead queue - use slots to
+    # reduce their memory footprint and speed up attribute access
+    __slots__ = (
+        'toolhead', 'start_pos', 'end_pos', 'accel', 'junction_deviation',
+        'timing_callbacks', 'is_kinematic_move', 'axes_d', 'move_d',
+        'axes_r', 'min_move_t', 'max_cruise_v2', 'delta_v2', 'smooth_delta_v2',
+        'start_v', 'cruise_v', 'end_v', 'accel_t', 'cruise_t', 'decel_t')
     def __init__(self, toolhead, start_pos, end_pos, speed):
         self.toolhead = toolhead
         self.start_pos = tuple(start_pos)
         self.end_pos = tuple(end_pos)
         self.accel = toolhead.max_accel
         self.junction_deviation = toolhead.junction_deviation
-        self.timing_callbacks = []
+        self.timing_callbacks = ()
         velocity = min(speed, toolhead.max_velocity)
         self.is_kinematic_move = True
-        self.axes_d = axes_d = [end_pos[i] - start_pos[i] for i in (0, 1, 2, 3)]
-        self.move_d = move_d = math.sqrt(sum([d*d for d in axes_d[:3]]))
+        axes_d = (end_pos[0] - start_pos[0], end_pos[1] - start_pos[1],
+                  end_pos[2] - start_pos[2], end_pos[3] - start_pos[3])
+        move_d = math.sqrt(axes_d[0]*axes_d[0] + axes_d[1]*axes_d[1]
+                           + axes_d[2]*axes_d[2])
         if move_d < .000000001:
             # Extrude only move
             self.end_pos = (start_pos[0], start_pos[1], start_pos[2],
                             end_pos[3])
-            axes_d[0] = axes_d[1] = axes_d[2] = 0.
-            self.move_d = move_d = abs(axes_d[3])
+            axes_d = (0., 0., 0., axes_d[3])
+            move_d = abs(axes_d[3])
             inv_move_d = 0.
             if move_d:
                 inv_move_d = 1. / move_d
@@ -37,17 +46,18 @@ class Move:
             self.is_kinematic_move = False
         else:
             inv_move_d = 1. / move_d
-        self.axes_r = [d * inv_move_d for d in axes_d]
+        self.axes_d = axes_d
+        self.move_d = move_d
+        self.axes_r = (axes_d[0] * inv_move_d, axes_d[1] * inv_move_d,
+                       axes_d[2] * inv_move_d, axes_d[3] * inv_move_d)
         self.min_move_t = move_d / velocity
         # Junction speeds are tracked in velocity squared.  The
         # delta_v2 is the maximum amount of this squared-velocity that
-        # can change in this move.
-        self.max_start_v2 = 0.
+        # can change in this move.  The junction velocities themselves
+        # are calculated by the lookahead code in chelper.
         self.max_cruise_v2 = velocity**2
         self.delta_v2 = 2.0 * move_d * self.accel
-        self.max_smoothed_v2 = 0.
         self.smooth_delta_v2 = 2.0 * move_d * toolhead.max_accel_to_decel
-        self.next_junction_v2 = 999999999.9
     def limit_speed(self, speed, accel):
         speed2 = speed**2
         if speed2 < self.max_cruise_v2:
@@ -56,59 +66,10 @@ class Move:
         self.accel = min(self.accel, accel)
         self.delta_v2 = 2.0 * self.move_d * self.accel
         self.smooth_delta_v2 = min(self.smooth_delta_v2, self.delta_v2)
-    def limit_next_junction_speed(self, speed):
-        self.next_junction_v2 = min(self.next_junction_v2, speed**2)
     def move_error(self, msg="Move out of range"):
         ep = self.end_pos
         m = "%s: %.3f %.3f %.3f [%.3f]" % (msg, ep[0], ep[1], ep[2], ep[3])
         return self.toolhead.printer.command_error(m)
-    def calc_junction(self, prev_move):
-        if not self.is_kinematic_move or not prev_move.is_kinematic_move:
-            return
-        # Allow extruder to calculate its maximum junction
-        extruder_v2 = self.toolhead.extruder.calc_junction(prev_move, self)
-        max_start_v2 = min(extruder_v2, self.max_cruise_v2,
-                           prev_move.max_cruise_v2, prev_move.next_junction_v2,
-                           prev_move.max_start_v2 + prev_move.delta_v2)
-        # Find max velocity using "approximated centripetal velocity"
-        axes_r = self.axes_r
-        prev_axes_r = prev_move.axes_r
-        junction_cos_theta = -(axes_r[0] * prev_axes_r[0]
-                               + axes_r[1] * prev_axes_r[1]
-                               + axes_r[2] * prev_axes_r[2])
-        sin_theta_d2 = math.sqrt(max(0.5*(1.0-junction_cos_theta), 0.))
-        cos_theta_d2 = math.sqrt(max(0.5*(1.0+junction_cos_theta), 0.))
-        one_minus_sin_theta_d2 = 1. - sin_theta_d2
-        if one_minus_sin_theta_d2 > 0. and cos_theta_d2 > 0.:
-            R_jd = sin_theta_d2 / one_minus_sin_theta_d2
-            move_jd_v2 = R_jd * self.junction_deviation * self.accel
-            pmove_jd_v2 = R_jd * prev_move.junction_deviation * prev_move.accel
-            # Approximated circle must contact moves no further than mid-move
-            #   centripetal_v2 = .5 * self.move_d * self.accel * tan_theta_d2
-            quarter_tan_theta_d2 = .25 * sin_theta_d2 / cos_theta_d2
-            move_centripetal_v2 = self.delta_v2 * quarter_tan_theta_d2
-            pmove_centripetal_v2 = prev_move.delta_v2 * quarter_tan_theta_d2
-            max_start_v2 = min(max_start_v2, move_jd_v2, pmove_jd_v2,
-                               move_centripetal_v2, pmove_centripetal_v2)
-        # Apply limits
-        self.max_start_v2 = max_start_v2
-        self.max_smoothed_v2 = min(
-            max_start_v2, prev_move.max_smoothed_v2 + prev_move.smooth_delta_v2)
-    def set_junction(self, start_v2, cruise_v2, end_v2):
-        # Determine accel, cruise, and decel portions of the move distance
-        half_inv_accel = .5 / self.accel
-        accel_d = (cruise_v2 - start_v2) * half_inv_accel
-        decel_d = (cruise_v2 - end_v2) * half_inv_accel
-        cruise_d = self.move_d - accel_d - decel_d
-        # Determine move velocities
-        self.start_v = start_v = math.sqrt(start_v2)
-        self.cruise_v = cruise_v = math.sqrt(cruise_v2)
-        self.end_v = end_v = math.sqrt(end_v2)
-        # Determine time spent in each portion of move (time is the
-        # distance divided by average velocity)
-        self.accel_t = accel_d / ((start_v + cruise_v) * 0.5)
-        self.cruise_t = cruise_d / cruise_v
-        self.decel_t = decel_d / ((end_v + cruise_v) * 0.5)
 
 LOOKAHEAD_FLUSH_TIME = 0.250
 
@@ -119,8 +80,20 @@ class LookAheadQueue:
         self.toolhead = toolhead
         self.queue = []
         self.junction_flush = LOOKAHEAD_FLUSH_TIME
+        ffi_main, ffi_lib = chelper.get_ffi()
+        self.ffi_main = ffi_main
+        self.cqueue = ffi_main.gc(ffi_lib.lookahead_alloc(),
+                                  ffi_lib.lookahead_free)
+        self.lookahead_reset = ffi_lib.lookahead_reset
+        self.lookahead_add_move = ffi_lib.lookahead_add_move
+        self.lookahead_limit_next_junction = (
+            ffi_lib.lookahead_limit_next_junction)
+        self.lookahead_flush = ffi_lib.lookahead_flush
+        self.junctions_size = 64
+        self.junctions = ffi_main.new('double[]', 6 * self.junctions_size)
     def reset(self):
         del self.queue[:]
+        self.lookahead_reset(self.cqueue)
         self.junction_flush = LOOKAHEAD_FLUSH_TIME
     def set_flush_time(self, flush_time):
         self.junction_flush = flush_time
@@ -128,63 +101,47 @@ class LookAheadQueue:
         if self.queue:
             return self.queue[-1]
         return None
+    def limit_next_junction_speed(self, speed):
+        self.lookahead_limit_next_junction(self.cqueue, speed**2)
     def flush(self, lazy=False):
         self.junction_flush = LOOKAHEAD_FLUSH_TIME
-        update_flush_count = lazy
         queue = self.queue
-        flush_count = len(queue)
-        # Traverse queue from last to first move and determine maximum
-        # junction speed assuming the robot comes to a complete stop
-        # after the last move.
-        delayed = []
-        next_end_v2 = next_smoothed_v2 = peak_cruise_v2 = 0.
-        for i in range(flush_count-1, -1, -1):
-            move = queue[i]
-            reachable_start_v2 = next_end_v2 + move.delta_v2
-            start_v2 = min(move.max_start_v2, reachable_start_v2)
-            reachable_smoothed_v2 = next_smoothed_v2 + move.smooth_delta_v2
-            smoothed_v2 = min(move.max_smoothed_v2, reachable_smoothed_v2)
-            if smoothed_v2 < reachable_smoothed_v2:
-                # It's possible for this move to accelerate
-                if (smoothed_v2 + move.smooth_delta_v2 > next_smoothed_v2
-                    or delayed):
-                    # This move can decelerate or this is a full accel
-                    # move after a full decel move
-                    if update_flush_count and peak_cruise_v2:
-                        flush_count = i
-                        update_flush_count = False
-                    peak_cruise_v2 = min(move.max_cruise_v2, (
-                        smoothed_v2 + reachable_smoothed_v2) * .5)
-                    if delayed:
-                        # Propagate peak_cruise_v2 to any delayed moves
-                        if not update_flush_count and i < flush_count:
-                            mc_v2 = peak_cruise_v2
-                            for m, ms_v2, me_v2 in reversed(delayed):
-                                mc_v2 = min(mc_v2, ms_v2)
-                                m.set_junction(min(ms_v2, mc_v2), mc_v2
-                                               , min(me_v2, mc_v2))
-                        del delayed[:]
-                if not update_flush_count and i < flush_count:
-                    cruise_v2 = min((start_v2 + reachable_start_v2) * .5
-                                    , move.max_cruise_v2, peak_cruise_v2)
-                    move.set_junction(min(start_v2, cruise_v2), cruise_v2
-                                      , min(next_end_v2, cruise_v2))
-            else:
-                # Delay calculating this move until peak_cruise_v2 is known
-                delayed.append((move, start_v2, next_end_v2))
-            next_end_v2 = start_v2
-            next_smoothed_v2 = smoothed_v2
-        if update_flush_count or not flush_count:
+        if len(queue) > self.junctions_size:
+            self.junctions_size = max(len(queue), 2 * self.junctions_size)
+            self.junctions = self.ffi_main.new('double[]',
+                                               6 * self.junctions_size)
+        # Determine junction velocities (in chelper) and remove the
+        # moves that are ready to be flushed from the C queue
+        flush_count = self.lookahead_flush(self.cqueue, lazy, self.junctions)
+        if not flush_count:
             return
+        j = self.ffi_main.unpack(self.junctions, 6 * flush_count)
+        moves = queue[:flush_count]
+        for i, move in enumerate(moves):
+            (move.start_v, move.cruise_v, move.end_v,
+             move.accel_t, move.cruise_t, move.decel_t) = j[i*6:i*6+6]
         # Generate step times for all moves ready to be flushed
-        self.toolhead._process_moves(queue[:flush_count])
+        self.toolhead._process_moves(moves)
         # Remove processed moves from the queue
         del queue[:flush_count]
     def add_move(self, move):
-        self.queue.append(move)
-        if len(self.queue) == 1:
+        queue = self.queue
+        # Allow extruder to calculate its maximum junction
+        extruder_v2 = 0.
+        if queue and move.is_kinematic_move and queue[-1].is_kinematic_move:
+            extruder_v2 = self.toolhead.extruder.calc_junction(queue[-1], move)
+        axes_r = move.axes_r
+        ret = self.lookahead_add_move(
+            self.cqueue, move.move_d, move.accel, move.junction_deviation,
+            axes_r[0], axes_r[1], axes_r[2], move.is_kinematic_move,
+            move.max_cruise_v2, move.delta_v2, move.smooth_delta_v2,
+            extruder_v2)
+        if ret:
+            # The C queue no longer matches self.queue
+            raise mcu.error("Internal error in lookahead")
+        queue.append(move)
+        if len(queue) == 1:
             return
-        move.calc_junction(self.queue[-2])
         self.junction_flush -= move.min_move_t
         if self.junction_flush <= 0.:
             # Enough moves have been queued to reach the target flush time.
@@ -466,9 +423,7 @@ class ToolHead:
         self.kin.set_position(newpos, homing_axes)
         self.printer.send_event("toolhead:set_position")
     def limit_next_junction_speed(self, speed):
-        last_move = self.lookahead.get_last()
-        if last_move is not None:
-            last_move.limit_next_junction_speed(speed)
+        self.lookahead.limit_next_junction_speed(speed)
     def move(self, newpos, speed):
         move = Move(self, self.commanded_pos, newpos, speed)
         if not move.move_d:
@@ -481,6 +436,25 @@ class ToolHead:
         self.lookahead.add_move(move)
         if self.print_time > self.need_check_pause:
             self._check_pause()
+    def move_batch(self, moves):
+        # Queue a sequence of (newpos, speed) moves.  This is equivalent
+        # to calling move() for each entry, but lookups are done once.
+        kin_check_move = self.kin.check_move
+        extruder_check_move = self.extruder.check_move
+        add_move = self.lookahead.add_move
+        commanded_pos = self.commanded_pos
+        for newpos, speed in moves:
+            move = Move(self, commanded_pos, newpos, speed)
+            if not move.move_d:
+                continue
+            if move.is_kinematic_move:
+                kin_check_move(move)
+            if move.axes_d[3]:
+                extruder_check_move(move)
+            commanded_pos[:] = move.end_pos
+            add_move(move)
+            if self.print_time > self.need_check_pause:
+                self._check_pause()
     def manual_move(self, coord, speed):
         curpos = list(self.commanded_pos)
         for i in range(len(coord)):
@@ -602,7 +576,7 @@ class ToolHead:
         if last_move is None:
             callback(self.get_last_move_time())
             return
-        last_move.timing_callbacks.append(callback)
+        last_move.timing_callbacks += (callback,)
     def note_mcu_movequeue_activity(self, mq_time, set_step_gen_time=False):
         self.need_flush_time = max(self.need_flush_time, mq_time)
         if set_step_gen_time:
@@ -7,6 +7,11 @@ import logging, socket, os, sys, errno, json, collections
 import gcode
 
 REQUEST_LOG_SIZE = 20
+# Unsent bytes at which a client is considered to be falling behind
+SEND_BACKLOG_COALESCE = 65536
+# Unsent bytes above which droppable messages are discarded
+SEND_BACKLOG_LIMIT = 1048576
+SEND_CHUNK_SIZE = 65536
 
 # Json decodes strings as unicode types in Python 2.x.  This doesn't
 # play well with some parts of Klipper (particuarly displays), so we
@@ -26,6 +31,71 @@ if sys.version_info.major < 3:
                     for k, v in data.items()}
         return data
 
+# JSON codec - use a faster encoder/decoder when one is available and
+# fall back to the standard json module otherwise
+def _json_encode_std(data):
+    return json.dumps(data, separators=(',', ':')).encode()
+
+json_codec = "json"
+json_encode = _json_encode_std
+json_decode = json.loads
+def _has_nonfinite(data):
+    # Check for NaN/Infinity floats (orjson would encode them as null)
+    if isinstance(data, float):
+        return data != data or data in (float('inf'), float('-inf'))
+    if isinstance(data, dict):
+        return any(_has_nonfinite(v) for v in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(_has_nonfinite(v) for v in data)
+    return False
+
+try:
+    import orjson
+    def json_encode(data):
+        try:
+            msg = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Types not supported by orjson (eg, named tuples, large ints)
+            return _json_encode_std(data)
+        if b'null' in msg and _has_nonfinite(data):
+            # Keep the NaN/Infinity output of the standard json module
+            return _json_encode_std(data)
+        return msg
+    def json_decode(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson rejects NaN/Infinity literals
+            return json.loads(data)
+    json_codec = "orjson"
+    if json_loads_byteify is not None:
+        json_decode = json.loads
+except ImportError:
+    try:
+        import ujson
+        def json_encode(data):
+            try:
+                return ujson.dumps(data, escape_forward_slashes=False).encode()
+            except (TypeError, ValueError, OverflowError):
+                return _json_encode_std(data)
+        json_codec = "ujson"
+    except ImportError:
+        pass
+
+# Helper for sending already encoded "params" using a client's
+# response template - this allows a message sent to several clients
+# to only be encoded once
+class ResponseTemplate:
+    def __init__(self, template):
+        template = dict(template)
+        template.pop('params', None)
+        if template:
+            self.prefix = json_encode(template)[:-1] + b',"params":'
+        else:
+            self.prefix = b'{"params":'
+    def build(self, params_data):
+        return self.prefix + params_data + b'}\x03'
+
 class WebRequestError(gcode.CommandError):
     def __init__(self, message,):
         Exception.__init__(self, message)
@@ -42,7 +112,10 @@ class WebRequest:
     error = WebRequestError
     def __init__(self, client_conn, request):
         self.client_conn = client_conn
-        base_request = json.loads(request, object_hook=json_loads_byteify)
+        if json_loads_byteify is None:
+            base_request = json_decode(request)
+        else:
+            base_request = json.loads(request, object_hook=json_loads_byteify)
         if type(base_request) != dict:
             raise ValueError("Not a top-level dictionary")
         self.id = base_request.get('id', None)
@@ -182,7 +255,10 @@ class ClientConnection:
         self.sock = sock
         self.fd_handle = self.reactor.register_fd(
             self.sock.fileno(), self.process_received, self._do_send)
-        self.partial_data = self.send_buffer = b""
+        self.partial_data = b""
+        self.send_queue = collections.deque()
+        self.send_size = 0
+        self.drop_count = 0
         self.is_blocking = False
         self.blocking_count = 0
         self.set_client_info("?", "New connection")
@@ -269,36 +345,75 @@ class ClientConnection:
 
     def send(self, data):
         try:
-            jmsg = json.dumps(data, separators=(',', ':'))
-            self.send_buffer += jmsg.encode() + b"\x03"
+            msg = json_encode(data) + b"\x03"
         except (TypeError, ValueError) as e:
             msg = ("json encoding error: %s" % (str(e),))
             logging.exception(msg)
             self.printer.invoke_shutdown(msg)
             return
+        self.send_encoded(msg)
+
+    def send_encoded(self, msg, droppable=False):
+        # Queue an encoded message (including its terminator).  Droppable
+        # messages are discarded if the client has too large a backlog.
+        if droppable and self.send_size + len(msg) > SEND_BACKLOG_LIMIT:
+            if not self.drop_count:
+                logging.info("webhooks client %s: send backlog full,"
+                             " dropping messages", self.uid)
+            self.drop_count += 1
+            return False
+        self.send_queue.append(msg)
+        self.send_size += len(msg)
         if not self.is_blocking:
             self._do_send()
+        return True
+
+    def is_backlogged(self):
+        return self.send_size > SEND_BACKLOG_COALESCE
 
     def _do_send(self, eventtime=None):
         if self.fd_handle is None:
             return
-        try:
-            sent = self.sock.send(self.send_buffer)
-        except socket.error as e:
-            if e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
-                logging.info("webhooks: socket write error %d" % (self.uid,))
-                self.close()
-                return
-            sent = 0
-        if sent < len(self.send_buffer):
+        send_queue = self.send_queue
+        while send_queue:
+            data = send_queue[0]
+            if len(send_queue) > 1 and len(data) < SEND_CHUNK_SIZE:
+                # Merge small messages into a single write
+                parts = [send_queue.popleft()]
+                size = len(data)
+                while send_queue and size < SEND_CHUNK_SIZE:
+                    part = send_queue.popleft()
+                    parts.append(part)
+                    size += len(part)
+                data = b"".join(parts)
+                send_queue.appendleft(data)
+            try:
+                sent = self.sock.send(data)
+            except socket.error as e:
+                if e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    logging.info("webhooks: socket write error %d"
+                                 % (self.uid,))
+                    self.close()
+                    return
+                sent = 0
+            self.send_size -= sent
+            if sent < len(data):
+                send_queue[0] = data[sent:]
+                break
+            send_queue.popleft()
+        if send_queue:
             if not self.is_blocking:
                 self.reactor.set_fd_wake(self.fd_handle, False, True)
                 self.is_blocking = True
                 self.blocking_count = 5
-        elif self.is_blocking:
-            self.reactor.set_fd_wake(self.fd_handle, True, False)
-            self.is_blocking = False
-        self.send_buffer = self.send_buffer[sent:]
+        else:
+            if self.is_blocking:
+                self.reactor.set_fd_wake(self.fd_handle, True, False)
+                self.is_blocking = False
+            if self.drop_count:
+                logging.info("webhooks client %s: dropped %d messages",
+                             self.uid, self.drop_count)
+                self.drop_count = 0
 
 class WebHooks:
     def __init__(self, printer):
@@ -381,6 +496,16 @@ class WebHooks:
     def get_connection(self):
         return self.sconn
 
+    def encode_params(self, params):
+        # Encode message params for use with ResponseTemplate.build()
+        try:
+            return json_encode(params)
+        except (TypeError, ValueError) as e:
+            msg = ("json encoding error: %s" % (str(e),))
+            logging.exception(msg)
+            self.printer.invoke_shutdown(msg)
+            return None
+
     def get_callback(self, path):
         cb = self._endpoints.get(path, None)
         if cb is None:
@@ -422,7 +547,7 @@ class GCodeHelper:
         self.is_output_registered = False
         self.clients = {}
         # Register webhooks
-        wh = printer.lookup_object('webhooks')
+        self.webhooks = wh = printer.lookup_object('webhooks')
         wh.register_endpoint("gcode/help", self._handle_help)
         wh.register_endpoint("gcode/script", self._handle_script)
         wh.register_endpoint("gcode/restart", self._handle_restart)
@@ -439,17 +564,20 @@ class GCodeHelper:
     def _handle_firmware_restart(self, web_request):
         self.gcode.run_script('firmware_restart')
     def _output_callback(self, msg):
+        data = None
         for cconn, template in list(self.clients.items()):
             if cconn.is_closed():
                 del self.clients[cconn]
                 continue
-            tmp = dict(template)
-            tmp['params'] = {'response': msg}
-            cconn.send(tmp)
+            if data is None:
+                data = self.webhooks.encode_params({'response': msg})
+                if data is None:
+                    return
+            cconn.send_encoded(template.build(data))
     def _handle_subscribe_output(self, web_request):
         cconn = web_request.get_client_connection()
         template = web_request.get_dict('response_template', {})
-        self.clients[cconn] = template
+        self.clients[cconn] = ResponseTemplate(template)
         if not self.is_output_registered:
             self.gcode.register_output_handler(self._output_callback)
             self.is_output_registered = True
@@ -463,8 +591,10 @@ class QueryStatusHelper:
         self.pending_queries = []
         self.query_timer = None
         self.last_query = {}
+        self.status_cache = {}
+        self.resync_clients = set()
         # Register webhooks
-        webhooks = printer.lookup_object('webhooks')
+        self.webhooks = webhooks = printer.lookup_object('webhooks')
         webhooks.register_endpoint("objects/list", self._handle_list)
         webhooks.register_endpoint("objects/query", self._handle_query)
         webhooks.register_endpoint("objects/subscribe", self._handle_subscribe)
@@ -472,18 +602,47 @@ class QueryStatusHelper:
         objects = [n for n, o in self.printer.lookup_objects()
                    if hasattr(o, 'get_status')]
         web_request.send({'objects': objects})
+    def _get_status(self, obj_name, po, eventtime):
+        # Reuse the last status of objects reporting an unchanged version
+        get_version = getattr(po, 'get_status_version', None)
+        if get_version is None:
+            return po.get_status(eventtime)
+        version = get_version()
+        cached = self.status_cache.get(obj_name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        status = po.get_status(eventtime)
+        self.status_cache[obj_name] = (version, status)
+        return status
     def _do_query(self, eventtime):
         last_query = self.last_query
         query = self.last_query = {}
         msglist = self.pending_queries
         self.pending_queries = []
         msglist.extend(self.clients.values())
+        # Subscriptions to the same items share the same encoded update
+        encoded = {}
         # Generate get_status() info for each client
-        for cconn, subscription, send_func, template in msglist:
-            is_query = cconn is None
-            if not is_query and cconn.is_closed():
-                del self.clients[cconn]
-                continue
+        for cconn, subscription, send_func, template, sub_key in msglist:
+            is_query = is_full = cconn is None
+            if not is_query:
+                if cconn.is_closed():
+                    del self.clients[cconn]
+                    self.resync_clients.discard(cconn)
+                    continue
+                if cconn.is_backlogged():
+                    # Client is not keeping up - skip updates and send
+                    # the full state once its backlog has drained
+                    self.resync_clients.add(cconn)
+                    continue
+                is_full = cconn in self.resync_clients
+                self.resync_clients.discard(cconn)
+                ekey = (sub_key, is_full)
+                if ekey in encoded:
+                    data = encoded[ekey]
+                    if data is not None:
+                        cconn.send_encoded(template.build(data))
+                    continue
             # Query each requested printer object
             cquery = {}
             for obj_name, req_items in subscription.items():
@@ -493,29 +652,46 @@ class QueryStatusHelper:
                     if po is None or not hasattr(po, 'get_status'):
                         res = query[obj_name] = {}
                     else:
-                        res = query[obj_name] = po.get_status(eventtime)
+                        res = query[obj_name] = self._get_status(
+                            obj_name, po, eventtime)
                 if req_items is None:
                     req_items = list(res.keys())
                     if req_items:
                         subscription[obj_name] = req_items
                 lres = last_query.get(obj_name, {})
+                if res is lres and not is_full:
+                    # Status is the same object as last time - no changes
+                    continue
                 cres = {}
                 for ri in req_items:
                     rd = res.get(ri, None)
-                    if is_query or rd != lres.get(ri):
+                    if is_full:
                         cres[ri] = rd
-                if cres or is_query:
+                        continue
+                    lrd = lres.get(ri)
+                    if rd is not lrd and rd != lrd:
+                        cres[ri] = rd
+                if cres or is_full:
                     cquery[obj_name] = cres
             # Send data
-            if cquery or is_query:
+            if is_query:
                 tmp = dict(template)
                 tmp['params'] = {'eventtime': eventtime, 'status': cquery}
                 send_func(tmp)
-        if not query:
+                continue
+            data = None
+            if cquery:
+                data = self.webhooks.encode_params(
+                    {'eventtime': eventtime, 'status': cquery})
+                if data is not None:
+                    cconn.send_encoded(template.build(data))
+            encoded[ekey] = data
+        if not self.clients:
             # Unregister timer if there are no longer any subscriptions
             reactor = self.printer.get_reactor()
             reactor.unregister_timer(self.query_timer)
             self.query_timer = None
+            self.status_cache.clear()
             return reactor.NEVER
         return eventtime + SUBSCRIPTION_REFRESH_TIME
     def _handle_query(self, web_request, is_subscribe=False):
@@ -533,9 +709,11 @@ class QueryStatusHelper:
         template = web_request.get_dict('response_template', {})
         if is_subscribe and cconn in self.clients:
             del self.clients[cconn]
+            self.resync_clients.discard(cconn)
         reactor = self.printer.get_reactor()
         complete = reactor.completion()
-        self.pending_queries.append((None, objects, complete.complete, {}))
+        self.pending_queries.append((None, objects, complete.complete, {},
+                                     None))
         # Start timer if needed
         if self.query_timer is None:
             qt = reactor.register_timer(self._do_query, reactor.NOW)
@@ -544,7 +722,10 @@ class QueryStatusHelper:
         msg = complete.wait()
         web_request.send(msg['params'])
         if is_subscribe:
-            self.clients[cconn] = (cconn, objects, cconn.send, template)
+            sub_key = tuple([(k, v if v is None else tuple(v))
+                             for k, v in sorted(objects.items())])
+            self.clients[cconn] = (cconn, objects, cconn.send,
+                                   ResponseTemplate(template), sub_key)
     def _handle_subscribe(self, web_request):
         self._handle_query(web_request, is_subscribe=True)
 
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Measure the size and cpu cost of encoding bulk sensor batches
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, random, time, json
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import webhooks
+from extras import bulk_sensor
+
+def build_batch(rate, interval, seed):
+    # Simulated accelerometer batch (time, x, y, z)
+    rnd = random.Random(seed)
+    count = int(rate * interval)
+    start = 3292.4
+    rows = [(start + i / rate, rnd.uniform(-2000., 2000.),
+             rnd.uniform(-2000., 2000.), rnd.uniform(-2000., 10000.))
+            for i in range(count)]
+    return {'data': rows, 'errors': 0, 'overflows': 0}
+
+def bench(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        out = func()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return len(out), best
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-r", "--rate", type="float", default=3200.,
+                    help="sensor sample rate")
+    opts.add_option("-n", "--repeat", type="int", default=50,
+                    help="number of runs (the best run is reported)")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    interval = bulk_sensor.BATCH_INTERVAL
+    msg = build_batch(options.rate, interval, 1)
+    fmt = '<dfff'
+    print("json codec: %s, %d rows per batch"
+          % (webhooks.json_codec, len(msg['data'])))
+    tests = [
+        ("json stdlib", lambda: webhooks._json_encode_std(msg)),
+        ("json codec", lambda: webhooks.json_encode(msg)),
+        ("binary stdlib", lambda: webhooks._json_encode_std(
+            bulk_sensor.pack_binary_batch(msg, fmt))),
+        ("binary codec", lambda: webhooks.json_encode(
+            bulk_sensor.pack_binary_batch(msg, fmt))),
+    ]
+    print("%-15s %12s %14s" % ("encoding", "bytes/s", "cpu ms/s"))
+    for name, func in tests:
+        size, duration = bench(func, options.repeat)
+        print("%-15s %12d %14.2f" % (name, size / interval,
+                                     duration / interval * 1000.))
+    # Request decoding
+    req = (b'{"id":1,"method":"objects/query","params":{"objects":'
+           b'{"toolhead":null,"extruder":["temperature","target"]}}}')
+    for name, func in (("decode stdlib", json.loads),
+                       ("decode codec", webhooks.json_decode)):
+        count = 20000
+        start = time.perf_counter()
+        for i in range(count):
+            func(req)
+        duration = time.perf_counter() - start
+        print("%-15s %9.2f us/request" % (name, duration / count * 1000000.))
+
+if __name__ == '__main__':
+    main()
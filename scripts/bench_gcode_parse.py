@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# Benchmark the G-Code line parser on a G-Code file
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import gcode
+
+def strip_line(line):
+    # Same comment handling as GCodeDispatch._process_commands()
+    line = line.strip()
+    cpos = line.find(';')
+    if cpos >= 0:
+        line = line[:cpos]
+    return line
+
+def parse_full(dispatch, lines):
+    # Parse every line with the regular expression based parser
+    parse_line = dispatch._parse_line
+    return [parse_line(line) for line in lines]
+
+def parse_fast(dispatch, lines):
+    # Parse lines the way GCodeDispatch._process_commands() does
+    parse_simple = dispatch._parse_simple
+    parse_cache = dispatch.parse_cache
+    out = []
+    for line in lines:
+        parsed = parse_simple(line)
+        if parsed is None:
+            parsed = parse_cache.get(line)
+            if parsed is None:
+                if len(parse_cache) >= gcode.PARSE_CACHE_SIZE:
+                    parse_cache.clear()
+                parsed = parse_cache[line] = dispatch._parse_line(line)
+            parsed = (parsed[0], dict(parsed[1]))
+        out.append(parsed)
+    return out
+
+def bench(func, lines, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(lines)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return len(lines) / best
+
+def main():
+    usage = "%prog [options] <gcode file>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-r", "--repeat", type="int", default=5,
+                    help="number of runs (the best run is reported)")
+    opts.add_option("-l", "--limit", type="int", default=0,
+                    help="only use the first LIMIT lines of the file")
+    options, args = opts.parse_args()
+    if len(args) != 1:
+        opts.error("Incorrect number of arguments")
+    with open(args[0], 'r') as f:
+        raw_lines = f.read().split('\n')
+    if options.limit:
+        raw_lines = raw_lines[:options.limit]
+    lines = [strip_line(line) for line in raw_lines]
+    # Build a dispatch object with just the parser state
+    dispatch = gcode.GCodeDispatch.__new__(gcode.GCodeDispatch)
+    dispatch.parse_cache = {}
+    # Check that both parsers agree
+    full = parse_full(dispatch, lines)
+    fast = parse_fast(dispatch, lines)
+    for line, f1, f2 in zip(lines, full, fast):
+        if f1 != f2:
+            print("Parser mismatch on %r: %s != %s" % (line, f1, f2))
+            sys.exit(1)
+    simple = len([l for l in lines if dispatch._parse_simple(l) is not None])
+    print("%d lines, %.1f%% on the fast path"
+          % (len(lines), 100. * simple / max(1, len(lines))))
+    # Time the parsers
+    dispatch.parse_cache.clear()
+    rate_full = bench(lambda l: parse_full(dispatch, l), lines,
+                      options.repeat)
+    dispatch.parse_cache.clear()
+    rate_fast = bench(lambda l: parse_fast(dispatch, l), lines,
+                      options.repeat)
+    rate_strip_full = bench(
+        lambda l: parse_full(dispatch, [strip_line(x) for x in l]),
+        raw_lines, options.repeat)
+    rate_strip_fast = bench(
+        lambda l: parse_fast(dispatch, [strip_line(x) for x in l]),
+        raw_lines, options.repeat)
+    print("parse only:        regex %9.0f lines/s  fast path %9.0f lines/s"
+          % (rate_full, rate_fast))
+    print("strip and parse:   regex %9.0f lines/s  fast path %9.0f lines/s"
+          % (rate_strip_full, rate_strip_fast))
+
+if __name__ == '__main__':
+    main()
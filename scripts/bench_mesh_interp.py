@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Check and time the bed_mesh interpolation of random probed meshes
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, random, time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+from extras import bed_mesh
+from bench_mesh_split import load_baseline
+
+# Probe counts and mesh_pps values checked for each algorithm
+PARITY_CASES = {
+    'lagrange': [(3, 3), (4, 4), (5, 3), (6, 6)],
+    'bicubic': [(4, 4), (5, 5), (6, 6), (7, 5), (15, 15)],
+}
+PARITY_PPS = [(0, 2), (1, 1), (2, 2), (3, 1), (4, 4)]
+TIMING_CASES = [('bicubic', 15, 4), ('bicubic', 7, 3),
+                ('lagrange', 6, 4), ('lagrange', 5, 2)]
+
+def make_params(rnd, algo, x_count, y_count, pps):
+    return {'min_x': rnd.uniform(0., 40.), 'max_x': rnd.uniform(200., 250.),
+            'min_y': rnd.uniform(0., 40.), 'max_y': rnd.uniform(180., 230.),
+            'x_count': x_count, 'y_count': y_count,
+            'mesh_x_pps': pps[0], 'mesh_y_pps': pps[1],
+            'algo': algo, 'tension': rnd.uniform(0., 1.)}
+
+def make_mesh(mod, params, probed, use_numpy=True):
+    zmesh = mod.ZMesh(params, "bench")
+    if not use_numpy:
+        zmesh.numpy = False
+    zmesh.build_mesh([list(row) for row in probed])
+    return zmesh
+
+def compare(zmesh, ref):
+    if len(zmesh.mesh_matrix) != len(ref.mesh_matrix):
+        return None
+    diff = 0.
+    for row, ref_row in zip(zmesh.mesh_matrix, ref.mesh_matrix):
+        if len(row) != len(ref_row):
+            return None
+        for z, ref_z in zip(row, ref_row):
+            diff = max(diff, abs(z - ref_z))
+    return diff
+
+def check_parity(mods, rnd):
+    worst = 0.
+    for algo, counts in sorted(PARITY_CASES.items()):
+        for x_count, y_count in counts:
+            for pps in PARITY_PPS:
+                params = make_params(rnd, algo, x_count, y_count, pps)
+                probed = [[rnd.uniform(-.5, .5) for i in range(x_count)]
+                          for j in range(y_count)]
+                ref = make_mesh(bed_mesh, params, probed)
+                others = [make_mesh(bed_mesh, params, probed, False)]
+                others += [make_mesh(mod, params, probed)
+                           for name, mod in mods[1:]]
+                for zmesh in [ref] + others:
+                    # Probed points must be carried through unchanged
+                    for j in range(y_count):
+                        for i in range(x_count):
+                            z = zmesh.mesh_matrix[j * ref.y_mult][
+                                i * ref.x_mult]
+                            if z != probed[j][i]:
+                                return "%s %dx%d pps %s: probed point" \
+                                    " changed" % (algo, x_count, y_count,
+                                                  pps), worst
+                for zmesh in others:
+                    diff = compare(zmesh, ref)
+                    if diff is None or diff > 1e-9:
+                        return "%s %dx%d pps %s: mesh mismatch (%s)" % (
+                            algo, x_count, y_count, pps, diff), worst
+                    worst = max(worst, diff)
+    return None, worst
+
+def bench(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-r", "--repeat", type="int", default=20,
+                    help="number of runs (the best run is reported)")
+    opts.add_option("-s", "--seed", type="int", default=1,
+                    help="random seed")
+    opts.add_option("-b", "--baseline", type="string", default=None,
+                    help="also check and time bed_mesh.py from this"
+                    " git revision")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    rnd = random.Random(options.seed)
+    mods = [("current", bed_mesh)]
+    if options.baseline:
+        mods.append((options.baseline, load_baseline(options.baseline)))
+    has_numpy = bed_mesh.ZMesh(make_params(rnd, 'lagrange', 3, 3, (1, 1)),
+                               "check").get_numpy() is not None
+    # Check that all implementations build the same mesh
+    err, worst = check_parity(mods, rnd)
+    if err is not None:
+        print("Parity check failed: %s" % (err,))
+        sys.exit(1)
+    print("Parity check passed (numpy %s), largest difference %.3g"
+          % ("available" if has_numpy else "not available", worst))
+    # Time the interpolation
+    names = ["python"]
+    if has_numpy:
+        names.insert(0, "numpy")
+    names += [name for name, mod in mods[1:]]
+    print("%-24s" % ("interpolation",)
+          + "".join(["%12s" % (name,) for name in names]))
+    for algo, count, pps in TIMING_CASES:
+        params = make_params(rnd, algo, count, count, (pps, pps))
+        probed = [[rnd.uniform(-.5, .5) for i in range(count)]
+                  for j in range(count)]
+        zmeshes = [make_mesh(bed_mesh, params, probed, False)]
+        if has_numpy:
+            zmeshes.insert(0, make_mesh(bed_mesh, params, probed))
+        zmeshes += [make_mesh(mod, params, probed) for name, mod in mods[1:]]
+        times = [bench(lambda: zmesh._sample(probed), options.repeat)
+                 for zmesh in zmeshes]
+        print("%-24s" % ("%s %dx%d pps %d" % (algo, count, count, pps),)
+              + "".join(["%10.2fms" % (t * 1000.,) for t in times]))
+
+if __name__ == '__main__':
+    main()
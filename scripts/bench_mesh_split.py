@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Benchmark the bed_mesh move splitter on a synthetic mesh and moves
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, random, time, subprocess, importlib.util
+KLIPPY_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                          '..', 'klippy')
+sys.path.append(KLIPPY_DIR)
+from extras import bed_mesh
+
+# Minimal config object providing the [bed_mesh] splitter options
+class SplitterConfig:
+    def __init__(self, split_delta_z):
+        self.split_delta_z = split_delta_z
+    def getfloat(self, option, default=None, **kw):
+        if option == 'split_delta_z':
+            return self.split_delta_z
+        return default
+    def deprecate(self, option, value=None):
+        pass
+
+def load_baseline(rev):
+    # Load bed_mesh.py from a git revision as a module of the extras package
+    src = subprocess.check_output(
+        ['git', 'show', '%s:klippy/extras/bed_mesh.py' % (rev,)],
+        cwd=KLIPPY_DIR)
+    spec = importlib.util.spec_from_loader('extras.bed_mesh_baseline',
+                                           loader=None)
+    mod = importlib.util.module_from_spec(spec)
+    mod.__package__ = 'extras'
+    exec(compile(src, 'bed_mesh.py@%s' % (rev,), 'exec'), mod.__dict__)
+    return mod
+
+def build_mesh(mod, options, rnd):
+    cnt = options.probe_count
+    params = {'min_x': 10., 'max_x': 290., 'min_y': 10., 'max_y': 290.,
+              'x_count': cnt, 'y_count': cnt,
+              'mesh_x_pps': options.pps, 'mesh_y_pps': options.pps,
+              'algo': options.algo, 'tension': .2}
+    amp = options.amplitude
+    probed = [[rnd.uniform(-amp, amp) for i in range(cnt)]
+              for j in range(cnt)]
+    zmesh = mod.ZMesh(params, "bench")
+    zmesh.build_mesh(probed)
+    return zmesh
+
+def build_moves(options, rnd):
+    # Long diagonal moves across the bed
+    moves = []
+    for i in range(options.moves):
+        if i % 2:
+            start = (5., rnd.uniform(5., 295.))
+            end = (295., rnd.uniform(5., 295.))
+        else:
+            start = (rnd.uniform(5., 295.), 5.)
+            end = (rnd.uniform(5., 295.), 295.)
+        moves.append(([start[0], start[1], 0.2, 0.],
+                      [end[0], end[1], 0.2, 1.]))
+    return moves
+
+def run_splitter(mod, zmesh, moves, split_delta_z):
+    splitter = mod.MoveSplitter(SplitterConfig(split_delta_z), None)
+    splitter.initialize(zmesh, 0.)
+    out = []
+    for prev_pos, next_pos in moves:
+        splitter.build_move(prev_pos, next_pos, 1.)
+        segs = [tuple(prev_pos)]
+        while not splitter.traverse_complete:
+            segs.append(tuple(splitter.split()))
+        out.append(segs)
+    return out
+
+def calc_max_error(zmesh, results, samples=16):
+    # Largest distance between a queued move and the mesh surface
+    max_err = 0.
+    for segs in results:
+        prev = segs[0]
+        prev_z = prev[2] + zmesh.calc_z(prev[0], prev[1])
+        for seg in segs[1:]:
+            for i in range(1, samples):
+                t = float(i) / samples
+                x = prev[0] + (seg[0] - prev[0]) * t
+                y = prev[1] + (seg[1] - prev[1]) * t
+                z = prev_z + (seg[2] - prev_z) * t
+                max_err = max(max_err, abs(z - 0.2 - zmesh.calc_z(x, y)))
+            prev, prev_z = seg, seg[2]
+    return max_err
+
+def bench(mod, options):
+    rnd = random.Random(options.seed)
+    zmesh = build_mesh(mod, options, rnd)
+    moves = build_moves(options, rnd)
+    best = None
+    for i in range(options.repeat):
+        start = time.perf_counter()
+        results = run_splitter(mod, zmesh, moves, options.split_delta_z)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    segments = sum([len(segs) - 1 for segs in results])
+    return best, segments, calc_max_error(zmesh, results)
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-c", "--probe_count", type="int", default=15,
+                    help="probe points per axis")
+    opts.add_option("-p", "--pps", type="int", default=4,
+                    help="mesh points per segment")
+    opts.add_option("-a", "--amplitude", type="float", default=0.02,
+                    help="range (+/-) of the random probe points")
+    opts.add_option("--algo", type="string", default="bicubic",
+                    help="interpolation algorithm")
+    opts.add_option("-m", "--moves", type="int", default=400,
+                    help="number of diagonal moves")
+    opts.add_option("-z", "--split_delta_z", type="float", default=.025,
+                    help="split_delta_z setting")
+    opts.add_option("-r", "--repeat", type="int", default=7,
+                    help="number of runs (the best run is reported)")
+    opts.add_option("-s", "--seed", type="int", default=1,
+                    help="random seed")
+    opts.add_option("-b", "--baseline", type="string", default=None,
+                    help="also run bed_mesh.py from this git revision")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    mods = [("current", bed_mesh)]
+    if options.baseline:
+        mods.insert(0, (options.baseline, load_baseline(options.baseline)))
+    print("%dx%d mesh (pps %d), %d moves, split_delta_z %.3f"
+          % (options.probe_count, options.probe_count, options.pps,
+             options.moves, options.split_delta_z))
+    print("%-12s %10s %10s %12s" % ("version", "time ms", "segments",
+                                   "max error"))
+    for name, mod in mods:
+        duration, segments, max_err = bench(mod, options)
+        print("%-12s %10.1f %10d %12.4f" % (name, duration * 1000.,
+                                            segments, max_err))
+
+if __name__ == '__main__':
+    main()
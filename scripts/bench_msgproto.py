@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Benchmark message parsing over a captured serial data dump
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import msgproto
+
+def read_blocks(mp, filename):
+    # Split a serial data dump into message blocks (as parsedump.py does)
+    with open(filename, 'rb') as f:
+        data = bytearray(f.read())
+    blocks = []
+    errors = 0
+    while 1:
+        l = mp.check_packet(data)
+        if l == 0:
+            break
+        if l < 0:
+            errors += 1
+            data = data[-l:]
+            continue
+        blocks.append(bytes(data[:l]))
+        data = data[l:]
+    return blocks, errors
+
+def parse_generic(mid, s, pos):
+    # Parameter by parameter decoding (the code prior to compile_parser)
+    pos += len(mid.msgid_bytes)
+    out = {}
+    for name, t in mid.param_names:
+        v, pos = t.parse(s, pos)
+        out[name] = v
+    return out, pos
+
+def parse_blocks(mp, blocks, parse_func):
+    # Parse every message of every block
+    msgid_parse = mp.msgid_parser.parse
+    messages_by_id = mp.messages_by_id
+    out = []
+    for s in blocks:
+        pos = msgproto.MESSAGE_HEADER_SIZE
+        end = len(s) - msgproto.MESSAGE_TRAILER_SIZE
+        while pos < end:
+            msgid, param_pos = msgid_parse(s, pos)
+            mid = messages_by_id.get(msgid, mp.unknown)
+            params, pos = parse_func(mid, s, pos)
+            params['#name'] = mid.name
+            out.append(params)
+    return out
+
+def bench(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+def main():
+    usage = "%prog [options] <data dictionary> <serial data dump>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-r", "--repeat", type="int", default=20,
+                    help="number of runs (the best run is reported)")
+    options, args = opts.parse_args()
+    if len(args) != 2:
+        opts.error("Incorrect number of arguments")
+    with open(args[0], 'rb') as f:
+        dictionary = f.read()
+    mp = msgproto.MessageParser()
+    mp.process_identify(dictionary, decompress=False)
+    blocks, errors = read_blocks(mp, args[1])
+    compiled = (lambda mid, s, pos: mid.parse(s, pos))
+    # Check that both decoders agree
+    msgs = parse_blocks(mp, blocks, compiled)
+    if msgs != parse_blocks(mp, blocks, parse_generic):
+        print("Parser mismatch")
+        sys.exit(1)
+    counts = {}
+    for params in msgs:
+        counts[params['#name']] = counts.get(params['#name'], 0) + 1
+    print("%d blocks (%d resyncs on invalid data), %d messages"
+          % (len(blocks), errors, len(msgs)))
+    for name, count in sorted(counts.items(), key=lambda i: -i[1])[:5]:
+        print("  %6d %s" % (count, name))
+    # Time the decoders
+    for name, func in (("per parameter", parse_generic),
+                       ("compiled", compiled)):
+        duration = bench(lambda: parse_blocks(mp, blocks, func),
+                         options.repeat)
+        print("%-14s %6.2f us/msg" % (name,
+                                      duration / max(1, len(msgs)) * 1000000.))
+
+if __name__ == '__main__':
+    main()
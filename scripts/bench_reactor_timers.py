@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# Measure reactor timer dispatch overhead versus the number of timers
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, random, time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import reactor
+
+def bench_timers(count, duration, step, seed):
+    # One timer is due every pass, the others re-arm 0.1 to 1.1s out
+    r = reactor.SelectReactor()
+    rnd = random.Random(seed)
+    for i in range(count - 1):
+        period = 0.1 + rnd.random()
+        r.register_timer((lambda et, p=period: et + p), rnd.random())
+    r.register_timer((lambda et: et + step), 0.)
+    eventtime = 0.
+    total = 0.
+    passes = 0
+    while eventtime < duration:
+        if eventtime >= r._next_timer:
+            start = time.perf_counter()
+            r._check_timers(eventtime, False)
+            total += time.perf_counter() - start
+            passes += 1
+        else:
+            r._check_timers(eventtime, False)
+        eventtime += step
+    return total / max(1, passes), passes
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-c", "--counts", type="string",
+                    default="5,10,25,50,100,200",
+                    help="comma separated list of timer counts")
+    opts.add_option("-d", "--duration", type="float", default=30.,
+                    help="simulated time in seconds")
+    opts.add_option("-s", "--step", type="float", default=0.001,
+                    help="simulated time between reactor passes")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    counts = [int(c) for c in options.counts.split(',')]
+    print("%8s %14s %10s" % ("timers", "us/dispatch", "passes"))
+    for count in counts:
+        per_pass, passes = bench_timers(count, options.duration,
+                                        options.step, 1)
+        print("%8d %14.2f %10d" % (count, per_pass * 1000000., passes))
+
+if __name__ == '__main__':
+    main()